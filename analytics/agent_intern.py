@@ -0,0 +1,73 @@
+"""
+Справочник окружений хитов (модель Agent): браузер, ОС, размер экрана и тип устройства.
+Разных наборов на версию - сотни, хитов - миллионы, поэтому хит хранит один agent_id
+вместо пяти колонок. Наборы превращаются в id при загрузке батча так же, как URL
+в url_intern.py: новые добавляются одним bulk_create, известные берутся из кэша процесса.
+"""
+import json
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+
+from analytics.models import Agent
+
+# Порядок значений в наборе и в ключе Agent.key
+AGENT_FIELDS = ('browser', 'os', 'screen_width', 'screen_height', 'device_category')
+# Размер IN (...) при поиске по key: SQLite ограничивает число параметров запроса
+LOOKUP_CHUNK = 1000
+
+# набор значений -> id. Справочник только пополняется, поэтому кэш процесса не устаревает
+_agent_ids: Dict[Tuple, int] = {}
+
+
+def agent_key(values: Tuple) -> str:
+    """Уникальный ключ набора: JSON-список значений в порядке AGENT_FIELDS."""
+    return json.dumps(list(values), ensure_ascii=False)
+
+
+def _lookup(keys: List[str]) -> Dict[str, int]:
+    found = {}
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        found.update(Agent.objects.filter(key__in=keys[start:start + LOOKUP_CHUNK]).values_list('key', 'id'))
+    return found
+
+
+def intern_agents(agents: Iterable[Tuple]) -> Dict[Tuple, int]:
+    """
+    {набор: id} для всех наборов (кортежи значений AGENT_FIELDS); отсутствующие добавляются.
+    Параллельные писатели не мешают друг другу: вставка с ignore_conflicts, id перечитываются.
+    """
+    wanted = set(agents)
+    missing = {agent_key(agent): agent for agent in wanted if agent not in _agent_ids}
+    if missing:
+        found = _lookup(list(missing))
+        new = [key for key in missing if key not in found]
+        if new:
+            Agent.objects.bulk_create(
+                [Agent(key=key, **dict(zip(AGENT_FIELDS, missing[key]))) for key in new],
+                batch_size=LOOKUP_CHUNK, ignore_conflicts=True,
+            )
+            found.update(_lookup(new))
+        found = {missing[key]: pk for key, pk in found.items()}
+        if connection.in_atomic_block:
+            # Транзакция еще может откатиться - новые id в кэш процесса не кладем
+            return {agent: _agent_ids.get(agent) or found[agent] for agent in wanted}
+        _agent_ids.update(found)
+    return {agent: _agent_ids[agent] for agent in wanted}
+
+
+def agent_ids(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Забирает из columns колонки AGENT_FIELDS (значения - str/int или None)
+    и возвращает массив id справочника (int64), по одному обращению на уникальный набор.
+    """
+    agents = pd.Series(list(zip(*(columns.pop(field).tolist() for field in AGENT_FIELDS))), dtype=object)
+    codes, uniques = pd.factorize(agents)
+    mapping = intern_agents(uniques.tolist())
+    ids = np.array([mapping[agent] for agent in uniques], dtype=np.int64)
+    return ids[codes]
+
+
+__all__ = ['AGENT_FIELDS', 'agent_key', 'intern_agents', 'agent_ids']
@@ -0,0 +1,39 @@
+"""
+SQL-агрегаты, которых нет в django.db.models.
+"""
+from django.db import connection
+from django.db.models import Aggregate, Count, QuerySet
+
+
+class Mode(Aggregate):
+    """
+    Самое частое значение в группе: mode() WITHIN GROUP (ORDER BY ...) - только PostgreSQL.
+    При равных частотах PostgreSQL берет меньшее значение (как и group_modes ниже). NULL игнорируются.
+    """
+    function = 'MODE'
+    name = 'Mode'
+    template = '%(function)s() WITHIN GROUP (ORDER BY %(expressions)s)'
+
+
+def supports_mode(conn=None) -> bool:
+    return (conn or connection).vendor == 'postgresql'
+
+
+def group_modes(queryset: QuerySet, group_field: str, value_field: str) -> dict:
+    """
+    Запасной путь для СУБД без mode(): {группа: самое частое непустое значение}
+    из одного GROUP BY (группа, значение) с подсчетом; при равенстве - меньшее значение.
+    """
+    counts = (
+        queryset.exclude(**{f'{value_field}__isnull': True}).exclude(**{value_field: ''})
+        .values_list(group_field, value_field).annotate(n=Count('id'))
+    )
+    best = {}
+    for group, value, n in counts:
+        current = best.get(group)
+        if current is None or n > current[1] or (n == current[1] and value < current[0]):
+            best[group] = (value, n)
+    return {group: value for group, (value, _) in best.items()}
+
+
+__all__ = ['Mode', 'supports_mode', 'group_modes']
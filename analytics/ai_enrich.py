@@ -0,0 +1,97 @@
+"""
+Конкурентное обогащение проблем AI-гипотезами после детекции.
+Запросы к LLM идут из пула потоков с ограничением параллельности, частоты (token bucket)
+и общего дедлайна: время анализа больше не растет как число проблем × задержка LLM.
+Не успевшие к дедлайну проблемы остаются с заглушкой (их потом подхватит refresh_ai).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, List, Optional
+
+# Запросов в секунду (0 - без ограничения) и запас токенов (всплеск) для ограничителя частоты
+AI_RATE_PER_SECOND = float(os.environ.get("AI_RATE_PER_SECOND", "5"))
+AI_BURST = int(os.environ.get("AI_BURST", "5"))
+# Одновременных запросов к LLM
+AI_CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", "4"))
+# Общий дедлайн обогащения, секунд
+AI_DEADLINE_SECONDS = float(os.environ.get("AI_DEADLINE_SECONDS", "120"))
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate токенов в секунду, не больше burst в запасе."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline: float) -> bool:
+        """Ждет токен до момента deadline (time.monotonic); False - не дождались."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                if self.rate <= 0:
+                    return False
+                wait_for = (1 - self.tokens) / self.rate
+            if now + wait_for > deadline:
+                return False
+            time.sleep(max(0.0, wait_for))
+
+
+def enrich_concurrently(
+    requests: List[dict],
+    func: Callable[..., str],
+    rate: float = None,
+    burst: int = None,
+    concurrency: int = None,
+    deadline: float = None,
+) -> List[Optional[str]]:
+    """
+    Вызывает func(**kwargs) для каждого словаря requests в пуле потоков.
+    rate <= 0 отключает ограничение частоты (остаются concurrency и deadline).
+    Возвращает результаты в порядке requests; None - запрос не уложился в дедлайн
+    (или упал), вызывающий оставляет для него заглушку.
+    """
+    if not requests:
+        return []
+    rate = AI_RATE_PER_SECOND if rate is None else rate
+    burst = AI_BURST if burst is None else burst
+    concurrency = AI_CONCURRENCY if concurrency is None else concurrency
+    deadline = AI_DEADLINE_SECONDS if deadline is None else deadline
+
+    until = time.monotonic() + deadline
+    bucket = TokenBucket(rate, burst) if rate > 0 else None
+
+    def call(kwargs):
+        if bucket is not None and not bucket.acquire(until):
+            return None
+        return func(**kwargs)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='ai-enrich')
+    futures = [executor.submit(call, kwargs) for kwargs in requests]
+    wait(futures, timeout=max(0.0, until - time.monotonic()))
+    # Незапущенные задачи отменяются; уже идущие запросы дорабатывают в фоне (их ограничивает timeout HTTP)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for future in futures:
+        if future.done() and not future.cancelled() and future.exception() is None:
+            results.append(future.result())
+        else:
+            results.append(None)
+    return results
+
+
+__all__ = [
+    'AI_BURST', 'AI_CONCURRENCY', 'AI_DEADLINE_SECONDS', 'AI_RATE_PER_SECOND',
+    'TokenBucket', 'enrich_concurrently',
+]
@@ -42,9 +42,13 @@ STUB_TEMPLATES = {
     'SEARCH_FAIL': "Гипотеза: Результаты поиска нерелевантны или пустые. Исправить: добавить подсказки/популярные запросы и ссылки на целевые разделы.",
 }
 
+def ai_configured():
+    """Есть ли креды и requests для запросов к YandexGPT (иначе AI-функции отдают заглушки)."""
+    return bool(FOLDER_ID and API_KEY and requests is not None)
+
 def _send_gpt_request(system_text, user_text):
     """Helper to send request to YandexGPT"""
-    if not FOLDER_ID or not API_KEY or requests is None:
+    if not ai_configured():
         return None
 
     url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
@@ -0,0 +1,78 @@
+"""
+Загрузка из БД тех же DataFrame, которые эвристики и кластеризация получают при ingest.
+Колонки названы как в выгрузке Метрики (ym:s:*, ym:pv:*), clientID - int64-ключи,
+поэтому run_analysis/segment_users_into_cohorts работают без перечитывания Parquet.
+Хиты читаются из колоночного снимка версии (hit_snapshot.py), если он есть.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from analytics.ingest_utils import ANALYSIS_HIT_COLUMNS, ANALYSIS_VISIT_COLUMNS, normalize_client_ids
+from analytics.hit_snapshot import column, read_hits, url_values
+from analytics.models import PageHit, VisitSession
+
+# Поле модели -> колонка выгрузки
+VISIT_COLUMN_MAP = {
+    'visit_id': 'ym:s:visitID',
+    'client_id': 'ym:s:clientID',
+    'duration_sec': 'ym:s:visitDuration',
+    'bounced': 'ym:s:bounce',
+    'page_views': 'ym:s:pageViews',
+    'goals_id': 'ym:s:goalsID',
+    'entry_page': 'ym:s:startURL',
+}
+HIT_COLUMN_MAP = {
+    'session__client_id': 'ym:pv:clientID',
+    'timestamp': 'ym:pv:dateTime',
+    'url__raw': 'ym:pv:URL',
+}
+
+
+def _frame(queryset, column_map) -> pd.DataFrame:
+    rows = list(queryset.values_list(*column_map.keys()).iterator(chunk_size=50000))
+    return pd.DataFrame(rows, columns=list(column_map.values()))
+
+
+def load_visits_frame(version) -> pd.DataFrame:
+    """Визиты версии в колонках ANALYSIS_VISIT_COLUMNS."""
+    df = _frame(VisitSession.objects.filter(version=version).order_by('id'), VISIT_COLUMN_MAP)
+    df['ym:s:bounce'] = df['ym:s:bounce'].astype(int)
+    df['ym:s:clientID'] = normalize_client_ids(df['ym:s:clientID'])
+    df['client_id_norm'] = df['ym:s:clientID']
+    return df[list(ANALYSIS_VISIT_COLUMNS)]
+
+
+def _snapshot_hits_frame(version) -> Optional[pd.DataFrame]:
+    """Хиты из снимка в порядке id (как из БД) или None, если снимка нет."""
+    table = read_hits(version.id, ['id', 'client_id', 'timestamp', 'url_id'])
+    if table is None:
+        return None
+    order = np.argsort(column(table, 'id'), kind='stable')
+    url_ids = column(table, 'url_id')[order]
+    raw_urls = url_values(url_ids, 'raw')
+    return pd.DataFrame({
+        'ym:pv:clientID': column(table, 'client_id')[order],
+        'ym:pv:dateTime': pd.to_datetime(column(table, 'timestamp')[order], utc=True),
+        'ym:pv:URL': [raw_urls.get(url_id) for url_id in url_ids.tolist()],
+    })
+
+
+def load_hits_frame(version) -> pd.DataFrame:
+    """Хиты версии в колонках ANALYSIS_HIT_COLUMNS."""
+    df = _snapshot_hits_frame(version)
+    if df is None:
+        df = _frame(PageHit.objects.filter(version=version).order_by('id'), HIT_COLUMN_MAP)
+    df['ym:pv:dateTime'] = pd.to_datetime(df['ym:pv:dateTime'], utc=True)
+    df['ym:pv:clientID'] = normalize_client_ids(df['ym:pv:clientID'])
+    df['client_id_norm'] = df['ym:pv:clientID']
+    return df[list(ANALYSIS_HIT_COLUMNS)]
+
+
+def load_analysis_frames(version) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """(df_visits, df_hits) для эвристик и кластеризации."""
+    return load_visits_frame(version), load_hits_frame(version)
+
+
+__all__ = ['VISIT_COLUMN_MAP', 'HIT_COLUMN_MAP', 'load_visits_frame', 'load_hits_frame', 'load_analysis_frames']
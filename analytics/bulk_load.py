@@ -0,0 +1,112 @@
+"""
+Массовая загрузка строк в таблицы аналитики.
+На PostgreSQL (psycopg3) строки идут через COPY FROM STDIN во временную UNLOGGED-таблицу
+и затем одним INSERT ... SELECT переносятся в целевую. На остальных СУБД - bulk_create.
+"""
+import json
+import os
+import threading
+from typing import Iterable, Optional, Sequence
+
+from django.db import connection, models, transaction
+
+
+def supports_copy(conn=None) -> bool:
+    """True, если соединение - PostgreSQL через psycopg3 (у курсора есть copy())."""
+    conn = conn or connection
+    if conn.vendor != 'postgresql':
+        return False
+    return getattr(conn.Database, '__name__', '') == 'psycopg'
+
+
+def _columns(model, fields: Sequence[str]):
+    return [model._meta.get_field(name).column for name in fields]
+
+
+def _json_positions(model, fields: Sequence[str]):
+    return [
+        idx for idx, name in enumerate(fields)
+        if isinstance(model._meta.get_field(name), models.JSONField)
+    ]
+
+
+def copy_rows(model, fields: Sequence[str], rows: Iterable[tuple],
+              conflict_fields: Optional[Sequence[str]] = None, conn=None) -> int:
+    """
+    Загружает кортежи rows (в порядке fields) через COPY в staging-таблицу
+    и переносит их в таблицу модели. Возвращает число вставленных строк.
+    При conflict_fields конфликты по ним пропускаются (аналог ignore_conflicts).
+    """
+    conn = conn or connection
+    qn = conn.ops.quote_name
+    table = model._meta.db_table
+    # Своя staging-таблица на процесс и поток: параллельные писатели не мешают друг другу
+    staging = f"{table}_stage_{os.getpid()}_{threading.get_native_id()}"
+    cols = ", ".join(qn(c) for c in _columns(model, fields))
+    json_idx = _json_positions(model, fields)
+
+    def prepared():
+        for row in rows:
+            if json_idx:
+                row = list(row)
+                for idx in json_idx:
+                    if row[idx] is not None:
+                        row[idx] = json.dumps(row[idx])
+            yield row
+
+    on_conflict = ""
+    if conflict_fields:
+        conflict_cols = ", ".join(qn(c) for c in _columns(model, conflict_fields))
+        on_conflict = f" ON CONFLICT ({conflict_cols}) DO NOTHING"
+
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {qn(staging)}")
+        cursor.execute(
+            f"CREATE UNLOGGED TABLE {qn(staging)} AS SELECT {cols} FROM {qn(table)} WITH NO DATA"
+        )
+        with cursor.copy(f"COPY {qn(staging)} ({cols}) FROM STDIN") as copy:
+            for row in prepared():
+                copy.write_row(row)
+        cursor.execute(
+            f"INSERT INTO {qn(table)} ({cols}) SELECT {cols} FROM {qn(staging)}{on_conflict}"
+        )
+        inserted = cursor.rowcount
+        cursor.execute(f"DROP TABLE {qn(staging)}")
+    return inserted
+
+
+def save_rows(model, fields: Sequence[str], rows: Sequence[tuple], use_copy: bool = True,
+              ignore_conflicts: bool = False, conflict_fields: Optional[Sequence[str]] = None,
+              batch_size: int = 5000, **extra) -> int:
+    """
+    Сохраняет строки в таблицу модели: COPY на PostgreSQL, bulk_create в остальных случаях.
+    extra - постоянные значения полей (например, version=...) для пути через ORM.
+    """
+    if not rows:
+        return 0
+    if use_copy and supports_copy():
+        constants = {
+            f"{name}_id" if isinstance(value, models.Model) else name:
+            value.pk if isinstance(value, models.Model) else value
+            for name, value in extra.items()
+        }
+        # Django-дефолты (is_exit=False и т.п.) не существуют на уровне БД - подставляем сами
+        for field in model._meta.concrete_fields:
+            if field.primary_key or field.attname in constants or field.name in constants:
+                continue
+            if field.attname in fields or field.name in fields:
+                continue
+            if field.has_default():
+                constants[field.attname] = field.get_default()
+        if constants:
+            fields = tuple(constants) + tuple(fields)
+            const_values = tuple(constants.values())
+            rows = [const_values + tuple(row) for row in rows]
+        return copy_rows(model, fields, rows, conflict_fields=conflict_fields if ignore_conflicts else None)
+
+    objects = [model(**extra, **dict(zip(fields, row))) for row in rows]
+    model.objects.bulk_create(objects, batch_size=batch_size, ignore_conflicts=ignore_conflicts)
+    return len(objects)
+
+
+__all__ = ['supports_copy', 'copy_rows', 'save_rows']
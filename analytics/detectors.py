@@ -0,0 +1,553 @@
+"""
+Реестр детекторов UX-проблем для run_analysis.
+Каждый детектор - класс с объявленными входами (hits - кадр build_hit_frame, visits - визиты
+с norm_start_url, page_metrics - PageMetricsIndex версии), порогами и зависимостями (after).
+Детектор только находит проблемы (Finding); метрики страниц, динамику, AI-гипотезу и UXIssue
+достраивает команда. Независимые детекторы выполняются параллельно в пуле процессов.
+Модуль импортируется в дочернем процессе (spawn) до настройки Django,
+поэтому здесь нет импортов моделей.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from analytics.hit_frame import SESSION_GAP_SECONDS, session_groups, top_counts, top_norm_urls
+from analytics.nav_loops import TOP_LOOPS, find_navigation_loops
+from analytics.utils import normalize_issue_url
+
+MIN_PAGE_VIEWS_FOR_PAGE_ALERT = int(os.environ.get("MIN_PAGE_VIEWS_FOR_PAGE_ALERT", "30"))
+MIN_WANDERING_SESSIONS = int(os.environ.get("MIN_WANDERING_SESSIONS", "5"))
+# Процессов пула по умолчанию; 1 - детекторы выполняются последовательно в текущем процессе
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "1"))
+
+# Поле PageMetrics для ключа page_metrics в контексте AI
+PAGE_METRIC_FIELDS = {
+    'avg_time': 'avg_time_on_page',
+    'exit_rate': 'exit_rate',
+    'scroll_depth': 'avg_scroll_depth',
+}
+
+
+@dataclass
+class Finding:
+    """
+    Найденная проблема до обогащения.
+    page_urls - адреса для поиска страницы в PageMetricsIndex.find, ai_fields - какие метрики
+    найденной страницы передать AI, ai_metrics - готовые значения (вместе с найденной страницей).
+    tracked - считать trend/priority/специалистов; target_url - страница, которую покрывает проблема.
+    """
+    issue_type: str
+    severity: str
+    location_url: str
+    description: str
+    metrics_context: str
+    affected_sessions: int
+    impact_score: float
+    page_urls: Tuple[str, ...] = ()
+    ai_fields: Tuple[str, ...] = ()
+    ai_metrics: Optional[dict] = None
+    tracked: bool = False
+    specialists_type: Optional[str] = None
+    target_url: Optional[str] = None
+
+
+def pick_representative_url(df: pd.DataFrame, norm_column: str, norm_value: str) -> str:
+    """Return the most frequent raw URL for a normalized value to fetch PageMetrics."""
+    subset = df[df[norm_column] == norm_value]['ym:pv:URL'].dropna()
+    if subset.empty:
+        return norm_value
+    return subset.mode().iloc[0]
+
+
+class Detector:
+    """Базовый детектор: name совпадает с UXIssue.issue_type."""
+    name = ''
+    inputs: Tuple[str, ...] = ('hits',)
+    # Детекторы, чьи результаты нужны этому (передаются в detect как upstream)
+    after: Tuple[str, ...] = ()
+    thresholds: Dict[str, object] = {}
+
+    def detect(self, data: dict, upstream: Dict[str, List[Finding]]) -> List[Finding]:
+        raise NotImplementedError
+
+
+# name -> класс детектора в порядке регистрации (он же порядок проблем в результате)
+DETECTORS: Dict[str, type] = {}
+
+
+def register(cls):
+    """Декоратор класса: добавляет детектор в реестр; зависимости должны быть зарегистрированы раньше."""
+    missing = [name for name in cls.after if name not in DETECTORS]
+    if missing:
+        raise ValueError(f"{cls.name}: register {', '.join(missing)} first")
+    DETECTORS[cls.name] = cls
+    return cls
+
+
+@register
+class RageClickDetector(Detector):
+    name = 'RAGE_CLICK'
+    thresholds = {'max_interval_sec': 2, 'top': 5}
+
+    def detect(self, data, upstream):
+        hits = data['hits']
+        rage_clicks = hits[
+            (hits['time_diff'] < self.thresholds['max_interval_sec']) &
+            (hits['url_code'] >= 0) &
+            (hits['url_code'] == hits['prev_url_code'])
+        ]
+        findings = []
+        if rage_clicks.empty:
+            return findings
+        for norm_url, count in top_norm_urls(rage_clicks, self.thresholds['top']).items():
+            if not norm_url:
+                continue
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='WARNING',
+                location_url=norm_url,
+                description=f"Обнаружены {count} быстрых повторных кликов/перезагрузок на странице.",
+                metrics_context=f"Количество событий: {count}",
+                affected_sessions=int(count),
+                impact_score=min(count * 0.1, 10.0),
+                page_urls=(pick_representative_url(rage_clicks, 'norm_url', norm_url), norm_url),
+                ai_fields=('avg_time',),
+                tracked=True,
+            ))
+        return findings
+
+
+@register
+class LoopingDetector(Detector):
+    name = 'LOOPING'
+    # Клиент заходит на страницу больше repeats раз
+    thresholds = {'repeats': 3, 'top': 5}
+
+    def detect(self, data, upstream):
+        hits = data['hits']
+        loop_hits = hits[(hits['norm_url'] != "") & (hits['client'] >= 0)]
+        loop_counts = loop_hits.groupby(['client', loop_hits['norm_url'].cat.codes.rename('norm_code')]).size()
+        loops = loop_counts[loop_counts > self.thresholds['repeats']]
+        findings = []
+        if loops.empty:
+            return findings
+        loop_urls = top_counts(loops.index.get_level_values('norm_code').value_counts(), self.thresholds['top'])
+        loop_urls.index = hits['norm_url'].cat.categories[loop_urls.index]
+        for norm_url, count in loop_urls.items():
+            if not norm_url:
+                continue
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='WARNING',
+                location_url=norm_url,
+                description=f"Пользователи возвращаются на эту страницу (циклов: {count}).",
+                metrics_context=f"Количество зацикливаний: {count}",
+                affected_sessions=int(count),
+                impact_score=min(count * 0.15, 10.0),
+                page_urls=(norm_url,),
+                ai_fields=('avg_time',),
+                tracked=True,
+                target_url=norm_url,
+            ))
+        return findings
+
+
+@register
+class WanderingDetector(Detector):
+    """Сессии с большим числом просмотров, но без целей."""
+    name = 'WANDERING'
+    inputs = ('visits',)
+    thresholds = {'min_page_views': 10, 'min_sessions': MIN_WANDERING_SESSIONS, 'top': 5}
+
+    def detect(self, data, upstream):
+        df_visits = data['visits']
+        findings = []
+        if 'ym:s:goalsID' not in df_visits.columns:
+            return findings
+        wandering_visits = df_visits[
+            (df_visits['ym:s:pageViews'] > self.thresholds['min_page_views']) &
+            (df_visits['ym:s:goalsID'].isna() | (df_visits['ym:s:goalsID'].astype(str) == '[]'))
+        ]
+        if wandering_visits.empty:
+            return findings
+        wandering_by_page = wandering_visits.groupby('norm_start_url').size()
+        for entry_page, count in wandering_by_page.head(self.thresholds['top']).items():
+            # Отсеиваем шум: слишком мало сессий
+            if not entry_page or count < self.thresholds['min_sessions']:
+                continue
+            avg_depth = wandering_visits[wandering_visits['norm_start_url'] == entry_page]['ym:s:pageViews'].mean()
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='WARNING',
+                location_url=entry_page,
+                description=f"Пользователи блуждают по {avg_depth:.1f} страницам без достижения целей.",
+                metrics_context=f"Количество сессий: {count}, Средняя глубина: {avg_depth:.1f}",
+                affected_sessions=int(count),
+                impact_score=min(count * 0.1, 10.0),
+                page_urls=(entry_page,),
+                ai_fields=('avg_time', 'exit_rate'),
+            ))
+        return findings
+
+
+@register
+class NavigationBackDetector(Detector):
+    """Частое использование "Назад": циклы 2-3 страниц (nav_loops.py)."""
+    name = 'NAVIGATION_BACK'
+    thresholds = {'top': TOP_LOOPS}
+
+    def detect(self, data, upstream):
+        findings = []
+        for path_key, loop_path, pattern_count, users_count in find_navigation_loops(data['hits'], self.thresholds['top']):
+            # Берем вторую страницу как проблемную точку для метрик, если есть
+            target_url = path_key[1] if len(path_key) > 1 else path_key[0]
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='WARNING',
+                location_url=loop_path,
+                description=f"Пользователи ходят по петле {loop_path} ({pattern_count} паттернов, {users_count} пользователей).",
+                metrics_context=f"Навигационный цикл: {loop_path}. Повторений: {pattern_count}, пользователей: {users_count}",
+                affected_sessions=users_count,
+                impact_score=min(pattern_count * 0.12, 10.0),
+                page_urls=(target_url,),
+                ai_fields=('avg_time',),
+                tracked=True,
+                specialists_type='LOOPING',
+                target_url=target_url,
+            ))
+        return findings
+
+
+@register
+class HighBounceDetector(Detector):
+    """Отказы после учета циклов: страницы, уже покрытые LOOPING/NAVIGATION_BACK, пропускаются."""
+    name = 'HIGH_BOUNCE'
+    inputs = ('hits', 'visits')
+    after = ('LOOPING', 'NAVIGATION_BACK')
+    thresholds = {'max_visit_duration': 15, 'top': 5}
+
+    def detect(self, data, upstream):
+        hits, df_visits = data['hits'], data['visits']
+        covered = {finding.target_url for findings in upstream.values() for finding in findings}
+        bounced_visits = df_visits[df_visits['ym:s:visitDuration'] < self.thresholds['max_visit_duration']]['ym:s:clientID']
+        bounced_hits = hits[hits['ym:pv:clientID'].isin(bounced_visits)]
+        findings = []
+        if bounced_hits.empty:
+            return findings
+        for norm_url, count in top_norm_urls(bounced_hits, self.thresholds['top'], by_row=True).items():
+            if not norm_url or norm_url in covered:
+                continue
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='CRITICAL',
+                location_url=norm_url,
+                description=f"Высокий отскок: {count} пользователей ушли сразу.",
+                metrics_context=f"Количество отказов: {count}",
+                affected_sessions=int(count),
+                impact_score=min(count * 0.2, 10.0),
+                page_urls=(pick_representative_url(bounced_hits, 'norm_url', norm_url), norm_url),
+                ai_fields=('exit_rate', 'avg_time'),
+                tracked=True,
+            ))
+        return findings
+
+
+@register
+class FormFieldErrorsDetector(Detector):
+    """Долго на форме и нет цели."""
+    name = 'FORM_FIELD_ERRORS'
+    inputs = ('hits', 'visits')
+    thresholds = {
+        'url_pattern': r'/form|/apply|/request|/anket|/zayav',
+        'session_gap_sec': SESSION_GAP_SECONDS,
+        'min_duration_sec': 60,
+        # Отсекаем явно сломанные длительности
+        'max_duration_sec': 7200,
+        'top': 5,
+    }
+
+    def detect(self, data, upstream):
+        hits, df_visits = data['hits'], data['visits']
+        findings = []
+        # Шаблон проверяется один раз на уникальный сырой URL (в порядке кодов url_code)
+        is_form_url = pd.Series(pd.unique(hits['ym:pv:URL'].dropna())).astype(str).str.contains(
+            self.thresholds['url_pattern'], regex=True,
+        )
+        form_codes = np.flatnonzero(is_form_url.to_numpy())
+        form_hits = hits[hits['url_code'].isin(form_codes) & hits['timestamp'].notna() & (hits['client'] >= 0)]
+        if form_hits.empty:
+            return findings
+
+        # Кадр уже отсортирован по (клиент, время); режем на «квазисессии» по разрыву между
+        # хитами форм, чтобы не суммировать дни
+        form_hits = form_hits.assign(session_group=session_groups(
+            form_hits['client'].to_numpy(), form_hits['timestamp'], self.thresholds['session_gap_sec'],
+        ))
+        form_hits['session_key'] = form_hits['ym:pv:clientID'].astype(str) + "_" + form_hits['session_group'].astype(str)
+        form_sessions = form_hits.groupby('session_key').agg(
+            client_id=('ym:pv:clientID', 'first'),
+            url=('ym:pv:URL', 'first'),
+            min_time=('timestamp', 'min'),
+            max_time=('timestamp', 'max'),
+        )
+        form_sessions['duration'] = (form_sessions['max_time'] - form_sessions['min_time']).dt.total_seconds()
+        form_sessions = form_sessions[form_sessions['duration'] <= self.thresholds['max_duration_sec']]
+
+        long_form = form_sessions[form_sessions['duration'] > self.thresholds['min_duration_sec']]
+        if long_form.empty:
+            return findings
+        long_form_clients = long_form['client_id']
+        # Проверяем, есть ли у этих пользователей goals
+        if 'ym:s:goalsID' in df_visits.columns:
+            has_goals = df_visits[
+                df_visits['ym:s:clientID'].isin(long_form_clients) &
+                ~df_visits['ym:s:goalsID'].isna() &
+                (df_visits['ym:s:goalsID'].astype(str) != '[]')
+            ]
+            problem_clients = set(long_form_clients) - set(has_goals['ym:s:clientID'])
+        else:
+            problem_clients = set(long_form_clients)
+        if not problem_clients:
+            return findings
+
+        form_urls = top_counts(long_form[long_form['client_id'].isin(problem_clients)]['url'].value_counts(), self.thresholds['top'])
+        for url, count in form_urls.items():
+            norm_url = normalize_issue_url(url)
+            avg_duration = long_form[long_form['url'] == url]['duration'].mean()
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='WARNING',
+                location_url=norm_url or url,
+                description=f"Пользователи проводят {avg_duration:.1f} с на форме и не отправляют (сессий: {count}).",
+                metrics_context=f"Количество проблемных сессий: {count}, Среднее время на форме: {avg_duration:.1f} сек",
+                affected_sessions=int(count),
+                impact_score=min(count * 0.15, 10.0),
+                page_urls=(norm_url or url,),
+                ai_metrics={'avg_time': avg_duration},
+            ))
+        return findings
+
+
+@register
+class FunnelDropoffDetector(Detector):
+    """Критические точки отказа в популярном пути приемной комиссии."""
+    name = 'FUNNEL_DROPOFF'
+    thresholds = {'steps': ('/', '/lists', '/rating', '/apply'), 'min_users': 50, 'max_conversion': 0.3}
+
+    def detect(self, data, upstream):
+        hits = data['hits']
+        funnel_steps = self.thresholds['steps']
+        findings = []
+        for i in range(len(funnel_steps) - 1):
+            step1_url = normalize_issue_url(funnel_steps[i])
+            step2_url = normalize_issue_url(funnel_steps[i + 1])
+            step1_users = set(hits.loc[hits['norm_url'] == step1_url, 'ym:pv:clientID'])
+            step2_users = set(hits.loc[hits['norm_url'] == step2_url, 'ym:pv:clientID'])
+
+            # Порог по количеству, чтобы не создавать шумные дропы
+            if not step1_users or len(step1_users) < self.thresholds['min_users']:
+                continue
+            conversion = len(step2_users & step1_users) / len(step1_users)
+            if conversion >= self.thresholds['max_conversion']:
+                continue
+            lost_users = len(step1_users) - len(step2_users & step1_users)
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='CRITICAL',
+                location_url=step1_url,
+                description=f"Критический отвал: только {conversion*100:.1f}% переходят с {step1_url} на {step2_url}.",
+                metrics_context=f"Конверсия {step1_url} -> {step2_url}: {conversion*100:.1f}%, Потеряно пользователей: {lost_users}",
+                affected_sessions=lost_users,
+                impact_score=min(lost_users * 0.2, 10.0),
+                page_urls=(step1_url, funnel_steps[i]),
+                ai_fields=('exit_rate',),
+            ))
+        return findings
+
+
+def _top_by_exit_rate(pages, top: int, keep) -> List[dict]:
+    """Строки PageMetricsIndex, для которых keep(строка) истинно, по убыванию exit_rate (при равенстве - по id)."""
+    rows = [metric for metric in pages.rows if keep(metric)]
+    return sorted(rows, key=lambda metric: -metric['exit_rate'])[:top]
+
+
+@register
+class ScanAndDropDetector(Detector):
+    """Высокие выходы при глубоком скролле и коротком времени."""
+    name = 'SCAN_AND_DROP'
+    inputs = ('page_metrics',)
+    thresholds = {'min_scroll': 80, 'min_views': MIN_PAGE_VIEWS_FOR_PAGE_ALERT, 'min_exit_rate': 70, 'max_time': 30, 'top': 5}
+
+    def detect(self, data, upstream):
+        t = self.thresholds
+        candidates = _top_by_exit_rate(
+            data['page_metrics'], t['top'],
+            lambda m: m['avg_scroll_depth'] is not None and m['avg_scroll_depth'] >= t['min_scroll'] and m['total_views'] >= t['min_views'],
+        )
+        findings = []
+        for metric in candidates:
+            if not (metric['exit_rate'] and metric['exit_rate'] > t['min_exit_rate'] and metric['avg_time_on_page'] < t['max_time']):
+                continue
+            norm_url = normalize_issue_url(metric['url'])
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='WARNING',
+                location_url=norm_url,
+                description=f"Быстрый просмотр и уход (выход {metric['exit_rate']:.1f}%, время {metric['avg_time_on_page']:.1f} с).",
+                metrics_context=f"Exit rate: {metric['exit_rate']:.1f}%, Avg time: {metric['avg_time_on_page']:.1f}s, Scroll: {metric['avg_scroll_depth']:.1f}%",
+                affected_sessions=int(metric['total_views']),
+                impact_score=min(metric['exit_rate'] / 10, 10.0),
+                page_urls=(metric['url'],),
+                ai_fields=('exit_rate', 'avg_time', 'scroll_depth'),
+            ))
+        return findings
+
+
+@register
+class DeadClickDetector(Detector):
+    """Страницы с высоким выходом и почти нулевым вовлечением."""
+    name = 'DEAD_CLICK'
+    inputs = ('page_metrics',)
+    thresholds = {'min_views': MIN_PAGE_VIEWS_FOR_PAGE_ALERT, 'min_exit_rate': 60, 'max_time': 5, 'max_scroll': 20, 'top': 5}
+
+    def detect(self, data, upstream):
+        t = self.thresholds
+        candidates = _top_by_exit_rate(
+            data['page_metrics'], t['top'],
+            lambda m: m['total_views'] >= t['min_views'] and m['exit_rate'] >= t['min_exit_rate'] and m['avg_time_on_page'] <= t['max_time'],
+        )
+        findings = []
+        for metric in candidates:
+            if metric['avg_scroll_depth'] is not None and metric['avg_scroll_depth'] > t['max_scroll']:
+                continue  # не считаем, если есть скролл
+            norm_url = normalize_issue_url(metric['url'])
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='WARNING',
+                location_url=norm_url,
+                description=f"Похоже на мёртвые клики: выход {metric['exit_rate']:.1f}%, время {metric['avg_time_on_page']:.1f} с.",
+                metrics_context=f"Exit rate: {metric['exit_rate']:.1f}%, Avg time: {metric['avg_time_on_page']:.1f}s, Scroll: {metric['avg_scroll_depth']}",
+                affected_sessions=int(metric['total_views']),
+                impact_score=min(metric['exit_rate'] / 8, 10.0),
+                page_urls=(metric['url'],),
+                ai_fields=('exit_rate', 'avg_time', 'scroll_depth'),
+            ))
+        return findings
+
+
+@register
+class SearchFailDetector(Detector):
+    """Страницы поиска с высоким выходом."""
+    name = 'SEARCH_FAIL'
+    inputs = ('page_metrics',)
+    thresholds = {'url_substring': 'search', 'min_views': MIN_PAGE_VIEWS_FOR_PAGE_ALERT, 'min_exit_rate': 70, 'top': 5}
+
+    def detect(self, data, upstream):
+        t = self.thresholds
+        candidates = _top_by_exit_rate(
+            data['page_metrics'], t['top'],
+            lambda m: t['url_substring'] in m['url'].lower() and m['total_views'] >= t['min_views'],
+        )
+        findings = []
+        for metric in candidates:
+            if not (metric['exit_rate'] and metric['exit_rate'] > t['min_exit_rate']):
+                continue
+            norm_url = normalize_issue_url(metric['url'])
+            findings.append(Finding(
+                issue_type=self.name,
+                severity='WARNING',
+                location_url=norm_url,
+                description=f"Страница поиска с высоким выходом ({metric['exit_rate']:.1f}%).",
+                metrics_context=f"Search exit rate: {metric['exit_rate']:.1f}%, Avg time: {metric['avg_time_on_page']:.1f}s",
+                affected_sessions=int(metric['total_views']),
+                impact_score=min(metric['exit_rate'] / 8, 10.0),
+                page_urls=(metric['url'],),
+                ai_fields=('exit_rate', 'avg_time'),
+            ))
+        return findings
+
+
+def resolve_detectors(names=None) -> List[str]:
+    """Выбранные детекторы и их зависимости в порядке реестра; None - все."""
+    if not names:
+        return list(DETECTORS)
+    unknown = [name for name in names if name not in DETECTORS]
+    if unknown:
+        raise ValueError(f"Unknown detectors: {', '.join(unknown)}")
+    wanted, stack = set(), list(names)
+    while stack:
+        name = stack.pop()
+        if name not in wanted:
+            wanted.add(name)
+            stack.extend(DETECTORS[name].after)
+    return [name for name in DETECTORS if name in wanted]
+
+
+def required_inputs(names) -> set:
+    """Входы, которые нужно подготовить для детекторов names."""
+    return {source for name in names for source in DETECTORS[name].inputs}
+
+
+# Входы детекторов в процессе пула (передаются один раз через initializer)
+_worker_data: dict = {}
+
+
+def _init_worker(data):
+    _worker_data.clear()
+    _worker_data.update(data)
+
+
+def _run_detector(name, upstream, data=None):
+    """Выполняет один детектор. Возвращает (имя, находки, секунды)."""
+    started = time.perf_counter()
+    findings = DETECTORS[name]().detect(_worker_data if data is None else data, upstream)
+    return name, findings, time.perf_counter() - started
+
+
+def run_detectors(data: dict, names=None, workers: Optional[int] = None) -> Tuple[List[Finding], Dict[str, float]]:
+    """
+    Запускает детекторы names (None - все) по входам data.
+    workers > 1 - пул процессов: детектор стартует, как только готовы его зависимости.
+    Возвращает (находки выбранных детекторов в порядке реестра, {детектор: секунды}).
+    Зависимости, не выбранные явно, выполняются, но их находки не возвращаются.
+    """
+    order = resolve_detectors(names)
+    selected = set(names) if names else set(order)
+    workers = max(1, min(ANALYSIS_WORKERS if workers is None else workers, len(order)))
+    results, timings = {}, {}
+
+    def upstream(name):
+        return {dep: results[dep] for dep in DETECTORS[name].after}
+
+    if workers == 1:
+        for name in order:
+            _, results[name], timings[name] = _run_detector(name, upstream(name), data)
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(data,)) as pool:
+            pending, running = list(order), set()
+            while pending or running:
+                ready = [name for name in pending if all(dep in results for dep in DETECTORS[name].after)]
+                for name in ready:
+                    pending.remove(name)
+                    running.add(pool.submit(_run_detector, name, upstream(name)))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, findings, seconds = future.result()
+                    results[name], timings[name] = findings, seconds
+
+    findings = [finding for name in order if name in selected for finding in results[name]]
+    return findings, timings
+
+
+__all__ = [
+    'MIN_PAGE_VIEWS_FOR_PAGE_ALERT', 'MIN_WANDERING_SESSIONS', 'ANALYSIS_WORKERS', 'PAGE_METRIC_FIELDS',
+    'Finding', 'Detector', 'DETECTORS', 'register', 'pick_representative_url',
+    'resolve_detectors', 'required_inputs', 'run_detectors',
+]
@@ -4,9 +4,10 @@
 """
 from typing import List, Dict, Set, Tuple, Any, Optional
 from collections import defaultdict, Counter
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from analytics.models import VisitSession, PageHit, ProductVersion, UserCohort
 from analytics.utils import GoalParser
+from analytics.hit_snapshot import iter_session_hits
 
 
 def normalize_url_for_discovery(url: str) -> str:
@@ -64,6 +65,29 @@ def normalize_url_for_discovery(url: str) -> str:
     return path
 
 
+def _hits_with_urls(version) -> Prefetch:
+    """Хиты сессий версии по времени (при равном времени - по порядку загрузки) вместе со справочником URL."""
+    return Prefetch(
+        'hits', queryset=PageHit.objects.filter(version=version).select_related('url').order_by('timestamp', 'id'),
+    )
+
+
+def _sessions_with_hits(version, client_ids: Optional[Set[int]] = None):
+    """
+    (сессия, ее хиты по времени) для сессий версии: из колоночного снимка (hit_snapshot.py),
+    а если его нет - из БД через prefetch_related порциями по 1000 сессий.
+    """
+    snapshot = iter_session_hits(version.id, client_ids)
+    if snapshot is not None:
+        yield from snapshot
+        return
+    sessions = VisitSession.objects.filter(version=version)
+    if client_ids is not None:
+        sessions = sessions.filter(client_id__in=client_ids)
+    for session in sessions.prefetch_related(_hits_with_urls(version)).iterator(chunk_size=1000):
+        yield session, list(session.hits.all())
+
+
 def extract_user_paths(version: ProductVersion, min_steps: int = 2, max_steps: int = 5) -> List[List[str]]:
     """
     Извлекает пути пользователей (последовательности URL) из данных
@@ -79,23 +103,19 @@ def extract_user_paths(version: ProductVersion, min_steps: int = 2, max_steps: i
     """
     paths = []
     
-    # Используем iterator() для потоковой обработки больших объемов данных
-    # prefetch_related('hits') загружает все hits сразу для каждой сессии
-    sessions = VisitSession.objects.filter(version=version).prefetch_related('hits').iterator(chunk_size=1000)
-    
+    # Сессии потоком вместе с хитами (снимок или prefetch_related со справочником URL)
     session_count = 0
-    for session in sessions:
+    for session, hits in _sessions_with_hits(version):
         session_count += 1
         
-        # Получаем hits в хронологическом порядке (уже загружены через prefetch_related)
-        hits = list(session.hits.all())
+        # hits в хронологическом порядке
         hits.sort(key=lambda h: h.timestamp)
         
         # Нормализуем URL и убираем дубликаты подряд
         normalized_urls = []
         prev_url = None
         for hit in hits:
-            normalized = normalize_url_for_discovery(hit.url)
+            normalized = hit.url.discovery_url  # normalize_url_for_discovery, посчитан заранее
             if normalized and normalized != prev_url:  # Убираем дубликаты подряд
                 normalized_urls.append(normalized)
                 prev_url = normalized
@@ -336,7 +356,7 @@ def discover_funnels(
 
 def extract_user_paths_with_goals(
     version: ProductVersion,
-    client_ids_filter: Optional[Set[str]] = None,
+    client_ids_filter: Optional[Set[int]] = None,
     min_steps: int = 2,
     max_steps: int = 5,
     goal_parser: Optional[GoalParser] = None,
@@ -363,13 +383,14 @@ def extract_user_paths_with_goals(
     
     # Фильтруем сессии
     sessions_query = VisitSession.objects.filter(version=version)
+    client_ids_filter_int = None
     if client_ids_filter:
-        # Преобразуем в строки для сравнения
-        client_ids_filter_str = {str(cid) for cid in client_ids_filter}
-        sessions_query = sessions_query.filter(client_id__in=client_ids_filter_str)
+        # client_id - целое; когорты, сохраненные до перехода на BigIntegerField, хранят строки
+        client_ids_filter_int = {int(cid) for cid in client_ids_filter}
+        sessions_query = sessions_query.filter(client_id__in=client_ids_filter_int)
     
     total_sessions = sessions_query.count()
-    sessions = sessions_query.prefetch_related('hits').iterator(chunk_size=1000)
+    sessions = _sessions_with_hits(version, client_ids_filter_int)
     
     # Отладочная статистика
     sessions_with_hits = 0
@@ -384,10 +405,7 @@ def extract_user_paths_with_goals(
         if goal_id:
             goal_id_to_code[str(goal_id)] = goal.get('code')
     
-    for session in sessions:
-        # Получаем hits в хронологическом порядке
-        hits = list(session.hits.all())
-        
+    for session, hits in sessions:
         if not hits:
             sessions_without_hits += 1
             continue
@@ -401,14 +419,14 @@ def extract_user_paths_with_goals(
         
         # Обрабатываем hits
         for hit in hits:
-            if not hit.url:
+            if not hit.url.raw:
                 continue
             # Добавляем URL (если не дубликат)
-            normalized_url = normalize_url_for_discovery(hit.url)
+            normalized_url = hit.url.discovery_url
             if normalized_url and normalized_url != prev_url:
                 path_steps.append({
                     'type': 'url',
-                    'url': hit.url,
+                    'url': hit.url.raw,
                     'normalized_url': normalized_url,
                     'timestamp': hit.timestamp
                 })
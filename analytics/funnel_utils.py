@@ -2,30 +2,21 @@
 Утилиты для расчета метрик воронок конверсии
 Оптимизировано для работы с БД, минимальное использование памяти
 """
-from django.db.models import Count, Q, Exists, OuterRef
+from django.db.models import Count, Q, Exists, OuterRef, Prefetch
 from django.db import connection
-from analytics.models import ConversionFunnel, VisitSession, PageHit, UserCohort
-from analytics.utils import GoalParser
-import urllib.parse
+import numpy as np
+from analytics.models import ConversionFunnel, VisitSession, PageHit, SessionGoal, Url, UserCohort
+from analytics.session_goals import sessions_by_goal
+from analytics.hit_snapshot import SnapshotHit, column, iter_session_hits, read_hits
+from analytics import olap
+from analytics.utils import GoalParser, normalize_issue_url
 from typing import Dict, List, Optional, Set, Any
 from collections import defaultdict
 
 
 def normalize_url(url: str) -> str:
     """Нормализация URL (аналогично _normalize_issue_url из views.py)"""
-    if not isinstance(url, str):
-        return ""
-    parsed = urllib.parse.urlparse(url.strip())
-    netloc = parsed.netloc.lower()
-    path = (parsed.path or "/").rstrip("/") or "/"
-    query_dict = urllib.parse.parse_qs(parsed.query, keep_blank_values=False)
-    for noisy in ['referer', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term', 'yclid', '_openstat', 'from', 'ref']:
-        query_dict.pop(noisy, None)
-    clean_query = urllib.parse.urlencode({k: v[0] if len(v) == 1 else v for k, v in query_dict.items()}, doseq=True)
-    scheme = parsed.scheme.lower() if parsed.scheme else ("https" if netloc else "")
-    if netloc or scheme:
-        return urllib.parse.urlunparse((scheme, netloc, path, '', clean_query, ''))
-    return path + (f"?{clean_query}" if clean_query else "")
+    return normalize_issue_url(url)
 
 
 def matches_funnel_step(hit: PageHit, step_config: Dict[str, Any], goal_parser: GoalParser) -> bool:
@@ -33,7 +24,7 @@ def matches_funnel_step(hit: PageHit, step_config: Dict[str, Any], goal_parser:
     Проверяет, соответствует ли hit шагу воронки
     
     Args:
-        hit: PageHit объект
+        hit: PageHit объект (с загруженным hit.url - справочник Url)
         step_config: Конфигурация шага {'type': 'goal'|'url', 'code'|'url': ..., 'name': ...}
         goal_parser: Парсер целей для проверки goal-шагов
     
@@ -59,10 +50,10 @@ def matches_funnel_step(hit: PageHit, step_config: Dict[str, Any], goal_parser:
             return False
         
         elif match_type == 'url_prefix':
-            return hit.url.startswith(match_value) if match_value else False
+            return hit.url.raw.startswith(match_value) if match_value else False
         
         elif match_type == 'url_contains':
-            return match_value in hit.url if match_value else False
+            return match_value in hit.url.raw if match_value else False
         
         elif match_type == 'click':
             # Click goals требуют специальной обработки
@@ -70,11 +61,11 @@ def matches_funnel_step(hit: PageHit, step_config: Dict[str, Any], goal_parser:
     
     elif step_type == 'url':
         target_url = step_config.get('url', '')
-        if not target_url or not hit.url:
+        if not target_url or not hit.url.raw:
             return False
         
-        # Нормализуем URL (убираем параметры для сравнения базового пути)
-        normalized_hit_url = normalize_url(hit.url)
+        # Нормализуем URL (убираем параметры для сравнения базового пути); у хита форма посчитана заранее
+        normalized_hit_url = hit.url.issue_url
         normalized_target_url = normalize_url(target_url)
         
         # Точное совпадение после нормализации
@@ -82,8 +73,7 @@ def matches_funnel_step(hit: PageHit, step_config: Dict[str, Any], goal_parser:
             return True
         
         # Извлекаем пути без протокола и домена
-        def extract_path(url):
-            url_normalized = normalize_url(url)
+        def extract_path(url_normalized):
             for domain in ['https://priem.mai.ru', 'http://priem.mai.ru', 'https://mai.ru', 'http://mai.ru']:
                 url_normalized = url_normalized.replace(domain, '')
             # Убираем параметры запроса для сравнения базового пути
@@ -91,8 +81,8 @@ def matches_funnel_step(hit: PageHit, step_config: Dict[str, Any], goal_parser:
                 url_normalized = url_normalized.split('?')[0]
             return url_normalized.rstrip('/')
         
-        hit_path = extract_path(hit.url)
-        target_path = extract_path(target_url)
+        hit_path = extract_path(normalized_hit_url)
+        target_path = extract_path(normalized_target_url)
         
         # Нормализуем пути: /bachelor/ и /base/ считаются эквивалентными
         hit_path_normalized = hit_path.replace('/base/', '/bachelor/')
@@ -117,7 +107,23 @@ def matches_funnel_step(hit: PageHit, step_config: Dict[str, Any], goal_parser:
     return False
 
 
-def check_step_achieved(session: VisitSession, step: Dict[str, Any], goal_parser: GoalParser, hits: List[PageHit]) -> bool:
+def identifier_goal_id(step: Dict[str, Any], goal_parser: GoalParser) -> Optional[int]:
+    """ym_goal_id шага-цели типа identifier (достижение хранится в SessionGoal), иначе None."""
+    if step.get('type') != 'goal':
+        return None
+    goal_config = goal_parser.get_goal_by_code(step.get('code'))
+    if not goal_config or goal_config['match']['type'] != 'identifier':
+        return None
+    return goal_config.get('ym_goal_id') or None
+
+
+def check_step_achieved(
+    session: VisitSession,
+    step: Dict[str, Any],
+    goal_parser: GoalParser,
+    hits: List[PageHit],
+    goal_sessions: Optional[Dict[int, Set[int]]] = None,
+) -> bool:
     """
     Проверяет, достигнут ли шаг воронки в данной сессии
     
@@ -126,6 +132,7 @@ def check_step_achieved(session: VisitSession, step: Dict[str, Any], goal_parser
         step: Конфигурация шага
         goal_parser: Парсер целей
         hits: Список hits сессии
+        goal_sessions: {goal_id: id сессий с целью} из SessionGoal; без него проверяется session.goals_id
     
     Returns:
         bool: True если шаг достигнут
@@ -145,6 +152,8 @@ def check_step_achieved(session: VisitSession, step: Dict[str, Any], goal_parser
             # Проверяем через goalsID в сессии
             goal_id = goal_config.get('ym_goal_id')
             if goal_id:
+                if goal_sessions is not None:
+                    return session.id in goal_sessions.get(goal_id, ())
                 session_goals = session.goals_id or []
                 return goal_id in session_goals
             return False
@@ -165,42 +174,65 @@ def check_step_achieved(session: VisitSession, step: Dict[str, Any], goal_parser
     return False
 
 
-def calculate_funnel_metrics(
+def _olap_step_counts(
     funnel: ConversionFunnel,
     version,
-    client_ids_filter: Optional[Set[str]] = None,
-    goal_parser: Optional[GoalParser] = None
-) -> Dict[str, Any]:
+    client_ids: Optional[Set[int]],
+    step_goal_ids: List[Optional[int]],
+    goal_parser: GoalParser,
+) -> Optional[List[int]]:
     """
-    Рассчитывает метрики воронки для заданной версии
-    
-    Args:
-        funnel: Объект ConversionFunnel
-        version: ProductVersion объект
-        client_ids_filter: Опциональный фильтр по client_ids (для анализа по когортам)
-        goal_parser: Парсер целей (если не передан, создается новый)
-    
-    Returns:
-        Dict с метриками воронки
+    Число клиентов на каждом шаге через DuckDB (olap.py) или None, если движок недоступен.
+    Проверка URL-шагов не зависит от хита, только от его URL, поэтому matches_funnel_step
+    вызывается по разу на URL версии, а сессии и клиенты считаются в DuckDB.
     """
-    if goal_parser is None:
-        goal_parser = GoalParser()
-    
+    if not olap.enabled():
+        return None
+    hits = read_hits(version.id, ['url_id'])
+    if hits is None:
+        return None
+    urls = Url.objects.in_bulk(np.unique(column(hits, 'url_id')).tolist())
+    step_url_ids = [
+        [pk for pk, url in urls.items() if matches_funnel_step(SnapshotHit(url, None), step, goal_parser)]
+        for step in funnel.steps
+    ]
+    return olap.funnel_counts(version, step_url_ids, step_goal_ids, funnel.require_sequence, client_ids)
+
+
+def _session_step_counts(
+    funnel: ConversionFunnel,
+    version,
+    client_ids: Optional[Set[int]],
+    step_goal_ids: List[Optional[int]],
+    goal_parser: GoalParser,
+) -> List[int]:
+    """Число клиентов на каждом шаге: проход по сессиям с хитами (снимок или БД) в Python."""
     steps = funnel.steps
-    if not steps:
-        return {
-            'total_entered': 0,
-            'total_completed': 0,
-            'overall_conversion': 0.0,
-            'step_metrics': []
-        }
-    
-    # Получаем все сессии версии
-    sessions_query = VisitSession.objects.filter(version=version)
-    if client_ids_filter:
-        sessions_query = sessions_query.filter(client_id__in=client_ids_filter)
-    
-    sessions = sessions_query.prefetch_related('hits')
+    # Сессии с каждой целью-идентификатором одним запросом к SessionGoal
+    goal_sessions = sessions_by_goal(version, [goal_id for goal_id in step_goal_ids if goal_id])
+    # Последовательная воронка начинается с цели - остальные сессии не пройдут ни одного шага
+    first_goal = step_goal_ids[0] if funnel.require_sequence else None
+
+    # Сессии вместе с хитами по времени: из колоночного снимка или из БД
+    sessions = iter_session_hits(version.id, client_ids)
+    if sessions is not None:
+        if first_goal:
+            sessions = (item for item in sessions if item[0].id in goal_sessions[first_goal])
+    else:
+        sessions_query = VisitSession.objects.filter(version=version)
+        if client_ids:
+            sessions_query = sessions_query.filter(client_id__in=client_ids)
+        if first_goal:
+            sessions_query = sessions_query.filter(id__in=SessionGoal.objects.filter(
+                version=version, goal_id=first_goal,
+            ).values('session_id'))
+        # Хиты версии по времени вместе со справочником URL - без запросов на каждую сессию/хит
+        sessions = (
+            (session, list(session.hits.all()))
+            for session in sessions_query.prefetch_related(Prefetch(
+                'hits', queryset=PageHit.objects.filter(version=version).select_related('url').order_by('timestamp', 'id'),
+            ))
+        )
     
     # Собираем client_ids, которые достигли каждого шага
     step_client_ids = {}
@@ -208,9 +240,7 @@ def calculate_funnel_metrics(
         step_client_ids[step_idx] = set()
     
     # Проходим по всем сессиям и проверяем шаги
-    for session in sessions:
-        # Получаем hits сессии в хронологическом порядке
-        hits = list(session.hits.all().order_by('timestamp'))
+    for session, hits in sessions:
         client_id = session.client_id
         
         # Для последовательных воронок проверяем шаги по порядку
@@ -221,7 +251,7 @@ def calculate_funnel_metrics(
                     continue  # Пропускаем шаги, которые не являются текущими
                 
                 step = steps[step_idx]
-                if check_step_achieved(session, step, goal_parser, hits):
+                if check_step_achieved(session, step, goal_parser, hits, goal_sessions):
                     step_client_ids[step_idx].add(client_id)
                     current_step_idx = step_idx + 1
                     if current_step_idx >= len(steps):
@@ -232,12 +262,54 @@ def calculate_funnel_metrics(
         else:
             # Для непоследовательных воронок проверяем все шаги независимо
             for step_idx, step in enumerate(steps):
-                if check_step_achieved(session, step, goal_parser, hits):
+                if check_step_achieved(session, step, goal_parser, hits, goal_sessions):
                     step_client_ids[step_idx].add(client_id)
+
+    return [len(step_client_ids[step_idx]) for step_idx in range(len(steps))]
+
+
+def calculate_funnel_metrics(
+    funnel: ConversionFunnel,
+    version,
+    client_ids_filter: Optional[Set[int]] = None,
+    goal_parser: Optional[GoalParser] = None
+) -> Dict[str, Any]:
+    """
+    Рассчитывает метрики воронки для заданной версии
+    
+    Args:
+        funnel: Объект ConversionFunnel
+        version: ProductVersion объект
+        client_ids_filter: Опциональный фильтр по client_ids (для анализа по когортам)
+        goal_parser: Парсер целей (если не передан, создается новый)
+    
+    Returns:
+        Dict с метриками воронки
+    """
+    if goal_parser is None:
+        goal_parser = GoalParser()
+    
+    steps = funnel.steps
+    if not steps:
+        return {
+            'total_entered': 0,
+            'total_completed': 0,
+            'overall_conversion': 0.0,
+            'step_metrics': []
+        }
+    
+    # client_id - целое; когорты, сохраненные до перехода на BigIntegerField, хранят строки
+    client_ids = {int(cid) for cid in client_ids_filter} if client_ids_filter else None
+    # Цели-идентификаторы шагов (достижение хранится в SessionGoal)
+    step_goal_ids = [identifier_goal_id(step, goal_parser) for step in steps]
+
+    step_counts = _olap_step_counts(funnel, version, client_ids, step_goal_ids, goal_parser)
+    if step_counts is None:
+        step_counts = _session_step_counts(funnel, version, client_ids, step_goal_ids, goal_parser)
     
     # Рассчитываем метрики
-    total_entered = len(step_client_ids.get(0, set())) if step_client_ids else 0
-    total_completed = len(step_client_ids.get(len(steps) - 1, set())) if step_client_ids else 0
+    total_entered = step_counts[0]
+    total_completed = step_counts[-1]
     
     overall_conversion = (total_completed / total_entered * 100) if total_entered > 0 else 0.0
     
@@ -246,7 +318,7 @@ def calculate_funnel_metrics(
     prev_count = total_entered
     
     for step_idx, step in enumerate(steps):
-        users_reached = len(step_client_ids.get(step_idx, set()))
+        users_reached = step_counts[step_idx]
         conversion_from_prev = (users_reached / prev_count * 100) if prev_count > 0 else 0.0
         drop_off = prev_count - users_reached
         drop_off_percentage = (drop_off / prev_count * 100) if prev_count > 0 else 0.0
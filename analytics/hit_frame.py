@@ -0,0 +1,117 @@
+"""
+Общий кадр хитов для детекторов run_analysis: хиты сортируются один раз по (клиент, время),
+время разбирается один раз, URL кодируются целыми (сырые - url_code, нормализованные -
+категориальная norm_url с категориями в порядке строк). Сдвиги внутри клиента
+(time_diff, prev/next URL) и квазисессии по разрыву считаются массивами, без groupby.
+Модуль импортируется в процессах пула детекторов (spawn) до настройки Django,
+поэтому справочник URL импортируется только внутри build_hit_frame.
+"""
+import numpy as np
+import pandas as pd
+
+# Разрыв между хитами клиента, после которого начинается новая квазисессия
+SESSION_GAP_SECONDS = 1800
+
+
+def _client_boundaries(clients: np.ndarray) -> np.ndarray:
+    """same[i] - хиты i и i+1 принадлежат одному (известному) клиенту."""
+    return (clients[1:] == clients[:-1]) & (clients[1:] >= 0)
+
+
+def _seconds_since_previous(clients: np.ndarray, timestamps: pd.Series) -> np.ndarray:
+    """Секунды от предыдущего хита клиента; NaN для первого хита и хитов без времени."""
+    ns = timestamps.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    valid = timestamps.notna().to_numpy()
+    diff = np.full(len(ns), np.nan)
+    if len(ns) > 1:
+        same = _client_boundaries(clients) & valid[1:] & valid[:-1]
+        diff[1:][same] = (ns[1:][same] - ns[:-1][same]) / 1e9
+    return diff
+
+
+def _shift_codes(clients: np.ndarray, codes: np.ndarray, step: int) -> np.ndarray:
+    """Код соседнего хита того же клиента (step=1 - предыдущий, -1 - следующий), иначе -1."""
+    shifted = np.full(len(codes), -1, dtype=np.int64)
+    if len(codes) > 1:
+        same = _client_boundaries(clients)
+        if step > 0:
+            shifted[1:] = np.where(same, codes[:-1], -1)
+        else:
+            shifted[:-1] = np.where(same, codes[1:], -1)
+    return shifted
+
+
+def session_groups(clients: np.ndarray, timestamps: pd.Series, gap: float = SESSION_GAP_SECONDS) -> np.ndarray:
+    """
+    Номер квазисессии внутри клиента для хитов, отсортированных по (клиент, время):
+    счетчик разрывов > gap секунд с начала клиента (как groupby().transform(cumsum)).
+    """
+    breaks = (_seconds_since_previous(clients, timestamps) > gap).astype(np.int64)
+    total = np.cumsum(breaks)
+    starts = np.ones(len(clients), dtype=bool)
+    starts[1:] = clients[1:] != clients[:-1]
+    # На первом хите клиента разрыва нет, поэтому вычитаем накопленное до него значение
+    first = np.maximum.accumulate(np.where(starts, np.arange(len(clients)), 0))
+    return total - total[first]
+
+
+def build_hit_frame(df_hits: pd.DataFrame) -> pd.DataFrame:
+    """
+    Хиты, отсортированные по (ym:pv:clientID, время) стабильно, с колонками:
+    row - позиция в исходном df_hits, timestamp - UTC-время, client - код клиента (-1 для NA),
+    url_code / prev_url_code / next_url_code - коды сырых URL (-1 - нет), norm_url - категориальная
+    normalize_issue_url (пустая строка всегда среди категорий), time_diff - секунды от предыдущего хита клиента.
+    """
+    from analytics.url_intern import issue_urls
+
+    frame = pd.DataFrame({
+        'ym:pv:clientID': df_hits['ym:pv:clientID'].to_numpy(),
+        'ym:pv:URL': df_hits['ym:pv:URL'].to_numpy(dtype=object),
+        'timestamp': pd.to_datetime(df_hits['ym:pv:dateTime'], utc=True, errors='coerce').array,
+        'row': np.arange(len(df_hits)),
+    })
+    frame = frame.sort_values(['ym:pv:clientID', 'timestamp'], kind='stable', ignore_index=True)
+
+    clients = pd.factorize(frame['ym:pv:clientID'])[0].astype(np.int64)
+    url_codes, raw_uniques = pd.factorize(frame['ym:pv:URL'])
+    url_codes = url_codes.astype(np.int64)
+    # Нормализация - один раз на уникальный сырой URL; последний элемент (код -1) - пропущенный URL
+    raw_forms = issue_urls(pd.Series(list(raw_uniques) + [None], dtype=object)).to_numpy(dtype=object)
+    norm_of_raw, categories = pd.factorize(raw_forms, sort=True)
+
+    frame['client'] = clients
+    frame['url_code'] = url_codes
+    frame['prev_url_code'] = _shift_codes(clients, url_codes, 1)
+    frame['next_url_code'] = _shift_codes(clients, url_codes, -1)
+    frame['norm_url'] = pd.Categorical.from_codes(norm_of_raw[url_codes], categories=categories)
+    frame['time_diff'] = _seconds_since_previous(clients, frame['timestamp'])
+    return frame
+
+
+def top_counts(counts: pd.Series, top: int) -> pd.Series:
+    """
+    Первые top значений counts по убыванию, при равенстве - по возрастанию индекса.
+    Не зависит от порядка строк кадра (а он - от типа ключа клиента, по которому отсортированы хиты).
+    """
+    return counts.sort_index(kind='stable').sort_values(ascending=False, kind='stable').head(top)
+
+
+def top_norm_urls(hits: pd.DataFrame, top: int = 5, by_row: bool = False) -> pd.Series:
+    """
+    Самые частые norm_url в hits: Series {norm_url: count}, пустая строка не исключается.
+    При равенстве раньше идет меньший URL (by_row=True - URL, встреченный первым в порядке df_hits).
+    """
+    codes = hits['norm_url'].cat.codes
+    if by_row:
+        stats = pd.DataFrame({'code': codes, 'row': hits['row']}).groupby('code', sort=False).agg(
+            count=('row', 'size'), first=('row', 'min'),
+        )
+        counts = stats.sort_values(['count', 'first'], ascending=[False, True], kind='stable')['count'].head(top)
+    else:
+        # Коды категорий идут в порядке строк URL
+        counts = top_counts(codes.value_counts(), top)
+    counts.index = hits['norm_url'].cat.categories[counts.index]
+    return counts
+
+
+__all__ = ['SESSION_GAP_SECONDS', 'build_hit_frame', 'session_groups', 'top_counts', 'top_norm_urls']
@@ -0,0 +1,227 @@
+"""
+Колоночные снимки хитов версии на диске (Arrow IPC) для аналитики, которая читает хиты из БД.
+После загрузки версии (стадия snapshot в ingest_data, пересборка после --append) пишутся два файла:
+- hits.arrow: id, session_id, client_id, timestamp (UTC), url_id - по (session_id, timestamp, id),
+  то есть в порядке, в котором хиты сессий читают пути и воронки, и колонки для агрегатов
+  PageMetrics (time_on_page, is_exit, scroll_depth, page_title, agent_id);
+- sessions.arrow: session_id, client_id, start_time, goals и колонки разрезов дашборда
+  (bounced, duration_sec, device_category, browser, os, entry_page) - по session_id.
+Файлы без сжатия и одним record batch'ем: чтение - memory map без копирования, колонки
+сразу становятся numpy-массивами, вместо миллионов строк ORM; строки - словарные колонки.
+По тем же файлам считает агрегаты DuckDB (olap.py).
+Снимок удаляется при любой перезаписи сырых данных версии (загрузка, --append, purge_version);
+если снимка нет (или HIT_SNAPSHOT_DIR пуст), читатели возвращают None и потребители идут в БД.
+"""
+import os
+import re
+import shutil
+from datetime import timezone
+from collections import namedtuple
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from django.conf import settings
+from django.db import connection
+
+from analytics.models import PageHit, Url, VisitSession
+
+HITS_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('session_id', pa.int64()),
+    ('client_id', pa.int64()),
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('url_id', pa.int64()),
+    ('time_on_page', pa.int32()),
+    ('is_exit', pa.bool_()),
+    ('scroll_depth', pa.int32()),
+    ('page_title', pa.dictionary(pa.int32(), pa.string())),
+    ('agent_id', pa.int64()),
+])
+SESSIONS_SCHEMA = pa.schema([
+    ('session_id', pa.int64()),
+    ('client_id', pa.int64()),
+    ('start_time', pa.timestamp('us', tz='UTC')),
+    ('goals', pa.list_(pa.int64())),
+    ('bounced', pa.bool_()),
+    ('duration_sec', pa.int32()),
+    ('device_category', pa.dictionary(pa.int32(), pa.string())),
+    ('browser', pa.dictionary(pa.int32(), pa.string())),
+    ('os', pa.dictionary(pa.int32(), pa.string())),
+    ('entry_page', pa.dictionary(pa.int32(), pa.string())),
+])
+# Поле модели -> колонка снимка
+SESSION_FIELDS = {
+    'id': 'session_id', 'client_id': 'client_id', 'start_time': 'start_time', 'goals_id': 'goals',
+    'bounced': 'bounced', 'duration_sec': 'duration_sec', 'device_category': 'device_category',
+    'browser': 'browser', 'os': 'os', 'entry_page': 'entry_page',
+}
+HIT_FIELDS = {
+    'id': 'id', 'session_id': 'session_id', 'timestamp': 'timestamp', 'url_id': 'url_id',
+    'time_on_page': 'time_on_page', 'is_exit': 'is_exit', 'scroll_depth': 'scroll_depth',
+    'page_title': 'page_title', 'agent_id': 'agent_id',
+}
+READ_CHUNK = 50000
+
+# Сессия и хит из снимка с теми атрибутами, которые читают воронки и поиск путей
+# (время - aware datetime в UTC, как у ORM при USE_TZ; url - объект справочника Url)
+SnapshotSession = namedtuple('SnapshotSession', 'id client_id start_time goals_id')
+SnapshotHit = namedtuple('SnapshotHit', 'url timestamp')
+
+
+def snapshot_dir(version_id: int) -> Optional[str]:
+    """Каталог снимков версии (свой для каждой БД - id версий в разных БД совпадают) или None, если снимки выключены."""
+    root = getattr(settings, 'HIT_SNAPSHOT_DIR', '')
+    if not root:
+        return None
+    database = re.sub(r'\W+', '_', str(connection.settings_dict['NAME'])).strip('_')[-80:]
+    return os.path.join(root, database or 'default', f'v{version_id}')
+
+
+def _path(version_id: int, name: str) -> Optional[str]:
+    directory = snapshot_dir(version_id)
+    return os.path.join(directory, f'{name}.arrow') if directory else None
+
+
+def _write_table(path: str, table: pa.Table):
+    # Во временный файл и os.replace: читатель никогда не увидит недописанный снимок
+    tmp = f'{path}.tmp'
+    with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+    os.replace(tmp, path)
+
+
+def _read_table(queryset, fields: Dict[str, str], schema: pa.Schema) -> pa.Table:
+    """
+    Поля queryset (fields: поле модели -> колонка) таблицей Arrow: строки читаются порциями
+    по READ_CHUNK и сразу становятся колонками (строки - без словаря, его строит приведение к schema).
+    """
+    types = {
+        name: pa.string() if pa.types.is_dictionary(schema.field(name).type) else schema.field(name).type
+        for name in fields.values()
+    }
+    parts: Dict[str, list] = {name: [] for name in fields.values()}
+    rows = queryset.values_list(*fields).iterator(chunk_size=READ_CHUNK)
+    while True:
+        chunk = list(islice(rows, READ_CHUNK))
+        if not chunk:
+            break
+        for name, values in zip(fields.values(), zip(*chunk)):
+            parts[name].append(pa.array(values, type=types[name]))
+    return pa.table({
+        name: pa.concat_arrays(chunks) if chunks else pa.array([], type=types[name])
+        for name, chunks in parts.items()
+    })
+
+
+def write_snapshot(version) -> Dict[str, int]:
+    """Пишет снимок версии из БД. Возвращает {'sessions': n, 'hits': n} ({} если снимки выключены)."""
+    directory = snapshot_dir(version.id)
+    if directory is None:
+        return {}
+    os.makedirs(directory, exist_ok=True)
+
+    sessions = _read_table(
+        VisitSession.objects.filter(version=version).order_by('id'), SESSION_FIELDS, SESSIONS_SCHEMA,
+    ).cast(SESSIONS_SCHEMA)
+    _write_table(_path(version.id, 'sessions'), sessions)
+
+    hits = _read_table(PageHit.objects.filter(version=version), HIT_FIELDS, HITS_SCHEMA)
+    hit_sessions = column(hits, 'session_id')
+    order = np.lexsort((column(hits, 'id'), column(hits, 'timestamp'), hit_sessions))
+    # client_id хита - из его сессии (session_id сессий отсортированы)
+    session_ids, client_ids = column(sessions, 'session_id'), column(sessions, 'client_id')
+    position = np.searchsorted(session_ids, hit_sessions[order]).clip(0, max(len(session_ids) - 1, 0))
+    hit_clients = client_ids[position] if len(session_ids) else np.zeros(len(order), dtype=np.int64)
+    hits = hits.take(order).add_column(2, 'client_id', pa.array(hit_clients, type=pa.int64()))
+    _write_table(_path(version.id, 'hits'), hits.cast(HITS_SCHEMA))
+    return {'sessions': sessions.num_rows, 'hits': hits.num_rows}
+
+
+def drop_snapshot(version_id: int):
+    """Удаляет снимок версии (данные версии в БД меняются)."""
+    directory = snapshot_dir(version_id)
+    if directory and os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def read_table(version_id: int, name: str, columns: Optional[List[str]] = None) -> Optional[pa.Table]:
+    """Таблица снимка ('hits' или 'sessions') через memory map или None, если снимка нет."""
+    path = _path(version_id, name)
+    if path is None or not os.path.exists(path):
+        return None
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.select(columns) if columns else table
+
+
+def read_hits(version_id: int, columns: Optional[List[str]] = None) -> Optional[pa.Table]:
+    """Хиты версии из снимка (в порядке session_id, timestamp, id) или None."""
+    return read_table(version_id, 'hits', columns)
+
+
+def read_sessions(version_id: int, columns: Optional[List[str]] = None) -> Optional[pa.Table]:
+    """Сессии версии из снимка (по session_id) или None."""
+    return read_table(version_id, 'sessions', columns)
+
+
+def column(table: pa.Table, name: str) -> np.ndarray:
+    """Колонка таблицы как numpy-массив (для одного record batch - без копирования)."""
+    chunked = table.column(name)
+    if chunked.num_chunks == 1:
+        return chunked.chunk(0).to_numpy(zero_copy_only=False)
+    return chunked.to_numpy()
+
+
+def url_values(url_ids: np.ndarray, field: str) -> Dict[int, str]:
+    """{url_id: значение поля Url} для уникальных id массива - один запрос к справочнику."""
+    urls = Url.objects.only('id', field).in_bulk(np.unique(url_ids).tolist()) if len(url_ids) else {}
+    return {pk: getattr(url, field) for pk, url in urls.items()}
+
+
+def iter_session_hits(
+    version_id: int, client_ids: Optional[Iterable[int]] = None,
+) -> Optional[Iterator[Tuple[SnapshotSession, List[SnapshotHit]]]]:
+    """
+    (сессия, ее хиты по времени) для сессий версии (опционально - только клиентов client_ids)
+    или None, если снимка нет. Хиты несут объект Url, поэтому код, написанный для PageHit
+    с select_related('url'), работает с ними без изменений.
+    """
+    sessions = read_sessions(version_id)
+    hits = read_hits(version_id, ['session_id', 'timestamp', 'url_id'])
+    if sessions is None or hits is None:
+        return None
+    if client_ids is not None:
+        wanted = pa.array(sorted({int(client_id) for client_id in client_ids}), type=pa.int64())
+        sessions = sessions.filter(pc.is_in(sessions.column('client_id'), value_set=wanted))
+
+    hit_sessions = column(hits, 'session_id')
+    url_ids = column(hits, 'url_id')
+    timestamps = column(hits, 'timestamp')
+    session_ids = column(sessions, 'session_id')
+    starts = np.searchsorted(hit_sessions, session_ids, side='left')
+    ends = np.searchsorted(hit_sessions, session_ids, side='right')
+    urls = Url.objects.in_bulk(np.unique(url_ids).tolist()) if len(url_ids) else {}
+
+    def generate():
+        rows = zip(
+            session_ids.tolist(), column(sessions, 'client_id').tolist(),
+            column(sessions, 'start_time').tolist(), sessions.column('goals').to_pylist(),
+            starts.tolist(), ends.tolist(),
+        )
+        for session_id, client_id, start_time, goals, start, end in rows:
+            session_hits = [
+                SnapshotHit(urls[url_id], timestamp.replace(tzinfo=timezone.utc))
+                for url_id, timestamp in zip(url_ids[start:end].tolist(), timestamps[start:end].tolist())
+            ]
+            session = SnapshotSession(session_id, client_id, start_time.replace(tzinfo=timezone.utc), goals)
+            yield session, session_hits
+
+    return generate()
+
+
+__all__ = [
+    'HITS_SCHEMA', 'SESSIONS_SCHEMA', 'SnapshotSession', 'SnapshotHit', 'snapshot_dir', 'write_snapshot', 'drop_snapshot',
+    'read_table', 'read_hits', 'read_sessions', 'column', 'url_values', 'iter_session_hits',
+]
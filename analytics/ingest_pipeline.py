@@ -0,0 +1,166 @@
+"""
+Конвейер загрузки: чтение -> преобразование -> запись в БД с перекрытием стадий.
+Поток-читатель декодирует Arrow-батчи, основной поток строит строки, один или
+несколько потоков-писателей отправляют их в БД. Между стадиями - ограниченные
+очереди, поэтому запись батча N идет одновременно с чтением батча N+1, а память
+ограничена размером очередей.
+"""
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List, Optional
+
+from django.db import connection
+
+DEFAULT_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    """Счетчики стадии: батчи, строки и время работы (без ожидания в очередях)."""
+    name: str
+    threads: int = 1
+    batches: int = 0
+    rows: int = 0
+    busy_sec: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, rows: int, seconds: float):
+        with self._lock:
+            self.batches += 1
+            self.rows += rows
+            self.busy_sec += seconds
+
+    @property
+    def rows_per_sec(self) -> float:
+        # Потоки стадии работают параллельно - пропускная способность считается на всю стадию
+        wall = self.busy_sec / max(self.threads, 1)
+        return self.rows / wall if wall > 0 else 0.0
+
+    def summary(self) -> str:
+        threads = f" x{self.threads}" if self.threads > 1 else ""
+        return (
+            f"{self.name}{threads}: {self.rows} rows in {self.batches} batches, "
+            f"busy {self.busy_sec:.2f}s ({self.rows_per_sec:,.0f} rows/s)"
+        )
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """put с проверкой остановки, чтобы упавшая стадия не подвесила остальные."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event) -> Any:
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def _size(item: Any) -> int:
+    try:
+        return len(item)
+    except TypeError:
+        return 1
+
+
+def run_pipeline(source: Iterable, transform: Callable[[Any], Optional[Any]],
+                 write: Callable[[Any], int], writers: int = 1,
+                 queue_size: int = DEFAULT_QUEUE_SIZE) -> List[StageStats]:
+    """
+    Прогоняет батчи source через transform (в текущем потоке) и write (в writers потоках).
+    transform может вернуть None - батч пропускается. write возвращает число записанных строк.
+    Каждый поток-писатель закрывает свое соединение с БД по завершении.
+    Первая ошибка любой стадии останавливает конвейер и пробрасывается наружу.
+    Возвращает статистику стадий [read, transform, write].
+    """
+    writers = max(1, writers)
+    read_stats = StageStats('read')
+    transform_stats = StageStats('transform')
+    write_stats = StageStats('write', threads=writers)
+    raw_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    rows_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def fail(exc: BaseException):
+        errors.append(exc)
+        stop.set()
+
+    def reader():
+        try:
+            iterator = iter(source)
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                read_stats.add(_size(item), time.perf_counter() - started)
+                if not _put(raw_q, item, stop):
+                    break
+        except BaseException as exc:
+            fail(exc)
+        finally:
+            _put(raw_q, _DONE, stop)
+
+    def writer():
+        try:
+            while True:
+                item = _get(rows_q, stop)
+                if item is _DONE:
+                    break
+                started = time.perf_counter()
+                written = write(item)
+                write_stats.add(written, time.perf_counter() - started)
+        except BaseException as exc:
+            fail(exc)
+        finally:
+            # Соединения Django привязаны к потоку - закрываем свое
+            connection.close()
+
+    threads = [threading.Thread(target=reader, name='ingest-reader', daemon=True)]
+    threads += [
+        threading.Thread(target=writer, name=f'ingest-writer-{idx}', daemon=True)
+        for idx in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = _get(raw_q, stop)
+            if item is _DONE:
+                break
+            started = time.perf_counter()
+            rows = transform(item)
+            if rows is None:
+                continue
+            transform_stats.add(_size(rows), time.perf_counter() - started)
+            if not _put(rows_q, rows, stop):
+                break
+    except BaseException as exc:
+        fail(exc)
+    finally:
+        for _ in range(writers):
+            _put(rows_q, _DONE, stop)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return [read_stats, transform_stats, write_stats]
+
+
+__all__ = ['DEFAULT_QUEUE_SIZE', 'StageStats', 'run_pipeline']
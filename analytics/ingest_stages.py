@@ -0,0 +1,96 @@
+"""
+Стадии ingest_data с отметками в БД (IngestRun/IngestStage).
+Каждая стадия фиксирует статус и длительность, поэтому после падения поздней стадии
+(например, ошибки YandexGPT в анализе) запуск можно продолжить с --resume,
+а отдельные стадии - перезапустить через --only-stage/--from-stage.
+"""
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Set
+
+from django.utils import timezone
+
+from analytics.models import IngestRun, IngestStage
+
+# Порядок стадий ingest_data. load - визиты и хиты вместе: хиты привязываются к визитам
+# через маппинг counterUserIDHash, который живет только в памяти загрузки;
+# snapshot - колоночный снимок хитов для чтения аналитикой (hit_snapshot.py), уже с time_on_page
+STAGES = ('load', 'time_on_page', 'snapshot', 'page_metrics', 'analysis', 'lifecycle', 'cohorts', 'daily_stats')
+
+
+def select_stages(only: Optional[Iterable[str]] = None, start: Optional[str] = None) -> List[str]:
+    """Стадии к запуску: только перечисленные (only) или начиная со start, в порядке STAGES."""
+    if only:
+        wanted = set(only)
+        return [name for name in STAGES if name in wanted]
+    if start:
+        return list(STAGES[STAGES.index(start):])
+    return list(STAGES)
+
+
+def start_run(version, options: dict) -> IngestRun:
+    return IngestRun.objects.create(version=version, options=options)
+
+
+def last_unfinished_run(version) -> Optional[IngestRun]:
+    """Последний запуск версии, если он не завершился успешно (для --resume)."""
+    run = IngestRun.objects.filter(version=version).first()
+    if run is None or run.status == 'DONE':
+        return None
+    return run
+
+
+def completed_stages(run: IngestRun) -> Set[str]:
+    return set(run.stages.filter(status='DONE').values_list('name', flat=True))
+
+
+def skip_stage(run: IngestRun, name: str):
+    IngestStage.objects.update_or_create(
+        run=run, name=name,
+        defaults={'status': 'SKIPPED', 'error': '', 'started_at': None, 'finished_at': None, 'duration_sec': None},
+    )
+
+
+@contextmanager
+def stage(run: IngestRun, name: str):
+    """
+    Выполняет блок как стадию запуска: RUNNING -> DONE с длительностью,
+    при исключении - FAILED с текстом ошибки (и у стадии, и у запуска), исключение пробрасывается.
+    """
+    record, _ = IngestStage.objects.update_or_create(
+        run=run, name=name,
+        defaults={'status': 'RUNNING', 'error': '', 'started_at': timezone.now(), 'finished_at': None,
+                  'duration_sec': None},
+    )
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        error = traceback.format_exc()
+        record.status = 'FAILED'
+        record.error = error
+        record.finished_at = timezone.now()
+        record.duration_sec = time.perf_counter() - started
+        record.save()
+        run.status = 'FAILED'
+        run.error = error
+        run.save(update_fields=['status', 'error'])
+        raise
+    record.status = 'DONE'
+    record.finished_at = timezone.now()
+    record.duration_sec = time.perf_counter() - started
+    record.save()
+
+
+def finish_run(run: IngestRun):
+    run.status = 'DONE'
+    run.error = ''
+    run.finished_at = timezone.now()
+    run.save(update_fields=['status', 'error', 'finished_at'])
+
+
+__all__ = [
+    'STAGES', 'select_stages', 'start_run', 'last_unfinished_run', 'completed_stages',
+    'skip_stage', 'stage', 'finish_run',
+]
@@ -0,0 +1,374 @@
+"""
+Колоночные преобразования для ingest_data.
+Все поля чистятся целыми массивами (NaN -> None, размеры экрана > 0, bounce -> bool,
+разбор goalsID), а на выходе получаются готовые кортежи для вставки - без iterrows().
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Порядок полей в кортежах строк (совпадает с именами полей моделей)
+VISIT_FIELDS = (
+    'visit_id', 'client_id', 'start_time', 'duration_sec', 'device_category', 'source',
+    'bounced', 'page_views', 'browser', 'os', 'screen_width', 'screen_height',
+    'screen_format', 'is_returning_visitor', 'entry_page', 'exit_page',
+    'traffic_source', 'network_type', 'goals_id',
+)
+
+HIT_FIELDS = (
+    'session_id', 'timestamp', 'url_id', 'page_title', 'action_type', 'referrer_url', 'agent_id',
+)
+# Поля, которые можно посчитать до вставки, когда все хиты версии в памяти (см. session_time_columns)
+HIT_TIME_FIELDS = ('time_on_page', 'is_exit')
+
+# Колонки, которые нужны эвристикам и кластеризации после загрузки в БД.
+# Тяжелые строки (ym:pv:title, ym:pv:params, referer) анализу не нужны - их не держим.
+ANALYSIS_VISIT_COLUMNS = (
+    'ym:s:visitID', 'ym:s:clientID', 'ym:s:visitDuration', 'ym:s:bounce',
+    'ym:s:pageViews', 'ym:s:goalsID', 'ym:s:startURL', 'client_id_norm',
+)
+ANALYSIS_HIT_COLUMNS = ('ym:pv:clientID', 'ym:pv:dateTime', 'ym:pv:URL', 'client_id_norm')
+
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    """Колонка DataFrame или пустая (NaN) серия той же длины, если колонки нет."""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+
+_INT64_MAX = np.iinfo(np.int64).max
+_UINT64_SPAN = 2 ** 64
+_DIGITS_RE = r'^-?\d+$'
+
+
+def _floats_to_keys(nums: np.ndarray) -> pd.arrays.IntegerArray:
+    """
+    float64 -> Int64 (округление как у f"{x:.0f}"), NaN/inf/переполнение -> NA.
+    Значения из [2^63, 2^64) (uint64-идентификаторы Метрики) хранятся как int64 с тем же битовым образом.
+    """
+    ok = np.isfinite(nums) & (nums >= -2.0 ** 63) & (nums < 2.0 ** 64)
+    out = np.zeros(len(nums), dtype=np.int64)
+    rounded = np.round(nums[ok])
+    high = rounded >= 2.0 ** 63
+    values = np.empty(len(rounded), dtype=np.int64)
+    values[~high] = rounded[~high].astype(np.int64)
+    values[high] = rounded[high].astype(np.uint64).view(np.int64)
+    out[ok] = values
+    return pd.arrays.IntegerArray(out, ~ok)
+
+
+def key_images(keys: np.ndarray) -> np.ndarray:
+    """int64-ключи -> float64, как их видит Метрика в float-колонках (ключ - битовый образ uint64)."""
+    return keys.astype(np.int64).view(np.uint64).astype(np.float64)
+
+
+def normalize_client_ids(values: pd.Series) -> pd.Series:
+    """
+    Векторная нормализация clientID/counterUserIDHash/visitID в компактный int64-ключ (Int64, NA - пусто).
+    Без потерь для всего диапазона uint64: значения выше 2^63 - 1 хранятся как int64 с тем же
+    битовым образом (отрицательные числа), а не отбрасываются; в БД это BigIntegerField.
+    - целые колонки берутся как есть (без потери точности выше 2^53);
+    - float (в т.ч. научная нотация в hits) округляются до целого;
+    - строки из цифр (в т.ч. с хвостом ".0") разбираются точно, прочие - через float;
+      нечисловые строки дают NA.
+    """
+    if pd.api.types.is_bool_dtype(values):
+        values = values.astype('float64')
+    if pd.api.types.is_integer_dtype(values):
+        if pd.api.types.is_unsigned_integer_dtype(values):
+            mask = values.isna().to_numpy()
+            ints = values.where(~mask, 0).to_numpy(dtype=np.uint64).view(np.int64)
+            return pd.Series(pd.arrays.IntegerArray(ints, mask), index=values.index)
+        return values.astype('Int64')
+    if pd.api.types.is_float_dtype(values):
+        return pd.Series(_floats_to_keys(values.to_numpy(dtype='float64', na_value=np.nan)), index=values.index)
+
+    text = values.astype('string').str.strip().str.replace(r'\.0+$', '', regex=True)
+    digits = text.str.match(_DIGITS_RE).fillna(False).to_numpy(dtype=bool)
+    result = pd.Series(pd.NA, index=values.index, dtype='Int64')
+    if digits.any():
+        # Точный разбор: через Python int, без промежуточного float
+        exact = [int(v) for v in text[digits].tolist()]
+        exact = [
+            v if -_INT64_MAX <= v <= _INT64_MAX else v - _UINT64_SPAN if _INT64_MAX < v < _UINT64_SPAN else None
+            for v in exact
+        ]
+        result[digits] = pd.array(exact, dtype='Int64')
+    rest = ~digits & text.notna().to_numpy()
+    if rest.any():
+        nums = pd.to_numeric(text[rest], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        result[rest] = _floats_to_keys(nums)
+    return result
+
+
+def build_key_index(exact_keys: pd.Series) -> Tuple[pd.Index, pd.Series]:
+    """
+    Индекс точных ключей для canonicalize_keys: (множество ключей, "float-образ -> точный ключ").
+    Float-образ - то, во что превращается точный int64 после прохода через float64
+    (так clientID приходят в hits). При совпадении образов побеждает последний.
+    """
+    exact = pd.Series(exact_keys, dtype='Int64').dropna().drop_duplicates()
+    images = _floats_to_keys(key_images(exact.to_numpy(dtype=np.int64)))
+    lookup = pd.Series(exact.to_numpy(), index=pd.Index(images))
+    lookup = lookup[lookup.index.notna()]
+    lookup = lookup[~lookup.index.duplicated(keep='last')].astype('Int64')
+    return pd.Index(exact), lookup
+
+
+def canonicalize_keys(keys: pd.Series, key_index: Tuple[pd.Index, pd.Series]) -> pd.Series:
+    """
+    Приводит ключи, прошедшие через float (потеря точности выше 2^53), к точным ключам.
+    Ключ, который уже есть среди точных, не меняется; иначе ищется по float-образу;
+    не найденный остается как есть.
+    """
+    exact, lookup = key_index
+    if keys.empty or lookup.empty:
+        return keys
+    known = keys.isin(exact).to_numpy()
+    mapped = keys.map(lookup).astype('Int64')
+    return keys.where(known | mapped.isna().to_numpy(), mapped)
+
+
+def prepare_frame(df: pd.DataFrame, prefix: str) -> pd.DataFrame:
+    """
+    Общая подготовка визитов (prefix='ym:s:') и хитов (prefix='ym:pv:'):
+    dateTime -> UTC, clientID/counterUserIDHash -> int64-ключи (Int64),
+    строки без clientID отбрасываются.
+    """
+    df[f'{prefix}dateTime'] = pd.to_datetime(df[f'{prefix}dateTime'], utc=True, errors='coerce')
+    df['client_id_norm'] = normalize_client_ids(df[f'{prefix}clientID'])
+    df = df[df['client_id_norm'].notna()].copy()
+    df[f'{prefix}clientID'] = df['client_id_norm']
+    if f'{prefix}counterUserIDHash' in df.columns:
+        df['counter_user_hash'] = normalize_client_ids(df[f'{prefix}counterUserIDHash'])
+    else:
+        df['counter_user_hash'] = pd.Series(pd.NA, index=df.index, dtype='Int64')
+    return df
+
+
+def align_hit_keys(df_hits: pd.DataFrame, client_index: Tuple[pd.Index, pd.Series],
+                   hash_index: Tuple[pd.Index, pd.Series]) -> pd.DataFrame:
+    """
+    Подтягивает ключи хитов (clientID часто приходит float'ом) к точным ключам визитов,
+    чтобы join'ы и эвристики видели одних и тех же клиентов.
+    """
+    df_hits['client_id_norm'] = canonicalize_keys(df_hits['client_id_norm'], client_index)
+    df_hits['ym:pv:clientID'] = df_hits['client_id_norm']
+    df_hits['counter_user_hash'] = canonicalize_keys(df_hits['counter_user_hash'], hash_index)
+    return df_hits
+
+
+def analysis_frame(df: pd.DataFrame, columns) -> pd.DataFrame:
+    """Оставляет только колонки, нужные анализу (отсутствующие пропускаются)."""
+    return df[[c for c in columns if c in df.columns]].copy()
+
+
+def clean_text(values: pd.Series, empty_as_none: bool = True, default: Optional[str] = None) -> np.ndarray:
+    """NaN (и пустые строки) -> default, остальное -> str. Возвращает object-массив."""
+    out = np.full(len(values), default, dtype=object)
+    mask = values.notna().to_numpy()
+    if mask.any():
+        text = values[mask].astype(str).to_numpy(dtype=object)
+        if empty_as_none:
+            keep = text != ''
+            idx = np.flatnonzero(mask)
+            out[idx[keep]] = text[keep]
+        else:
+            out[mask] = text
+    return out
+
+
+def positive_int(values: pd.Series) -> np.ndarray:
+    """Целые > 0, всё остальное (NaN, 0, мусор) -> None."""
+    nums = pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    out = np.full(len(nums), None, dtype=object)
+    mask = nums > 0
+    if mask.any():
+        out[mask] = nums[mask].astype(np.int64).tolist()
+    return out
+
+
+def to_int(values: pd.Series, default: int = 0) -> np.ndarray:
+    """Целые с заменой NaN на default."""
+    nums = pd.to_numeric(values, errors='coerce').fillna(default)
+    return nums.to_numpy().astype(np.int64)
+
+
+def to_flag(values: pd.Series, default: bool = False) -> np.ndarray:
+    """0/1/True/False -> bool, NaN -> default."""
+    nums = pd.to_numeric(values, errors='coerce')
+    out = nums.fillna(1 if default else 0).to_numpy() != 0
+    return out
+
+
+def to_datetimes(values: pd.Series) -> np.ndarray:
+    """UTC-aware datetime-объекты, NaT -> None."""
+    ts = pd.to_datetime(values, utc=True, errors='coerce')
+    out = ts.astype(object).to_numpy(copy=True)
+    out[ts.isna().to_numpy()] = None
+    return out
+
+
+def parse_goals(values: pd.Series) -> List[List[int]]:
+    """
+    Разбирает ym:s:goalsID колонкой целиком.
+    Поддерживает строки вида "[123, 456]", списки/массивы из Arrow и одиночные числа.
+    Нули и нечисловой мусор отбрасываются (как в прежнем построчном разборе).
+    """
+    n = len(values)
+    result: List[List[int]] = [[] for _ in range(n)]
+    if n == 0:
+        return result
+
+    values = values.reset_index(drop=True)
+    if pd.api.types.is_numeric_dtype(values):
+        nums = pd.to_numeric(values, errors='coerce')
+        for pos, val in nums[nums > 0].astype(np.int64).items():
+            result[pos] = [int(val)]
+        return result
+
+    text = values.where(values.notna(), '').astype(str)
+    found = text.str.findall(r'\d+').explode()
+    nums = pd.to_numeric(found, errors='coerce')
+    nums = nums[nums > 0].astype(np.int64)
+    if nums.empty:
+        return result
+    for pos, goals in nums.groupby(level=0).agg(list).items():
+        result[pos] = [int(g) for g in goals]
+    return result
+
+
+def build_visit_columns(df_visits: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Чистит все поля визитов и возвращает {поле модели: массив значений}."""
+    is_new = pd.to_numeric(_column(df_visits, 'ym:s:isNewUser'), errors='coerce')
+    return {
+        # Визит без visitID получает 0 (как раньше пустую строку): уникальность (версия, visit_id) оставит один
+        'visit_id': normalize_client_ids(_column(df_visits, 'ym:s:visitID')).fillna(0).to_numpy(dtype=np.int64),
+        'client_id': df_visits['client_id_norm'].to_numpy(dtype=np.int64),
+        'start_time': to_datetimes(_column(df_visits, 'ym:s:dateTime')),
+        'duration_sec': to_int(_column(df_visits, 'ym:s:visitDuration')),
+        'device_category': clean_text(_column(df_visits, 'ym:s:deviceCategory'), default='unknown'),
+        'source': clean_text(_column(df_visits, 'ym:s:referer'), empty_as_none=False),
+        'bounced': to_flag(_column(df_visits, 'ym:s:bounce')),
+        'page_views': to_int(_column(df_visits, 'ym:s:pageViews')),
+        'browser': clean_text(_column(df_visits, 'ym:s:browser')),
+        'os': clean_text(_column(df_visits, 'ym:s:operatingSystem')),
+        'screen_width': positive_int(_column(df_visits, 'ym:s:screenWidth')),
+        'screen_height': positive_int(_column(df_visits, 'ym:s:screenHeight')),
+        'screen_format': clean_text(_column(df_visits, 'ym:s:screenFormat')),
+        'is_returning_visitor': (is_new.notna() & (is_new == 0)).to_numpy(),
+        'entry_page': clean_text(_column(df_visits, 'ym:s:startURL')),
+        'exit_page': clean_text(_column(df_visits, 'ym:s:endURL')),
+        'traffic_source': clean_text(_column(df_visits, 'ym:s:lastsignReferalSource')),
+        'network_type': clean_text(_column(df_visits, 'ym:s:networkType')),
+        'goals_id': parse_goals(_column(df_visits, 'ym:s:goalsID')),
+    }
+
+
+def resolve_session_ids(df_hits: pd.DataFrame, hash_to_visit_pk: Dict, client_to_visit_pk: Dict) -> pd.Series:
+    """
+    Сопоставляет хиты сессиям: сначала по counterUserIDHash, затем по clientID
+    (ключи словарей - int64-ключи из normalize_client_ids).
+    Возвращает float-серию pk сессий (NaN - сессия не найдена).
+    """
+    by_client = df_hits['client_id_norm'].map(client_to_visit_pk).astype('float64')
+    if 'counter_user_hash' in df_hits.columns and hash_to_visit_pk:
+        by_hash = df_hits['counter_user_hash'].map(hash_to_visit_pk).astype('float64')
+        return by_hash.fillna(by_client)
+    return by_client
+
+
+def session_time_columns(session_ids: np.ndarray, timestamps: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    time_on_page и is_exit для хитов всех сессий сразу (та же семантика, что у SQL в
+    calculate_time_on_page): секунды до следующего, строго более позднего хита сессии
+    (0 у последнего) и флаг последнего хита сессии (при равном времени - последний по порядку).
+    """
+    n = len(session_ids)
+    time_on_page = np.zeros(n, dtype=np.int64)
+    is_exit = np.zeros(n, dtype=bool)
+    if n == 0:
+        return time_on_page, is_exit
+
+    sid = np.asarray(session_ids, dtype=np.int64)
+    ts = pd.to_datetime(timestamps, utc=True).dt.as_unit('ns').astype('int64').to_numpy()
+    order = np.lexsort((ts, sid))  # устойчивая сортировка по (сессия, время)
+    s, t = sid[order], ts[order]
+
+    # Серии хитов с одинаковым (сессия, время): следующий момент - начало следующей серии той же сессии
+    same_session = s[1:] == s[:-1]
+    run_start = np.concatenate(([True], ~same_session | (t[1:] != t[:-1])))
+    run_idx = np.flatnonzero(run_start)
+    run_s, run_t = s[run_idx], t[run_idx]
+    has_next = np.concatenate((run_s[1:] == run_s[:-1], [False]))
+    gap = np.zeros(len(run_idx), dtype=np.int64)
+    gap[has_next] = np.rint((run_t[1:][has_next[:-1]] - run_t[:-1][has_next[:-1]]) / 1e9).astype(np.int64)
+
+    time_on_page[order] = gap[np.cumsum(run_start) - 1]
+    is_exit[order] = np.concatenate((~same_session, [True]))
+    return time_on_page, is_exit
+
+
+def build_hit_columns(df_hits: pd.DataFrame, session_ids: pd.Series) -> Dict[str, np.ndarray]:
+    """
+    Чистит поля хитов (только строк с найденной сессией) и возвращает {поле модели: массив}.
+    Если в кадре уже есть колонки HIT_TIME_FIELDS, они тоже попадают в результат.
+    url - строки адресов: в url_id их превращает url_intern.url_ids (нужна БД);
+    browser/os/screen_*/device_category - в agent_id через agent_intern.agent_ids.
+    """
+    mask = session_ids.notna().to_numpy()
+    df = df_hits[mask]
+    time_columns = {
+        field: df[field].to_numpy(copy=True) for field in HIT_TIME_FIELDS if field in df.columns
+    }
+    return {
+        **time_columns,
+        'session_id': session_ids[mask].to_numpy().astype(np.int64),
+        'timestamp': to_datetimes(_column(df, 'ym:pv:dateTime')),
+        'url': clean_text(_column(df, 'ym:pv:URL'), empty_as_none=False, default=''),
+        'page_title': clean_text(_column(df, 'ym:pv:title'), empty_as_none=False),
+        'action_type': np.full(len(df), 'view', dtype=object),
+        'referrer_url': clean_text(_column(df, 'ym:pv:referer')),
+        'browser': clean_text(_column(df, 'ym:pv:browser')),
+        'os': clean_text(_column(df, 'ym:pv:operatingSystem')),
+        'screen_width': positive_int(_column(df, 'ym:pv:screenWidth')),
+        'screen_height': positive_int(_column(df, 'ym:pv:screenHeight')),
+        'device_category': clean_text(_column(df, 'ym:pv:deviceCategory')),
+    }
+
+
+def columns_to_rows(columns: Dict[str, np.ndarray], fields) -> List[tuple]:
+    """Склеивает колонки в список кортежей в порядке fields (значения - python-типы)."""
+    lists = []
+    for field in fields:
+        col = columns[field]
+        lists.append(col.tolist() if isinstance(col, np.ndarray) else list(col))
+    return list(zip(*lists))
+
+
+__all__ = [
+    'VISIT_FIELDS',
+    'HIT_FIELDS',
+    'HIT_TIME_FIELDS',
+    'ANALYSIS_VISIT_COLUMNS',
+    'ANALYSIS_HIT_COLUMNS',
+    'normalize_client_ids',
+    'build_key_index',
+    'canonicalize_keys',
+    'prepare_frame',
+    'align_hit_keys',
+    'analysis_frame',
+    'clean_text',
+    'positive_int',
+    'to_int',
+    'to_flag',
+    'to_datetimes',
+    'parse_goals',
+    'build_visit_columns',
+    'session_time_columns',
+    'build_hit_columns',
+    'resolve_session_ids',
+    'columns_to_rows',
+]
@@ -0,0 +1,47 @@
+"""
+Функции рабочих процессов для ingest_many.
+Модуль импортируется в дочернем процессе (spawn) до настройки Django,
+поэтому на верхнем уровне здесь нет импортов моделей.
+"""
+import io
+import time
+
+
+def init_worker():
+    """Инициализатор процесса пула: настраивает Django (своё соединение с БД на процесс)."""
+    import django
+    django.setup()
+
+
+def ingest_version(entry):
+    """Загружает одну версию командой ingest_data. Возвращает (имя, успех, секунды, вывод)."""
+    from django.core.management import call_command
+    from django.db import connections
+
+    started = time.perf_counter()
+    out = io.StringIO()
+    options = dict(entry.get('options') or {})
+    if entry.get('clear'):
+        options['clear'] = True
+    try:
+        call_command(
+            'ingest_data',
+            visits=entry['visits'],
+            hits=entry['hits'],
+            product_version=entry['name'],
+            year=entry.get('year'),
+            stdout=out,
+            stderr=out,
+            **options,
+        )
+        output = out.getvalue()
+        ok = 'CRITICAL ERROR' not in output
+    except Exception as e:
+        output = out.getvalue() + f"\nCRITICAL ERROR: {e}"
+        ok = False
+    finally:
+        connections.close_all()
+    return entry['name'], ok, time.perf_counter() - started, output
+
+
+__all__ = ['init_worker', 'ingest_version']
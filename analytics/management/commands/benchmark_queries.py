@@ -0,0 +1,107 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Avg, Count, IntegerField, Q
+from django.db.models.functions import Cast, TruncDate
+
+from analytics.models import PageHit, ProductVersion, SessionGoal, VisitSession
+
+# Индексы из миграции 0011 (составные/покрывающие + BRIN на PostgreSQL)
+QUERY_PATH_INDEXES = ('pagehit_session_ts_idx', 'visit_version_client_idx', 'visit_version_start_idx')
+POSTGRES_ONLY_INDEXES = ('visit_version_device_idx', 'visit_version_browser_idx', 'pagehit_timestamp_brin')
+
+
+def build_queries(version):
+    """Запросы, повторяющие горячие пути представлений и воронок: {имя: queryset}."""
+    sessions = VisitSession.objects.filter(version=version)
+    client_ids = list(sessions.order_by('id').values_list('client_id', flat=True)[:50])
+    first_hit = PageHit.objects.filter(version=version).order_by('timestamp').values_list(
+        'timestamp', flat=True,
+    ).first()
+    top_goal = SessionGoal.objects.filter(version=version).values_list('goal_id', flat=True).first()
+    bounce = Avg(Cast('bounced', output_field=IntegerField()))
+
+    queries = {
+        # views_helpers._compute_paths
+        'paths': PageHit.objects.filter(version_id=version.id).order_by(
+            'session_id', 'timestamp', 'id'
+        ).values('session_id', 'url__issue_url'),
+        # funnel_utils / funnel_discovery с фильтром когорты
+        'cohort_sessions': sessions.filter(client_id__in=client_ids).values('id', 'client_id', 'goals_id'),
+        # funnel_utils / сегментация: сессии с целью и число сессий по целям (SessionGoal)
+        'goal_sessions': SessionGoal.objects.filter(version=version, goal_id=top_goal).values('session_id'),
+        'goal_counts': SessionGoal.objects.filter(version=version).values('goal_id').annotate(sessions=Count('id')),
+        # calculate_daily_stats / графики по дням
+        'daily': sessions.annotate(date=TruncDate('start_time')).values('date').annotate(
+            total=Count('id'), bounces=Count('id', filter=Q(bounced=True)), duration=Avg('duration_sec'),
+        ),
+        # views_dashboard: разбивка по устройствам и браузерам
+        'by_device': sessions.values('device_category').annotate(
+            visits=Count('id'), bounce=bounce, duration=Avg('duration_sec'),
+        ),
+        'by_browser': sessions.values('browser').annotate(
+            visits=Count('id'), bounce=bounce, duration=Avg('duration_sec'),
+        ).order_by('-visits')[:5],
+    }
+    if first_hit:
+        # Диапазон по времени хитов (BRIN на PostgreSQL)
+        queries['hits_first_day'] = PageHit.objects.filter(
+            timestamp__gte=first_hit, timestamp__lt=first_hit + timedelta(days=1),
+        ).values('session_id', 'url')
+    return queries
+
+
+class Command(BaseCommand):
+    help = 'Показывает планы и время запросов аналитики с индексами из 0011 и без них (EXPLAIN)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product-version', type=str, help='Версия для запросов (по умолчанию - первая)')
+        parser.add_argument('--query', action='append', help='Только этот запрос (можно несколько раз)')
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE на PostgreSQL (выполняет запрос)')
+        parser.add_argument('--no-compare', action='store_true', help='Не показывать план без индексов')
+
+    def handle(self, *args, **options):
+        version_name = options.get('product_version')
+        versions = ProductVersion.objects.all()
+        version = (versions.filter(name=version_name) if version_name else versions.order_by('release_date')).first()
+        if version is None:
+            self.stdout.write(self.style.WARNING("⚠️  Версия не найдена."))
+            return
+
+        queries = build_queries(version)
+        if options.get('query'):
+            queries = {name: qs for name, qs in queries.items() if name in options['query']}
+        self.stdout.write(self.style.SUCCESS(
+            f"Версия {version.name}: {len(queries)} запросов, СУБД {connection.vendor}"
+        ))
+
+        analyze = options.get('analyze') and connection.vendor == 'postgresql'
+        if not options.get('no_compare'):
+            self.stdout.write(self.style.WARNING("\n=== Без индексов 0011 ==="))
+            # DDL в транзакции с откатом: индексы удаляются только на время замера
+            with transaction.atomic():
+                self.drop_indexes()
+                self.report(queries, analyze)
+                transaction.set_rollback(True)
+
+        self.stdout.write(self.style.WARNING("\n=== С индексами 0011 ==="))
+        self.report(queries, analyze)
+
+    def drop_indexes(self):
+        names = QUERY_PATH_INDEXES
+        if connection.vendor == 'postgresql':
+            names += POSTGRES_ONLY_INDEXES
+        with connection.cursor() as cursor:
+            for name in names:
+                cursor.execute(f"DROP INDEX IF EXISTS {connection.ops.quote_name(name)}")
+
+    def report(self, queries, analyze):
+        for name, queryset in queries.items():
+            started = time.perf_counter()
+            rows = len(list(queryset.all()))  # .all() - без кэша результатов прошлого замера
+            elapsed = time.perf_counter() - started
+            plan = queryset.explain(analyze=True) if analyze else queryset.explain()
+            self.stdout.write(f"\n--- {name}: {rows} строк за {elapsed * 1000:.1f} мс")
+            self.stdout.write(plan)
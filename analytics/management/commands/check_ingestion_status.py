@@ -31,7 +31,7 @@ class Command(BaseCommand):
             self.stdout.write(f"  1. VisitSession: {sessions_count} сессий")
             
             # 2. Проверка hits
-            hits_count = PageHit.objects.filter(session__version=version).count()
+            hits_count = PageHit.objects.filter(version=version).count()
             self.stdout.write(f"  2. PageHit: {hits_count} хитов")
             
             # 3. Проверка page metrics
@@ -84,7 +84,7 @@ class Command(BaseCommand):
             issues_count = UXIssue.objects.filter(version=version).count()
             if issues_count == 0:
                 sessions_count = VisitSession.objects.filter(version=version).count()
-                hits_count = PageHit.objects.filter(session__version=version).count()
+                hits_count = PageHit.objects.filter(version=version).count()
                 if sessions_count > 0 and hits_count > 0:
                     self.stdout.write(f"\n  Для версии '{version.name}':")
                     self.stdout.write(f"    - Данные загружены ({sessions_count} сессий, {hits_count} хитов)")
@@ -2,18 +2,81 @@ import pandas as pd
 import numpy as np
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from analytics.models import ProductVersion, VisitSession, PageHit, UXIssue, DailyStat, UserCohort, PageMetrics, IssueLifecycle
+from analytics.models import ProductVersion, VisitSession, PageHit, UXIssue, DailyStat, UserCohort, IssueLifecycle, IngestWatermark
 from datetime import datetime, timedelta
 import os
-import urllib.parse
-from analytics.ai_service import analyze_issue_with_ai, generate_cohort_name
-from analytics.utils import GoalParser
+import time
+from analytics.ai_service import (
+    ai_configured, analyze_issue_with_ai, generate_cohort_name, generate_stub_hypothesis, get_stub_text_variants,
+)
+from analytics.ai_enrich import enrich_concurrently
+from analytics.utils import GoalParser, normalize_issue_url
+from analytics.bulk_load import save_rows, supports_copy
+from analytics.ingest_utils import (
+    VISIT_FIELDS, HIT_FIELDS, HIT_TIME_FIELDS, ANALYSIS_VISIT_COLUMNS, ANALYSIS_HIT_COLUMNS,
+    prepare_frame, analysis_frame, build_key_index, align_hit_keys, build_visit_columns, build_hit_columns, resolve_session_ids, columns_to_rows,
+    session_time_columns,
+)
+from analytics.parquet_stream import (
+    DEFAULT_BATCH_ROWS, available_columns, count_rows, iter_frames, parquet_files, file_signature, newer_than_filter,
+)
+from analytics.analysis_frames import load_analysis_frames
+from analytics.sampling import build_sample_filters
+from analytics.ingest_pipeline import run_pipeline
+from analytics.purge import purge_version
+from analytics.partitions import ensure_version_partitions
+from analytics.url_intern import url_ids, issue_urls
+from analytics.agent_intern import agent_ids
+from analytics.session_goals import clients_with_goal, populate_session_goals
+from analytics.hit_snapshot import drop_snapshot, write_snapshot
+from analytics.hit_frame import build_hit_frame
+from analytics.detectors import PAGE_METRIC_FIELDS, resolve_detectors, required_inputs, run_detectors
+from analytics.page_index import PageMetricsIndex
+from analytics import olap
+from analytics.ingest_stages import (
+    STAGES, select_stages, start_run, last_unfinished_run, completed_stages, skip_stage, stage, finish_run,
+)
+from django.db import connection
 import traceback
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 
-MIN_PAGE_VIEWS_FOR_PAGE_ALERT = int(os.environ.get("MIN_PAGE_VIEWS_FOR_PAGE_ALERT", "30"))
-MIN_WANDERING_SESSIONS = int(os.environ.get("MIN_WANDERING_SESSIONS", "5"))
+
+# Детекторы, которые считают trend/priority относительно прошлых версий
+TREND_ISSUE_TYPES = ('RAGE_CLICK', 'LOOPING', 'NAVIGATION_BACK', 'HIGH_BOUNCE')
+
+# Visits columns - расширены для новых метрик
+VISITS_COLUMNS = [
+    'ym:s:visitID', 'ym:s:clientID', 'ym:s:counterUserIDHash', 'ym:s:dateTime',
+    'ym:s:visitDuration', 'ym:s:deviceCategory', 'ym:s:referer',
+    'ym:s:bounce', 'ym:s:pageViews', 'ym:s:goalsID',
+    # Новые поля (100% или >99% заполнено)
+    'ym:s:isNewUser',      # 100%
+    'ym:s:startURL',       # 100%
+    'ym:s:endURL',         # 100%
+    'ym:s:browser',        # 99.9%
+    'ym:s:operatingSystem', # 99.9%
+    'ym:s:screenWidth',    # 100%
+    'ym:s:screenHeight',   # 100%
+    'ym:s:screenFormat',   # 100%
+    # Поля с частичным заполнением (опционально)
+    'ym:s:lastsignReferalSource',  # 25%
+    'ym:s:networkType',            # 42%
+]
+
+# Hits columns - расширены для новых метрик
+HITS_COLUMNS = [
+    'ym:pv:clientID', 'ym:pv:counterUserIDHash', 'ym:pv:dateTime', 'ym:pv:URL',
+    'ym:pv:title',    # 68% - использовать с проверкой на null
+    # Новые поля
+    'ym:pv:referer',           # 58%
+    'ym:pv:browser',           # 99.9%
+    'ym:pv:operatingSystem',   # 99.9%
+    'ym:pv:screenWidth',       # 100%
+    'ym:pv:screenHeight',      # 100%
+    'ym:pv:deviceCategory',    # 100%
+    'ym:pv:params',            # 31% - для scroll depth (опционально)
+]
 
 class Command(BaseCommand):
     help = 'Ingests Parquet data from Yandex Metrica and runs UX analysis'
@@ -24,6 +87,21 @@ class Command(BaseCommand):
         parser.add_argument('--product-version', type=str, help='Version name (e.g., "v1.0")')
         parser.add_argument('--year', type=int, help='Year of data (e.g., 2022)')
         parser.add_argument('--clear', action='store_true', help='Clear existing data for this version before loading')
+        parser.add_argument('--no-copy', action='store_true', help='Use ORM bulk_create instead of COPY even on PostgreSQL')
+        parser.add_argument('--stream', action='store_true', help='Read parquet files batch by batch (memory bounded by --batch-rows)')
+        parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS, help='Rows per record batch in --stream mode')
+        parser.add_argument('--pipeline', action='store_true', help='Overlap parquet decode, row building and DB writes (implies --stream)')
+        parser.add_argument('--writers', type=int, default=1, help='DB writer threads in --pipeline mode')
+        parser.add_argument(
+            '--append', action='store_true',
+            help='Load only files/rows newer than the version watermark and update metrics and issues incrementally',
+        )
+        parser.add_argument('--resume', action='store_true', help='Continue the last unfinished run, skipping completed stages')
+        parser.add_argument(
+            '--only-stage', action='append', choices=STAGES,
+            help='Run only this stage (repeatable); skipped load stages read data from the DB',
+        )
+        parser.add_argument('--from-stage', choices=STAGES, help='Run this stage and all following ones')
 
     def handle(self, *args, **options):
         self.stdout.write("DEBUG: Command started")
@@ -39,6 +117,14 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR('Please provide --visits, --hits and --product-version'))
             return
 
+        partial = options.get('resume') or options.get('only_stage') or options.get('from_stage')
+        if options.get('only_stage') and options.get('from_stage'):
+            self.stdout.write(self.style.ERROR('Use either --only-stage or --from-stage'))
+            return
+        if partial and (options.get('clear') or options.get('append')):
+            self.stdout.write(self.style.ERROR('--resume/--only-stage/--from-stage cannot be combined with --clear or --append'))
+            return
+
         self.stdout.write(f"Starting ingestion for {version_name}...")
 
         try:
@@ -54,453 +140,638 @@ class Command(BaseCommand):
                 defaults={'release_date': datetime(year, 1, 1), 'is_active': True}
             )
             self.stdout.write(f"DEBUG: ProductVersion created: {version.id}")
+
+            # На PostgreSQL сессии и хиты секционированы по версии - секции создаются по требованию
+            created_partitions = ensure_version_partitions(version)
+            if created_partitions:
+                self.stdout.write(f"Created partitions: {', '.join(created_partitions)}")
             
             # 1.5. Clear existing data if --clear flag is set
             if options.get('clear', False):
                 self.stdout.write(self.style.WARNING(f"Clearing existing data for version {version_name}..."))
-                UXIssue.objects.filter(version=version).delete()
-                PageMetrics.objects.filter(version=version).delete()
-                UserCohort.objects.filter(version=version).delete()
-                DailyStat.objects.filter(version=version).delete()
-                PageHit.objects.filter(session__version=version).delete()
-                VisitSession.objects.filter(version=version).delete()
-                self.stdout.write(self.style.SUCCESS("✅ Existing data cleared."))
-
-            # 2. Load Data (Using Pandas)
-            self.stdout.write(f"Loading Parquet files from {visits_path}...")
+                counts, seconds = purge_version(version)
+                removed = ", ".join(f"{name}={count}" for name, count in counts.items() if count)
+                self.stdout.write(self.style.SUCCESS(
+                    f"✅ Existing data cleared in {seconds:.2f}s ({sum(counts.values())} rows: {removed or 'none'})."
+                ))
+
+            # 2. Load Data
             if not os.path.exists(visits_path):
                  self.stdout.write(self.style.ERROR(f"File not found: {visits_path}"))
                  return
-            
-            # Visits columns - расширены для новых метрик
-            visits_columns = [
-                'ym:s:visitID', 'ym:s:clientID', 'ym:s:counterUserIDHash', 'ym:s:dateTime', 
-                'ym:s:visitDuration', 'ym:s:deviceCategory', 'ym:s:referer', 
-                'ym:s:bounce', 'ym:s:pageViews', 'ym:s:goalsID',
-                # Новые поля (100% или >99% заполнено)
-                'ym:s:isNewUser',      # 100%
-                'ym:s:startURL',       # 100%
-                'ym:s:endURL',         # 100%
-                'ym:s:browser',        # 99.9%
-                'ym:s:operatingSystem', # 99.9%
-                'ym:s:screenWidth',    # 100%
-                'ym:s:screenHeight',   # 100%
-                'ym:s:screenFormat',   # 100%
-                # Поля с частичным заполнением (опционально)
-                'ym:s:lastsignReferalSource',  # 25%
-                'ym:s:networkType',            # 42%
-            ] 
-
-            # Пытаемся загрузить все колонки, если какие-то отсутствуют - удаляем их из списка
-            try:
-                df_visits = pd.read_parquet(visits_path, columns=visits_columns)
-            except Exception as e:
-                self.stdout.write(f"Warning: Some columns not found, trying to load available ones. Error: {e}")
-                # Удаляем опциональные поля и пробуем снова
-                optional_fields = ['ym:s:lastsignReferalSource', 'ym:s:networkType', 'ym:s:goalsID']
-                for field in optional_fields:
-                    if field in visits_columns:
-                        visits_columns.remove(field)
-                try:
-                    df_visits = pd.read_parquet(visits_path, columns=visits_columns)
-                except Exception:
-                    # Если все еще ошибка, загружаем только базовые поля
-                    basic_fields = ['ym:s:visitID', 'ym:s:clientID', 'ym:s:dateTime', 
-                                   'ym:s:visitDuration', 'ym:s:deviceCategory', 'ym:s:referer', 
-                                   'ym:s:bounce', 'ym:s:pageViews']
-                    df_visits = pd.read_parquet(visits_path, columns=basic_fields)
-                    self.stdout.write("Warning: Loaded only basic fields due to column mismatch.")
-
-            def normalize_client_id(val):
-                """
-                Приводит clientID/counterUserIDHash к стабильной строке.
-                Учитывает float в научной нотации (часто в hits), чтобы совпадали с int из visits.
-                """
-                if pd.isna(val):
-                    return None
-                # Пробуем через float/Decimal, чтобы убрать научную нотацию
-                try:
-                    # float('1.7e+18') -> 1700000000000000000
-                    return f"{float(val):.0f}"
-                except Exception:
-                    pass
-                s = str(val)
-                if s.endswith('.0'):
-                    s = s[:-2]
-                return s
-
-            # Ensure timestamps are timezone-aware (UTC) to avoid Django naive datetime warnings
-            df_visits['ym:s:dateTime'] = pd.to_datetime(df_visits['ym:s:dateTime'], utc=True, errors='coerce')
-            # Normalize client IDs to consistent strings for joins
-            df_visits['client_id_norm'] = df_visits['ym:s:clientID'].apply(normalize_client_id)
-            df_visits = df_visits[df_visits['client_id_norm'].notna()]
-            df_visits['ym:s:clientID'] = df_visits['client_id_norm']
-            # Normalize counterUserIDHash for joins with hits (более надежный ключ)
-            if 'ym:s:counterUserIDHash' in df_visits.columns:
-                df_visits['counter_user_hash'] = df_visits['ym:s:counterUserIDHash'].apply(normalize_client_id)
-            else:
-                df_visits['counter_user_hash'] = None
-            self.stdout.write(f"DEBUG: Visits loaded. Shape: {df_visits.shape}")
-            
-            # Hits columns - расширены для новых метрик
-            hits_columns = [
-                'ym:pv:clientID', 'ym:pv:counterUserIDHash', 'ym:pv:dateTime', 'ym:pv:URL', 
-                'ym:pv:title',    # 68% - использовать с проверкой на null
-                # Новые поля
-                'ym:pv:referer',           # 58%
-                'ym:pv:browser',           # 99.9%
-                'ym:pv:operatingSystem',   # 99.9%
-                'ym:pv:screenWidth',       # 100%
-                'ym:pv:screenHeight',      # 100%
-                'ym:pv:deviceCategory',    # 100%
-                'ym:pv:params',            # 31% - для scroll depth (опционально)
-            ]
-            try:
-                df_hits = pd.read_parquet(hits_path, columns=hits_columns)
-            except Exception as e:
-                self.stdout.write(f"Warning: Some hit columns not found, trying basic set. Error: {e}")
-                # Пробуем загрузить только базовые поля
-                basic_hits = ['ym:pv:clientID', 'ym:pv:dateTime', 'ym:pv:URL', 'ym:pv:title']
-                df_hits = pd.read_parquet(hits_path, columns=basic_hits)
-                self.stdout.write("Warning: Loaded only basic hit fields.")
-            df_hits['ym:pv:dateTime'] = pd.to_datetime(df_hits['ym:pv:dateTime'], utc=True, errors='coerce')
-            df_hits['client_id_norm'] = df_hits['ym:pv:clientID'].apply(normalize_client_id)
-            df_hits = df_hits[df_hits['client_id_norm'].notna()]
-            df_hits['ym:pv:clientID'] = df_hits['client_id_norm']
-            if 'ym:pv:counterUserIDHash' in df_hits.columns:
-                df_hits['counter_user_hash'] = df_hits['ym:pv:counterUserIDHash'].apply(normalize_client_id)
-            else:
-                df_hits['counter_user_hash'] = None
-            self.stdout.write(f"DEBUG: Hits loaded. Shape: {df_hits.shape}")
-
-            # 3. Process Visits (Sessions)
-            self.stdout.write("Processing Visits...")
-
-            sample_limit = int(os.environ.get("INGEST_SAMPLE_LIMIT", "10000"))
-            if sample_limit > 0 and len(df_visits) > sample_limit:
-                self.stdout.write(f"Sampling {sample_limit} visits from {len(df_visits)}...")
-                df_visits = df_visits.head(sample_limit)
-                client_ids = set(df_visits['client_id_norm'].unique())
-                counter_hashes = set(df_visits['counter_user_hash'].dropna().unique()) if 'counter_user_hash' in df_visits else set()
-                before_hits = len(df_hits)
-                df_hits = df_hits[
-                    df_hits['client_id_norm'].isin(client_ids)
-                    | df_hits['counter_user_hash'].isin(counter_hashes)
-                ]
-                after_hits = len(df_hits)
-                if after_hits == 0 and before_hits > 0:
-                    self.stdout.write(self.style.WARNING(
-                        "Filtered hits to 0 after sampling clients; keeping all hits to avoid data loss."
-                    ))
-                    df_hits = pd.read_parquet(hits_path, columns=hits_columns)
-                    df_hits['ym:pv:dateTime'] = pd.to_datetime(df_hits['ym:pv:dateTime'], utc=True, errors='coerce')
-                    df_hits['client_id_norm'] = df_hits['ym:pv:clientID'].apply(normalize_client_id)
-                    df_hits = df_hits[df_hits['client_id_norm'].notna()]
-                    df_hits['ym:pv:clientID'] = df_hits['client_id_norm']
-                    if 'ym:pv:counterUserIDHash' in df_hits.columns:
-                        df_hits['counter_user_hash'] = df_hits['ym:pv:counterUserIDHash'].apply(normalize_client_id)
-                    else:
-                        df_hits['counter_user_hash'] = None
+
+            use_copy = not options.get('no_copy', False) and supports_copy()
+            batch_rows = options.get('batch_rows') or DEFAULT_BATCH_ROWS
 
             # Cache previous issues for routing comparisons
             self.prev_issue_index = self.build_previous_issue_index(version)
 
-            # Bulk Create Sessions (оптимизировано: создаем и сохраняем батчами)
-            self.stdout.write("Creating and saving visits in batches...")
-            batch_size = 10000
-            total_visits = len(df_visits)
-            visit_map_by_client = {}
-            counter_hash_to_client = {}
-            
-            for batch_start in range(0, total_visits, batch_size):
-                batch_end = min(batch_start + batch_size, total_visits)
-                batch_df = df_visits.iloc[batch_start:batch_end]
-                
-                visit_objects = []
-                for _, row in batch_df.iterrows():
-                    v_id = str(row.get('ym:s:visitID', ''))
-                    c_id = str(row.get('client_id_norm', ''))
-                    
-                    # Обработка новых полей с проверкой на наличие
-                    browser_val = row.get('ym:s:browser') if 'ym:s:browser' in row.index else None
-                    os_val = row.get('ym:s:operatingSystem') if 'ym:s:operatingSystem' in row.index else None
-                    screen_w = int(row.get('ym:s:screenWidth', 0)) if 'ym:s:screenWidth' in row.index and pd.notna(row.get('ym:s:screenWidth')) else None
-                    screen_h = int(row.get('ym:s:screenHeight', 0)) if 'ym:s:screenHeight' in row.index and pd.notna(row.get('ym:s:screenHeight')) else None
-                    screen_fmt = row.get('ym:s:screenFormat') if 'ym:s:screenFormat' in row.index else None
-                    is_new = row.get('ym:s:isNewUser') if 'ym:s:isNewUser' in row.index else True
-                    start_url = row.get('ym:s:startURL') if 'ym:s:startURL' in row.index else None
-                    end_url = row.get('ym:s:endURL') if 'ym:s:endURL' in row.index else None
-                    traffic_src = row.get('ym:s:lastsignReferalSource') if 'ym:s:lastsignReferalSource' in row.index else None
-                    net_type = row.get('ym:s:networkType') if 'ym:s:networkType' in row.index else None
-                    
-                    # Обработка goalsID для воронок
-                    goals_id_list = []
-                    if 'ym:s:goalsID' in row.index:
-                        goals_id_raw = row.get('ym:s:goalsID')
-                        if pd.notna(goals_id_raw) and goals_id_raw:
-                            # goalsID может быть списком, строкой списка, или числом
-                            try:
-                                if isinstance(goals_id_raw, (list, tuple)):
-                                    goals_id_list = [int(g) for g in goals_id_raw if g]
-                                elif isinstance(goals_id_raw, str):
-                                    # Попытка распарсить строку "[12345, 67890]"
-                                    import ast
-                                    parsed = ast.literal_eval(goals_id_raw)
-                                    if isinstance(parsed, list):
-                                        goals_id_list = [int(g) for g in parsed if g]
-                                    else:
-                                        goals_id_list = [int(parsed)]
-                                else:
-                                    goals_id_list = [int(goals_id_raw)]
-                            except (ValueError, SyntaxError, TypeError):
-                                # Если не удалось распарсить, пропускаем
-                                goals_id_list = []
-                    
-                    visit = VisitSession(
-                        version=version,
-                        visit_id=v_id,
-                        client_id=c_id,
-                        start_time=pd.to_datetime(row.get('ym:s:dateTime')),
-                        duration_sec=int(row.get('ym:s:visitDuration', 0)),
-                        device_category=row.get('ym:s:deviceCategory', 'unknown'),
-                        source=row.get('ym:s:referer', ''),
-                        bounced=bool(row.get('ym:s:bounce', 0)),
-                        page_views=int(row.get('ym:s:pageViews', 0)),
-                        # Новые поля
-                        browser=browser_val if browser_val and pd.notna(browser_val) else None,
-                        os=os_val if os_val and pd.notna(os_val) else None,
-                        screen_width=screen_w if screen_w and screen_w > 0 else None,
-                        screen_height=screen_h if screen_h and screen_h > 0 else None,
-                        screen_format=screen_fmt if screen_fmt and pd.notna(screen_fmt) else None,
-                        is_returning_visitor=not bool(is_new) if pd.notna(is_new) else False,
-                        entry_page=start_url if start_url and pd.notna(start_url) else None,
-                        exit_page=end_url if end_url and pd.notna(end_url) else None,
-                        traffic_source=traffic_src if traffic_src and pd.notna(traffic_src) else None,
-                        network_type=net_type if net_type and pd.notna(net_type) else None,
-                        goals_id=goals_id_list if goals_id_list else [],
+            writers = 0
+            if options.get('pipeline', False):
+                writers = max(1, options.get('writers') or 1)
+                if writers > 1 and connection.vendor == 'sqlite':
+                    # SQLite допускает только одного писателя - параллельные потоки упрутся в блокировку
+                    self.stdout.write(self.style.WARNING("SQLite: using a single writer thread."))
+                    writers = 1
+
+            if options.get('append', False):
+                self.append_load(version, visits_path, hits_path, batch_rows, use_copy, writers, goals_config)
+                self.stdout.write(self.style.SUCCESS(f"Incremental ingestion complete for {version_name}"))
+                return
+
+            # Стадии запуска: --resume продолжает прошлый запуск, иначе новый запуск с выбранными стадиями
+            if options.get('resume'):
+                run = last_unfinished_run(version)
+                if run is None:
+                    self.stdout.write("Nothing to resume: last run completed.")
+                    return
+                done = completed_stages(run)
+                selected = [name for name in STAGES if name not in done]
+                self.stdout.write(f"Resuming run #{run.id}, completed stages: {', '.join(sorted(done)) or '-'}")
+            else:
+                selected = select_stages(options.get('only_stage'), options.get('from_stage'))
+                run = start_run(version, {
+                    'visits': visits_path, 'hits': hits_path, 'stages': selected,
+                    'stream': bool(options.get('stream')), 'writers': writers,
+                })
+                for name in STAGES:
+                    if name not in selected:
+                        skip_stage(run, name)
+            self.stdout.write(f"Run #{run.id} stages: {', '.join(selected)}")
+
+            frames = {}
+
+            def analysis_frames():
+                # Стадия load пропущена - эвристикам и кластеризации нужны кадры из БД
+                if not frames:
+                    self.stdout.write("Loading analysis frames from DB...")
+                    frames['visits'], frames['hits'] = load_analysis_frames(version)
+                return frames['visits'], frames['hits']
+
+            if 'load' in selected:
+                with stage(run, 'load'):
+                    drop_snapshot(version.id)
+                    if partial:
+                        # Незавершенная загрузка могла оставить часть строк - хиты не уникальны, грузим заново
+                        purge_version(version, raw_only=True)
+                    frames['visits'], frames['hits'] = self.load_data(
+                        version, visits_path, hits_path, batch_rows, use_copy, writers, options,
                     )
-                    visit_objects.append(visit)
-                    counter_hash = row.get('counter_user_hash') if 'counter_user_hash' in row else None
-                    if pd.notna(counter_hash):
-                        counter_hash_to_client[counter_hash] = c_id
-                
-                # Сохраняем батч и сразу получаем ID для маппинга
-                created = VisitSession.objects.bulk_create(visit_objects, ignore_conflicts=True)
-                # Получаем сохраненные объекты для маппинга
-                for visit in visit_objects:
-                    visit_map_by_client[visit.client_id] = visit
-                
-                if (batch_start // batch_size) % 10 == 0:
-                    self.stdout.write(f"  Saved {batch_end}/{total_visits} visits...")
-            
-            self.stdout.write(f"Created {total_visits} sessions.")
-
-            # Получаем маппинг client_id -> session_id из БД
-            self.stdout.write("Loading visit mappings...")
-            db_visits = VisitSession.objects.filter(version=version).values('id', 'client_id')
-            client_to_visit_pk = {v['client_id']: v['id'] for v in db_visits}
-            hash_to_visit_pk = {h: client_to_visit_pk[c] for h, c in counter_hash_to_client.items() if c in client_to_visit_pk}
-            self.stdout.write(f"Loaded {len(client_to_visit_pk)} visit mappings.")
-
-            # 4. Process Hits (оптимизировано: батчами)
-            self.stdout.write("Processing and saving hits in batches...")
-            hit_batch_size = 50000
-            total_hits = len(df_hits)
-            total_saved = 0
-            
-            for batch_start in range(0, total_hits, hit_batch_size):
-                batch_end = min(batch_start + hit_batch_size, total_hits)
-                batch_df = df_hits.iloc[batch_start:batch_end]
-                
-                hit_objects = []
-                for _, row in batch_df.iterrows():
-                    c_id = str(row.get('client_id_norm', ''))
-                    counter_hash = row.get('counter_user_hash') if 'counter_user_hash' in row else None
-                    session_id = None
-                    if pd.notna(counter_hash) and counter_hash in hash_to_visit_pk:
-                        session_id = hash_to_visit_pk[counter_hash]
-                    elif c_id in client_to_visit_pk:
-                        session_id = client_to_visit_pk[c_id]
-                    if session_id:
-                        # Обработка новых полей с проверкой на наличие
-                        referrer = row.get('ym:pv:referer') if 'ym:pv:referer' in row.index else None
-                        browser_val = row.get('ym:pv:browser') if 'ym:pv:browser' in row.index else None
-                        os_val = row.get('ym:pv:operatingSystem') if 'ym:pv:operatingSystem' in row.index else None
-                        screen_w = int(row.get('ym:pv:screenWidth', 0)) if 'ym:pv:screenWidth' in row.index and pd.notna(row.get('ym:pv:screenWidth')) else None
-                        screen_h = int(row.get('ym:pv:screenHeight', 0)) if 'ym:pv:screenHeight' in row.index and pd.notna(row.get('ym:pv:screenHeight')) else None
-                        device_cat = row.get('ym:pv:deviceCategory') if 'ym:pv:deviceCategory' in row.index else None
-                        
-                        hit = PageHit(
-                            session_id=session_id,
-                            timestamp=pd.to_datetime(row.get('ym:pv:dateTime')),
-                            url=row.get('ym:pv:URL', ''),
-                            page_title=row.get('ym:pv:title') if pd.notna(row.get('ym:pv:title', '')) else None,
-                            action_type='view',
-                            # Новые поля
-                            referrer_url=referrer if referrer and pd.notna(referrer) else None,
-                            browser=browser_val if browser_val and pd.notna(browser_val) else None,
-                            os=os_val if os_val and pd.notna(os_val) else None,
-                            screen_width=screen_w if screen_w and screen_w > 0 else None,
-                            screen_height=screen_h if screen_h and screen_h > 0 else None,
-                            device_category=device_cat if device_cat and pd.notna(device_cat) else None,
-                            # time_on_page и is_exit будут рассчитаны позже
-                        )
-                        hit_objects.append(hit)
-                
-                # Сохраняем батч
-                if hit_objects:
-                    PageHit.objects.bulk_create(hit_objects, batch_size=5000)
-                    total_saved += len(hit_objects)
-                
-                if (batch_start // hit_batch_size) % 5 == 0:
-                    self.stdout.write(f"  Saved {total_saved} hits ({batch_end}/{total_hits} processed)...")
-            
-            self.stdout.write(f"Created {total_saved} hits.")
-            
+
             # 4.5 Calculate time_on_page and is_exit
-            self.calculate_time_on_page(version)
-            
-            # 4.6 Calculate page metrics
-            self.calculate_page_metrics(version)
+            if 'time_on_page' in selected:
+                with stage(run, 'time_on_page'):
+                    self.calculate_time_on_page(version)
+
+            if 'snapshot' in selected:
+                with stage(run, 'snapshot'):
+                    self.write_hit_snapshot(version)
 
-            # 5. Run Analysis (Heuristics)
-            self.run_analysis(version, df_hits, df_visits)
-            self.update_issue_lifecycle(version)
+            # 4.6 Calculate page metrics
+            if 'page_metrics' in selected:
+                with stage(run, 'page_metrics'):
+                    self.calculate_page_metrics(version)
+
+            # 5. Run Analysis (Heuristics); при повторном запуске проблемы сливаются с сохраненными
+            if 'analysis' in selected:
+                with stage(run, 'analysis'):
+                    df_visits, df_hits = analysis_frames()
+                    self.run_analysis(
+                        version, df_hits, df_visits, merge=UXIssue.objects.filter(version=version).exists(),
+                    )
+            if 'lifecycle' in selected:
+                with stage(run, 'lifecycle'):
+                    self.update_issue_lifecycle(version)
 
             # 6. Segment Users into Cohorts (New Logic)
-            self.segment_users_into_cohorts(version, df_visits, df_hits, goals_config)
-            
-            # 6.5 Update dominant_cohort in PageMetrics after cohorts are created
-            self.update_page_metrics_cohorts(version)
+            if 'cohorts' in selected:
+                with stage(run, 'cohorts'):
+                    df_visits, df_hits = analysis_frames()
+                    self.segment_users_into_cohorts(version, df_visits, df_hits, goals_config)
+                    # 6.5 Update dominant_cohort in PageMetrics after cohorts are created
+                    self.update_page_metrics_cohorts(version)
 
             # 7. Pre-calculate Daily Stats
-            self.calculate_daily_stats(version)
+            if 'daily_stats' in selected:
+                with stage(run, 'daily_stats'):
+                    self.calculate_daily_stats(version)
 
+            finish_run(run)
             self.stdout.write(self.style.SUCCESS(f"Ingestion and analysis complete for {version_name}"))
         
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"CRITICAL ERROR: {e}"))
             traceback.print_exc()
 
-    def calculate_time_on_page(self, version):
-        """Рассчитывает time_on_page для каждого hit и помечает is_exit (оптимизированная версия через SQL)"""
+    def load_data(self, version, visits_path, hits_path, batch_rows, use_copy, writers, options):
+        """Стадия load: выборка клиентов, загрузка визитов и хитов, watermark. Возвращает (df_visits, df_hits)."""
+        sample_limit = int(os.environ.get("INGEST_SAMPLE_LIMIT", "10000"))
+
+        # Детерминированная выборка по хешу clientID: фильтры уходят в pyarrow,
+        # строки остальных клиентов вообще не читаются
+        visits_filter = hits_filter = None
+        if sample_limit > 0:
+            sample = build_sample_filters(visits_path, hits_path, sample_limit)
+            if sample:
+                visits_filter, hits_filter, sampled, total = sample
+                self.stdout.write(f"Sampling {sampled} visits from {total} (by client hash)...")
+
+        if options.get('stream', False) or writers:
+            df_visits, df_hits = self.stream_load(
+                version, visits_path, hits_path, batch_rows,
+                use_copy, visits_filter, hits_filter, writers=writers,
+            )
+        else:
+            df_visits, df_hits = self.load_in_memory(
+                version, visits_path, hits_path, use_copy, visits_filter, hits_filter,
+            )
+        self.stdout.write(f"Indexed {populate_session_goals(version)} session goals.")
+        self.update_watermark(version, parquet_files(visits_path) + parquet_files(hits_path))
+        return df_visits, df_hits
+
+    def append_load(self, version, visits_path, hits_path, batch_rows, use_copy, writers, goals_config):
+        """
+        Дозагрузка версии по watermark: читаются только еще не загруженные файлы/партиции
+        (каталог или файл) и только строки новее max dateTime в БД. После загрузки
+        time_on_page, PageMetrics и DailyStat пересчитываются только для затронутых
+        сессий, URL и дат; эвристики работают по легким колонкам из БД, а найденные
+        проблемы сливаются с существующими (без дублей, AI-тексты сохраняются).
+        Выборка INGEST_SAMPLE_LIMIT в этом режиме не применяется.
+        """
+        from django.db.models import Max
+        from django.db.models.functions import TruncDate
+
+        watermark, _ = IngestWatermark.objects.get_or_create(version=version)
+        known = {(f['path'], f['size'], f['mtime']) for f in watermark.ingested_files}
+
+        def new_files(path):
+            return [f for f in parquet_files(path) if tuple(file_signature(f).values()) not in known]
+
+        visits_files = new_files(visits_path)
+        hits_files = new_files(hits_path)
+        self.stdout.write(
+            f"Append: {len(visits_files)} new visits file(s), {len(hits_files)} new hits file(s); "
+            f"watermark visits={watermark.max_visit_time}, hits={watermark.max_hit_time}"
+        )
+        if not visits_files and not hits_files:
+            self.stdout.write("Nothing new to ingest.")
+            return
+
+        # Визиты с тем же временем допускаем (дубли отсекает unique visit_id), хиты - строго новее
+        visits_filter = newer_than_filter(visits_files, 'ym:s:dateTime', watermark.max_visit_time, inclusive=True) \
+            if visits_files else None
+        hits_filter = newer_than_filter(hits_files, 'ym:pv:dateTime', watermark.max_hit_time) if hits_files else None
+
+        last_visit_pk = VisitSession.objects.aggregate(m=Max('id'))['m'] or 0
+        last_hit_pk = PageHit.objects.aggregate(m=Max('id'))['m'] or 0
+
+        drop_snapshot(version.id)
+        self.stream_load(
+            version, visits_files or None, hits_files or None, batch_rows, use_copy,
+            visits_filter, hits_filter, writers=writers,
+        )
+        populate_session_goals(version, since_session_id=last_visit_pk)
+
+        new_hits = PageHit.objects.filter(version=version, id__gt=last_hit_pk)
+        new_visits = VisitSession.objects.filter(version=version, id__gt=last_visit_pk)
+        if not new_hits.exists() and not new_visits.exists():
+            self.stdout.write("No new rows after watermark filter.")
+            self.write_hit_snapshot(version)
+            self.update_watermark(version, visits_files + hits_files)
+            return
+
+        # Затронутые сессии: у них меняются time_on_page/is_exit последних хитов
+        touched_sessions = new_hits.values('session_id')
+        self.calculate_time_on_page(version, since_hit_id=last_hit_pk)
+        self.write_hit_snapshot(version)
+        touched_urls = list(
+            PageHit.objects.filter(version=version, session_id__in=touched_sessions)
+            .values_list('url_id', flat=True).distinct()
+        )
+        self.calculate_page_metrics(version, url_ids=touched_urls)
+        touched_dates = list(
+            new_visits.annotate(date=TruncDate('start_time')).values_list('date', flat=True).distinct()
+        )
+        self.calculate_daily_stats(version, dates=touched_dates)
+        self.update_watermark(version, visits_files + hits_files)
+
+        # Эвристикам нужна полная история клиентов - берем легкие колонки из БД
+        df_visits, df_hits = load_analysis_frames(version)
+        self.run_analysis(version, df_hits, df_visits, merge=True)
+        self.update_issue_lifecycle(version)
+        self.segment_users_into_cohorts(version, df_visits, df_hits, goals_config)
+        self.update_page_metrics_cohorts(version)
+
+    def write_hit_snapshot(self, version):
+        """Пересобирает колоночный снимок хитов версии (если HIT_SNAPSHOT_DIR задан)."""
+        counts = write_snapshot(version)
+        if counts:
+            self.stdout.write(f"Hit snapshot: {counts['sessions']} sessions, {counts['hits']} hits.")
+
+    def update_watermark(self, version, files):
+        """Обновляет watermark версии: max dateTime визитов/хитов в БД и список загруженных файлов."""
+        from django.db.models import Max
+
+        watermark, _ = IngestWatermark.objects.get_or_create(version=version)
+        watermark.max_visit_time = VisitSession.objects.filter(version=version).aggregate(m=Max('start_time'))['m']
+        watermark.max_hit_time = PageHit.objects.filter(version=version).aggregate(m=Max('timestamp'))['m']
+        signatures = {f['path']: f for f in watermark.ingested_files}
+        for path in files:
+            signature = file_signature(path)
+            signatures[signature['path']] = signature
+        watermark.ingested_files = sorted(signatures.values(), key=lambda f: f['path'])
+        watermark.save()
+
+    def load_in_memory(self, version, visits_path, hits_path, use_copy, visits_filter=None, hits_filter=None):
+        """
+        Читает оба файла целиком через pd.read_parquet (с фильтрами выборки, если заданы)
+        и сохраняет визиты и хиты батчами.
+        """
+        self.stdout.write(f"Loading Parquet files from {visits_path}...")
+        visits_columns = list(VISITS_COLUMNS)
+
+        # Пытаемся загрузить все колонки, если какие-то отсутствуют - удаляем их из списка
+        try:
+            df_visits = pd.read_parquet(visits_path, columns=visits_columns, filters=visits_filter)
+        except Exception as e:
+            self.stdout.write(f"Warning: Some columns not found, trying to load available ones. Error: {e}")
+            # Удаляем опциональные поля и пробуем снова
+            optional_fields = ['ym:s:lastsignReferalSource', 'ym:s:networkType', 'ym:s:goalsID']
+            for field in optional_fields:
+                if field in visits_columns:
+                    visits_columns.remove(field)
+            try:
+                df_visits = pd.read_parquet(visits_path, columns=visits_columns, filters=visits_filter)
+            except Exception:
+                # Если все еще ошибка, загружаем только базовые поля
+                basic_fields = ['ym:s:visitID', 'ym:s:clientID', 'ym:s:dateTime',
+                               'ym:s:visitDuration', 'ym:s:deviceCategory', 'ym:s:referer',
+                               'ym:s:bounce', 'ym:s:pageViews']
+                df_visits = pd.read_parquet(visits_path, columns=basic_fields, filters=visits_filter)
+                self.stdout.write("Warning: Loaded only basic fields due to column mismatch.")
+
+        # Ensure timestamps are timezone-aware (UTC) and client IDs are consistent strings for joins
+        df_visits = prepare_frame(df_visits, 'ym:s:')
+        self.stdout.write(f"DEBUG: Visits loaded. Shape: {df_visits.shape}")
+
+        hits_columns = list(HITS_COLUMNS)
+        try:
+            df_hits = pd.read_parquet(hits_path, columns=hits_columns, filters=hits_filter)
+        except Exception as e:
+            self.stdout.write(f"Warning: Some hit columns not found, trying basic set. Error: {e}")
+            # Пробуем загрузить только базовые поля
+            hits_columns = ['ym:pv:clientID', 'ym:pv:dateTime', 'ym:pv:URL', 'ym:pv:title']
+            df_hits = pd.read_parquet(hits_path, columns=hits_columns, filters=hits_filter)
+            self.stdout.write("Warning: Loaded only basic hit fields.")
+        df_hits = prepare_frame(df_hits, 'ym:pv:')
+        df_hits = align_hit_keys(
+            df_hits, build_key_index(df_visits['client_id_norm']), build_key_index(df_visits['counter_user_hash']),
+        )
+        self.stdout.write(f"DEBUG: Hits loaded. Shape: {df_hits.shape}")
+
+        # 3. Process Visits (Sessions)
+        self.stdout.write("Processing Visits...")
+
+        # Bulk Create Sessions (колоночная подготовка строк, сохранение батчами)
+        loader = "COPY" if use_copy else "bulk_create"
+        self.stdout.write(f"Creating and saving visits in batches ({loader})...")
+        batch_size = 10000
+        total_visits = len(df_visits)
+        counter_hash_to_client = {}
+
+        for batch_start in range(0, total_visits, batch_size):
+            batch_end = min(batch_start + batch_size, total_visits)
+            self.save_visits_batch(version, df_visits.iloc[batch_start:batch_end], counter_hash_to_client, use_copy)
+
+            if (batch_start // batch_size) % 10 == 0:
+                self.stdout.write(f"  Saved {batch_end}/{total_visits} visits...")
+
+        self.stdout.write(f"Created {total_visits} sessions.")
+
+        client_to_visit_pk, hash_to_visit_pk = self.load_visit_mappings(version, counter_hash_to_client)
+
+        # Все хиты версии в памяти - time_on_page и is_exit считаются до вставки, без UPDATE-прохода
+        session_ids = resolve_session_ids(df_hits, hash_to_visit_pk, client_to_visit_pk)
+        matched = session_ids.notna().to_numpy()
+        time_on_page, is_exit = session_time_columns(
+            session_ids[matched].to_numpy().astype(np.int64), df_hits.loc[matched, 'ym:pv:dateTime'],
+        )
+        df_hits['time_on_page'] = 0
+        df_hits['is_exit'] = False
+        df_hits.loc[matched, 'time_on_page'] = time_on_page
+        df_hits.loc[matched, 'is_exit'] = is_exit
+
+        # 4. Process Hits (колоночная подготовка строк, сохранение батчами)
+        self.stdout.write("Processing and saving hits in batches...")
+        hit_batch_size = 50000
+        total_hits = len(df_hits)
+        total_saved = 0
+
+        for batch_start in range(0, total_hits, hit_batch_size):
+            batch_end = min(batch_start + hit_batch_size, total_hits)
+            total_saved += self.save_hits_batch(
+                version, df_hits.iloc[batch_start:batch_end], hash_to_visit_pk, client_to_visit_pk, use_copy,
+            )
+
+            if (batch_start // hit_batch_size) % 5 == 0:
+                self.stdout.write(f"  Saved {total_saved} hits ({batch_end}/{total_hits} processed)...")
+
+        self.stdout.write(f"Created {total_saved} hits.")
+
+        # Анализу нужны только несколько колонок - тяжелые строки освобождаем сразу
+        return analysis_frame(df_visits, ANALYSIS_VISIT_COLUMNS), analysis_frame(df_hits, ANALYSIS_HIT_COLUMNS)
+
+    def stream_load(self, version, visits_path, hits_path, batch_rows, use_copy, visits_filter=None,
+                    hits_filter=None, writers=0):
+        """
+        Потоковая загрузка: файлы читаются record batch'ами, каждый батч сразу
+        нормализуется и пишется в БД. В памяти копятся только колонки для анализа.
+        writers > 0 включает конвейер: чтение, подготовка строк и запись (в writers потоков)
+        идут одновременно.
+        """
+        loader = "COPY" if use_copy else "bulk_create"
+        mode = f", pipeline with {writers} writer(s)" if writers else ""
+        if visits_path:
+            visits_columns = available_columns(visits_path, VISITS_COLUMNS)
+            self.stdout.write(
+                f"Streaming {visits_path} ({count_rows(visits_path)} rows) in batches of {batch_rows} ({loader}{mode})..."
+            )
+
+        counter_hash_to_client = {}
+        visit_frames = []
+
+        def transform_visits(batch_df):
+            batch_df = prepare_frame(batch_df, 'ym:s:')
+            if batch_df.empty:
+                return None
+            visit_frames.append(analysis_frame(batch_df, ANALYSIS_VISIT_COLUMNS))
+            return self.build_visit_rows(batch_df, counter_hash_to_client)
+
+        def write_visits(rows):
+            return save_rows(
+                VisitSession, VISIT_FIELDS, rows, use_copy=use_copy,
+                ignore_conflicts=True, conflict_fields=('version', 'visit_id'), version=version,
+            )
+
+        if visits_path:
+            self.run_batches(
+                iter_frames(visits_path, visits_columns, batch_rows, filter=visits_filter),
+                transform_visits, write_visits, writers, 'visits',
+            )
+        df_visits = pd.concat(visit_frames, ignore_index=True) if visit_frames else pd.DataFrame(
+            columns=list(ANALYSIS_VISIT_COLUMNS)
+        )
+        self.stdout.write(f"Created {len(df_visits)} sessions.")
+
+        client_to_visit_pk, hash_to_visit_pk = self.load_visit_mappings(version, counter_hash_to_client)
+        # Точные ключи - все клиенты версии в БД (при --append это и ранее загруженные)
+        client_index = build_key_index(pd.Series(list(client_to_visit_pk), dtype='Int64'))
+        hash_index = build_key_index(pd.Series(list(counter_hash_to_client), dtype='Int64'))
+
+        hit_frames = []
+        if not hits_path:
+            return df_visits, pd.DataFrame(columns=list(ANALYSIS_HIT_COLUMNS))
+        hits_columns = available_columns(hits_path, HITS_COLUMNS)
+        self.stdout.write(f"Streaming {hits_path} ({count_rows(hits_path)} rows)...")
+
+        def transform_hits(batch_df):
+            batch_df = prepare_frame(batch_df, 'ym:pv:')
+            if batch_df.empty:
+                return None
+            batch_df = align_hit_keys(batch_df, client_index, hash_index)
+            hit_frames.append(analysis_frame(batch_df, ANALYSIS_HIT_COLUMNS))
+            return self.build_hit_rows(batch_df, hash_to_visit_pk, client_to_visit_pk)
+
+        def write_hits(rows):
+            return save_rows(PageHit, HIT_FIELDS, rows, use_copy=use_copy, version=version)
+
+        total_saved = self.run_batches(
+            iter_frames(hits_path, hits_columns, batch_rows, filter=hits_filter),
+            transform_hits, write_hits, writers, 'hits',
+        )
+        df_hits = pd.concat(hit_frames, ignore_index=True) if hit_frames else pd.DataFrame(
+            columns=list(ANALYSIS_HIT_COLUMNS)
+        )
+        self.stdout.write(f"Created {total_saved} hits.")
+        return df_visits, df_hits
+
+    def run_batches(self, source, transform, write, writers, label):
+        """
+        Прогоняет батчи source через transform и write: последовательно (writers=0)
+        или конвейером с перекрытием стадий. Возвращает число записанных строк.
+        """
+        if writers:
+            stats = run_pipeline(source, transform, write, writers=writers)
+            for stage_stats in stats:
+                self.stdout.write(f"  [{label}] {stage_stats.summary()}")
+            bottleneck = max(stats, key=lambda stage_stats: stage_stats.busy_sec / stage_stats.threads)
+            self.stdout.write(f"  [{label}] bottleneck: {bottleneck.name}")
+            return stats[-1].rows
+
+        total_read = 0
+        total_saved = 0
+        for batch_df in source:
+            total_read += len(batch_df)
+            rows = transform(batch_df)
+            if rows is None:
+                continue
+            total_saved += write(rows)
+            self.stdout.write(f"  Saved {total_saved} {label} ({total_read} read)...")
+        return total_saved
+
+    def build_visit_rows(self, batch_df, counter_hash_to_client):
+        """Строки визитов для вставки; дополняет маппинг counterUserIDHash -> client_id (последнее вхождение побеждает)."""
+        if 'counter_user_hash' in batch_df.columns:
+            hashes = batch_df['counter_user_hash']
+            hash_mask = hashes.notna()
+            counter_hash_to_client.update(zip(
+                hashes[hash_mask].tolist(),
+                batch_df.loc[hash_mask, 'client_id_norm'].tolist(),
+            ))
+        return columns_to_rows(build_visit_columns(batch_df), VISIT_FIELDS)
+
+    def save_visits_batch(self, version, batch_df, counter_hash_to_client, use_copy):
+        """Сохраняет батч визитов."""
+        save_rows(
+            VisitSession, VISIT_FIELDS, self.build_visit_rows(batch_df, counter_hash_to_client), use_copy=use_copy,
+            ignore_conflicts=True, conflict_fields=('version', 'visit_id'), version=version,
+        )
+
+    def load_visit_mappings(self, version, counter_hash_to_client):
+        """Получает маппинги client_id -> session pk и counterUserIDHash -> session pk из БД (ключи - int64)."""
+        self.stdout.write("Loading visit mappings...")
+        db_visits = VisitSession.objects.filter(version=version).values_list('client_id', 'id')
+        client_to_visit_pk = dict(db_visits)
+        hash_to_visit_pk = {h: client_to_visit_pk[c] for h, c in counter_hash_to_client.items() if c in client_to_visit_pk}
+        self.stdout.write(f"Loaded {len(client_to_visit_pk)} visit mappings.")
+        return client_to_visit_pk, hash_to_visit_pk
+
+    def build_hit_rows(self, batch_df, hash_to_visit_pk, client_to_visit_pk):
+        """Сопоставляет хиты сессиям и строит строки для вставки (только хиты с найденной сессией)."""
+        session_ids = resolve_session_ids(batch_df, hash_to_visit_pk, client_to_visit_pk)
+        # time_on_page и is_exit есть, если посчитаны по всей версии в памяти, иначе их заполнит calculate_time_on_page
+        fields = HIT_FIELDS + HIT_TIME_FIELDS if 'time_on_page' in batch_df.columns else HIT_FIELDS
+        columns = build_hit_columns(batch_df, session_ids)
+        columns['url_id'] = url_ids(columns.pop('url'))
+        columns['agent_id'] = agent_ids(columns)
+        return columns_to_rows(columns, fields)
+
+    def save_hits_batch(self, version, batch_df, hash_to_visit_pk, client_to_visit_pk, use_copy):
+        """Сохраняет батч хитов (COPY на PostgreSQL, bulk_create на SQLite). Возвращает число сохраненных хитов."""
+        fields = HIT_FIELDS + HIT_TIME_FIELDS if 'time_on_page' in batch_df.columns else HIT_FIELDS
+        return save_rows(
+            PageHit, fields, self.build_hit_rows(batch_df, hash_to_visit_pk, client_to_visit_pk), use_copy=use_copy,
+            version=version,
+        )
+
+    def calculate_time_on_page(self, version, since_hit_id=None):
+        """
+        Рассчитывает time_on_page для каждого hit и помечает is_exit одним UPDATE с оконными функциями:
+        LEAD() по уникальным моментам сессии (следующий строго более поздний хит, у последнего - 0)
+        и ROW_NUMBER() для последнего хита. Работает на PostgreSQL и SQLite (>= 3.33, UPDATE ... FROM).
+        since_hit_id - пересчет только для сессий, в которые добавлены хиты с id > since_hit_id (--append).
+        Если при загрузке поля уже посчитаны в памяти (нет хитов с NULL time_on_page), проход пропускается.
+        """
         self.stdout.write("Calculating time_on_page and exit flags...")
         from analytics.models import PageHit
         from django.db import connection
-        
-        # Используем SQL для быстрого расчета time_on_page (в 10-100 раз быстрее Python-цикла)
-        with connection.cursor() as cursor:
-            # Обновляем time_on_page через SQL window function
-            cursor.execute("""
-                UPDATE analytics_pagehit ph1
-                SET time_on_page = GREATEST(0, EXTRACT(EPOCH FROM (
-                    SELECT ph2.timestamp 
-                    FROM analytics_pagehit ph2 
-                    WHERE ph2.session_id = ph1.session_id 
-                      AND ph2.timestamp > ph1.timestamp 
-                    ORDER BY ph2.timestamp ASC 
-                    LIMIT 1
-                ) - ph1.timestamp))::INTEGER
-                FROM analytics_visitsession vs
-                WHERE ph1.session_id = vs.id 
-                  AND vs.version_id = %s
-                  AND ph1.time_on_page IS NULL
-            """, [version.id])
-            
-            # Помечаем последние hits как exit
-            cursor.execute("""
-                UPDATE analytics_pagehit ph1
-                SET is_exit = TRUE
-                FROM analytics_visitsession vs
-                WHERE ph1.session_id = vs.id 
-                  AND vs.version_id = %s
-                  AND ph1.id = (
-                      SELECT ph2.id 
-                      FROM analytics_pagehit ph2 
-                      WHERE ph2.session_id = ph1.session_id 
-                      ORDER BY ph2.timestamp DESC 
-                      LIMIT 1
-                  )
-            """, [version.id])
-        
-        self.stdout.write("Updated time_on_page and exit flags via SQL (optimized).")
 
-    def calculate_page_metrics(self, version):
-        """Создает/обновляет PageMetrics для каждой страницы (оптимизированная версия)"""
+        if since_hit_id is None and not PageHit.objects.filter(
+            version=version, time_on_page__isnull=True,
+        ).exists():
+            self.stdout.write("time_on_page and exit flags already computed at load.")
+            return
+
+        session_filter = ""
+        params = [version.id]
+        if since_hit_id is not None:
+            session_filter = (
+                "AND ph.session_id IN (SELECT session_id FROM analytics_pagehit WHERE version_id = %s AND id > %s)"
+            )
+            params += [version.id, since_hit_id]
+
+        if connection.vendor == 'postgresql':
+            seconds = "EXTRACT(EPOCH FROM (m.next_ts - s.timestamp))::INTEGER"
+        else:
+            seconds = "CAST(ROUND((julianday(m.next_ts) - julianday(s.timestamp)) * 86400) AS INTEGER)"
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH scope AS (
+                    SELECT ph.id, ph.session_id, ph.timestamp
+                    FROM analytics_pagehit ph
+                    WHERE ph.version_id = %s {session_filter}
+                ),
+                moments AS (
+                    SELECT session_id, timestamp,
+                           LEAD(timestamp) OVER (PARTITION BY session_id ORDER BY timestamp) AS next_ts
+                    FROM (SELECT DISTINCT session_id, timestamp FROM scope) d
+                ),
+                ranked AS (
+                    SELECT s.id,
+                           COALESCE({seconds}, 0) AS time_on_page,
+                           ROW_NUMBER() OVER (PARTITION BY s.session_id ORDER BY s.timestamp DESC, s.id DESC) AS rn
+                    FROM scope s
+                    JOIN moments m ON m.session_id = s.session_id AND m.timestamp = s.timestamp
+                )
+                UPDATE analytics_pagehit
+                SET time_on_page = ranked.time_on_page,
+                    is_exit = (ranked.rn = 1)
+                FROM ranked
+                WHERE analytics_pagehit.id = ranked.id AND analytics_pagehit.version_id = %s
+            """, params + [version.id])
+            # SQLite не сообщает rowcount для UPDATE ... FROM с CTE
+            updated = f" for {cursor.rowcount} hits" if cursor.rowcount >= 0 else ""
+
+        self.stdout.write(f"Updated time_on_page and exit flags{updated} (window functions).")
+
+    def calculate_page_metrics(self, version, url_ids=None):
+        """
+        Создает/обновляет PageMetrics для каждой страницы: один агрегирующий запрос по хитам
+        (самые частые device и title - mode() на PostgreSQL, GROUP BY на остальных СУБД),
+        один по визитам для bounce_rate (доля отказов среди сессий, начавшихся на странице)
+        и одна вставка bulk_create(update_conflicts=True).
+        Хиты группируются по url_id (справочник Url), строки адресов подтягиваются одним запросом.
+        url_ids - список id URL для частичного пересчета (--append), иначе все страницы версии.
+        С ANALYTICS_ENGINE=duckdb оба агрегата считает DuckDB по снимку версии (olap.py).
+        """
         self.stdout.write("Calculating page metrics...")
-        from analytics.models import PageMetrics, PageHit, VisitSession
-        from django.db.models import Avg, Count, Q, Max
-        from collections import defaultdict
+        from analytics.models import PageMetrics, PageHit, Url, VisitSession
+        from analytics.aggregates import Mode, supports_mode, group_modes
+        from django.db.models import Avg, Count, Q, Value
+        from django.db.models.functions import NullIf
         
-        # Один запрос для всех метрик по страницам
-        page_stats = PageHit.objects.filter(session__version=version).values('url').annotate(
+        version_hits = PageHit.objects.filter(version=version)
+        entry_sessions = VisitSession.objects.filter(version=version)
+        if url_ids is not None:
+            version_hits = version_hits.filter(url_id__in=url_ids)
+            entry_sessions = entry_sessions.filter(entry_page__in=Url.objects.filter(id__in=url_ids).values('raw'))
+
+        aggregates = dict(
             total_views=Count('id'),
             unique_visitors=Count('session__client_id', distinct=True),
             avg_time=Avg('time_on_page'),
             exit_count=Count('id', filter=Q(is_exit=True)),
             avg_scroll=Avg('scroll_depth'),
         )
-        
-        # Получаем dominant device и page_title одним запросом для всех страниц
-        # Группируем по URL и берем самый частый device/title
-        device_data = defaultdict(lambda: defaultdict(int))
-        title_data = defaultdict(lambda: defaultdict(int))
-        
-        # Batch-обработка для device и title
-        hits_for_stats = PageHit.objects.filter(
-            session__version=version
-        ).values('url', 'device_category', 'page_title').exclude(
-            device_category__isnull=True
-        )
-        
-        for hit in hits_for_stats:
-            url = hit['url']
-            if hit['device_category']:
-                device_data[url][hit['device_category']] += 1
-            if hit['page_title']:
-                title_data[url][hit['page_title']] += 1
-        
-        # Создаем/обновляем PageMetrics батчами
-        metrics_to_create = []
+        use_mode = supports_mode()
+        if use_mode:
+            aggregates['dominant_device'] = Mode(NullIf('agent__device_category', Value('')))
+            aggregates['page_title'] = Mode(NullIf('page_title', Value('')))
+
+        # Один запрос для всех метрик по страницам
+        page_stats = olap.page_stats(version, url_ids)
+        if page_stats is None:
+            page_stats = list(version_hits.values('url_id').annotate(**aggregates))
+            if not use_mode:
+                devices = group_modes(version_hits, 'url_id', 'agent__device_category')
+                titles = group_modes(version_hits, 'url_id', 'page_title')
+                for stat in page_stats:
+                    stat['dominant_device'] = devices.get(stat['url_id'])
+                    stat['page_title'] = titles.get(stat['url_id'])
+        raw_urls = dict(Url.objects.filter(id__in=[stat['url_id'] for stat in page_stats]).values_list('id', 'raw'))
+
+        bounces = olap.entry_bounces(version, raw_urls.values() if url_ids is not None else None)
+        if bounces is None:
+            bounces = {
+                row['entry_page']: row
+                for row in entry_sessions.values('entry_page').annotate(
+                    sessions=Count('id'), bounces=Count('id', filter=Q(bounced=True)),
+                )
+            }
+
+        metrics = []
         for stat in page_stats:
-            url = stat['url']
+            url = raw_urls[stat['url_id']]
             total_views = stat['total_views']
             exit_rate = (stat['exit_count'] / total_views * 100) if total_views else 0
-            
-            # Берем самый частый device и title из предварительно собранных данных
-            dominant_device = max(device_data[url].items(), key=lambda x: x[1])[0] if device_data[url] else None
-            page_title = max(title_data[url].items(), key=lambda x: x[1])[0] if title_data[url] else None
-            
-            metrics_to_create.append(PageMetrics(
+            entries = bounces.get(url)
+            bounce_rate = (entries['bounces'] / entries['sessions'] * 100) if entries else 0
+            metrics.append(PageMetrics(
                 version=version,
                 url=url,
-                page_title=page_title,
+                page_title=stat['page_title'],
                 total_views=total_views,
                 unique_visitors=stat['unique_visitors'],
                 avg_time_on_page=stat['avg_time'] or 0,
-                bounce_rate=0,
+                bounce_rate=bounce_rate,
                 exit_rate=exit_rate,
                 avg_scroll_depth=stat['avg_scroll'],
-                dominant_device=dominant_device,
+                dominant_device=stat['dominant_device'],
                 dominant_cohort=None,
             ))
-        
-        # Bulk create/update (используем update_or_create для совместимости)
-        for metric in metrics_to_create:
-            PageMetrics.objects.update_or_create(
-                version=metric.version,
-                url=metric.url,
-                defaults={
-                    'page_title': metric.page_title,
-                    'total_views': metric.total_views,
-                    'unique_visitors': metric.unique_visitors,
-                    'avg_time_on_page': metric.avg_time_on_page,
-                    'bounce_rate': metric.bounce_rate,
-                    'exit_rate': metric.exit_rate,
-                    'avg_scroll_depth': metric.avg_scroll_depth,
-                    'dominant_device': metric.dominant_device,
-                }
-            )
+
+        # dominant_cohort не трогаем - его проставляет update_page_metrics_cohorts
+        PageMetrics.objects.bulk_create(
+            metrics,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['version', 'url'],
+            update_fields=[
+                'page_title', 'total_views', 'unique_visitors', 'avg_time_on_page', 'bounce_rate',
+                'exit_rate', 'avg_scroll_depth', 'dominant_device', 'calculated_at',
+            ],
+        )
         
         self.stdout.write(f"Calculated metrics for {len(page_stats)} pages.")
 
@@ -520,516 +791,176 @@ class Command(BaseCommand):
         else:
             self.stdout.write("No cohorts found, skipping dominant_cohort update.")
 
-    def run_analysis(self, version, df_hits, df_visits):
-        """Запускает анализ UX-проблем с AI-гипотезами"""
+    def run_analysis(self, version, df_hits, df_visits, merge=False, detectors=None, workers=None):
+        """
+        Запускает анализ UX-проблем с AI-гипотезами.
+        Детекторы реестра (analytics/detectors.py) находят проблемы по общему кадру хитов,
+        затем каждая дополняется метриками страницы и динамикой (build_issue) и сохраняется с заглушкой;
+        AI-гипотезы запрашиваются после сохранения одним конкурентным проходом (enrich_issues).
+        PageMetrics версии читаются один раз (PageMetricsIndex) и общие для детекторов и build_issue.
+        detectors - имена детекторов (None - все), workers - процессов пула детекторов.
+        merge=True - найденные проблемы сливаются с уже сохраненными (см. merge_issues).
+        """
         self.stdout.write("Running UX Analysis...")
-        issues = []
-
-        def normalize_issue_url(raw_url):
-            """
-            Collapse noisy params (referer/utm/etc) and trailing slashes so the same page
-            does not create multiple issues due to query strings or mixed schemes.
-            """
-            if not isinstance(raw_url, str):
-                return ""
-            parsed = urllib.parse.urlparse(raw_url.strip())
-            netloc = parsed.netloc.lower()
-            path = (parsed.path or "/").rstrip("/") or "/"
-            query_dict = urllib.parse.parse_qs(parsed.query, keep_blank_values=False)
-            for noisy in ['referer', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term', 'yclid', '_openstat', 'from', 'ref']:
-                query_dict.pop(noisy, None)
-            clean_query = urllib.parse.urlencode({k: v[0] if len(v) == 1 else v for k, v in query_dict.items()}, doseq=True)
-            scheme = parsed.scheme.lower() if parsed.scheme else ("https" if netloc else "")
-            if netloc or scheme:
-                return urllib.parse.urlunparse((scheme, netloc, path, '', clean_query, ''))
-            return path + (f"?{clean_query}" if clean_query else "")
-
-        def pick_representative_url(df, norm_column, norm_value):
-            """Return the most frequent raw URL for a normalized value to fetch PageMetrics."""
-            subset = df[df[norm_column] == norm_value]['ym:pv:URL'].dropna()
-            if subset.empty:
-                return norm_value
-            return subset.mode().iloc[0]
-
-        # A. Rage Clicks Detection
-        df_hits['timestamp'] = pd.to_datetime(df_hits['ym:pv:dateTime'], utc=True)
-        df_hits_sorted = df_hits.sort_values(['ym:pv:clientID', 'timestamp'])
-        df_hits_sorted['time_diff'] = df_hits_sorted.groupby('ym:pv:clientID')['timestamp'].diff().dt.total_seconds()
-        df_hits_sorted['prev_url'] = df_hits_sorted.groupby('ym:pv:clientID')['ym:pv:URL'].shift()
-        
-        rage_clicks = df_hits_sorted[
-            (df_hits_sorted['time_diff'] < 2) & 
-            (df_hits_sorted['ym:pv:URL'] == df_hits_sorted['prev_url'])
-        ].copy()
-        
-        if not rage_clicks.empty:
-            rage_clicks['norm_url'] = rage_clicks['ym:pv:URL'].apply(normalize_issue_url)
-            rage_stats = rage_clicks['norm_url'].value_counts().head(5)
-            for norm_url, count in rage_stats.items():
-                if not norm_url:
-                    continue
-                representative_url = pick_representative_url(rage_clicks, 'norm_url', norm_url)
-                page_metrics = PageMetrics.objects.filter(version=version, url=representative_url).first()
-                if not page_metrics:
-                    page_metrics = PageMetrics.objects.filter(version=version, url=norm_url).first()
-                impact = min(count * 0.1, 10.0)
-                trend = self._calculate_trend('RAGE_CLICK', norm_url, impact)
-                priority = self._calculate_priority('WARNING', impact, count, trend)
-                ai_text = analyze_issue_with_ai(
-                     issue_type='RAGE_CLICK',
-                     location=norm_url,
-                     metrics_context=f"Количество событий: {count}",
-                     page_title=page_metrics.page_title if page_metrics else None,
-                     page_metrics={'avg_time': page_metrics.avg_time_on_page if page_metrics else None} if page_metrics else None,
-                     dominant_cohort=page_metrics.dominant_cohort if page_metrics else None,
-                     dominant_device=page_metrics.dominant_device if page_metrics else None
-                 )
-                issues.append(UXIssue(
-                    version=version,
-                    issue_type='RAGE_CLICK',
-                    severity='WARNING',
-                description=f"Обнаружены {count} быстрых повторных кликов/перезагрузок на странице.",
-                    location_url=norm_url,
-                    affected_sessions=count,
-                    impact_score=impact,
-                    ai_hypothesis=ai_text,
-                    detected_version_name=version.name,
-                    trend=trend,
-                    priority=priority,
-                    recommended_specialists=self._recommend_specialists('RAGE_CLICK')
-                ))
-
-        nav_back_targets = set()
-
-        # B. Loops
-        df_hits['norm_url'] = df_hits['ym:pv:URL'].apply(normalize_issue_url)
-        loop_counts = df_hits[df_hits['norm_url'] != ""].groupby(['ym:pv:clientID', 'norm_url']).size()
-        loops = loop_counts[loop_counts > 3]
-        
-        if not loops.empty:
-            loop_urls = loops.index.get_level_values('norm_url').value_counts().head(5)
-            for norm_url, count in loop_urls.items():
-                if not norm_url:
-                    continue
-                nav_back_targets.add(norm_url)
-                page_metrics = PageMetrics.objects.filter(version=version, url=norm_url).first()
-                impact = min(count * 0.15, 10.0)
-                trend = self._calculate_trend('LOOPING', norm_url, impact)
-                priority = self._calculate_priority('WARNING', impact, count, trend)
-                ai_text = analyze_issue_with_ai(
-                     issue_type='LOOPING',
-                     location=norm_url,
-                     metrics_context=f"Количество зацикливаний: {count}",
-                     page_title=page_metrics.page_title if page_metrics else None,
-                     page_metrics={'avg_time': page_metrics.avg_time_on_page if page_metrics else None} if page_metrics else None,
-                     dominant_cohort=page_metrics.dominant_cohort if page_metrics else None,
-                     dominant_device=page_metrics.dominant_device if page_metrics else None
-                 )
-                issues.append(UXIssue(
-                    version=version,
-                    issue_type='LOOPING',
-                    severity='WARNING',
-                    description=f"Пользователи возвращаются на эту страницу (циклов: {count}).",
-                    location_url=norm_url,
-                    affected_sessions=count,
-                    impact_score=impact,
-                    ai_hypothesis=ai_text,
-                    detected_version_name=version.name,
-                    trend=trend,
-                    priority=priority,
-                    recommended_specialists=self._recommend_specialists('LOOPING')
-                ))
-
-        # C. WANDERING (Блуждание) - сессии с >10 просмотрами, но без целей
-        if 'ym:s:goalsID' in df_visits.columns:
-            wandering_visits = df_visits[
-                (df_visits['ym:s:pageViews'] > 10) & 
-                (df_visits['ym:s:goalsID'].isna() | (df_visits['ym:s:goalsID'].astype(str) == '[]'))
-            ].copy()
-            
-            if not wandering_visits.empty:
-                wandering_visits['norm_start_url'] = wandering_visits['ym:s:startURL'].apply(normalize_issue_url)
-                wandering_by_page = wandering_visits.groupby('norm_start_url').size()
-                for entry_page, count in wandering_by_page.head(5).items():
-                    if not entry_page:
-                        continue
-                    # Отсеиваем шум: слишком мало сессий
-                    if count < MIN_WANDERING_SESSIONS:
-                        continue
-                    # Получаем метрики страницы
-                    page_metrics = PageMetrics.objects.filter(version=version, url=entry_page).first()
-                    avg_depth = wandering_visits[wandering_visits['norm_start_url'] == entry_page]['ym:s:pageViews'].mean()
-                    metrics_context = f"Количество сессий: {count}, Средняя глубина: {avg_depth:.1f}"
-                    
-                    ai_text = analyze_issue_with_ai(
-                        issue_type='WANDERING',
-                        location=entry_page,
-                        metrics_context=metrics_context,
-                        page_title=page_metrics.page_title if page_metrics else None,
-                        page_metrics={'avg_time': page_metrics.avg_time_on_page if page_metrics else None,
-                                     'exit_rate': page_metrics.exit_rate if page_metrics else None} if page_metrics else None,
-                        dominant_cohort=page_metrics.dominant_cohort if page_metrics else None,
-                        dominant_device=page_metrics.dominant_device if page_metrics else None
-                    )
-                    issues.append(UXIssue(
-                        version=version,
-                        issue_type='WANDERING',
-                        severity='WARNING',
-                        description=f"Пользователи блуждают по {avg_depth:.1f} страницам без достижения целей.",
-                        location_url=entry_page,
-                        affected_sessions=count,
-                        impact_score=min(count * 0.1, 10.0),
-                        ai_hypothesis=ai_text
-                    ))
-
-        # D. NAVIGATION_BACK (Частое использование "Назад")
-        df_hits_sorted = df_hits.sort_values(['ym:pv:clientID', 'ym:pv:dateTime'])
-        if not df_hits_sorted.empty:
-            def canonical_loop_key(path_tuple):
-                """
-                Сводит петли к канонической форме, чтобы A->B->A и B->A->B считались одним паттерном.
-                Для двувершинных циклов сортируем вершины; для остальных оставляем как есть.
-                """
-                unique_nodes = set(path_tuple)
-                if len(unique_nodes) == 2:
-                    return tuple(sorted(unique_nodes))
-                return path_tuple
-
-            def canonical_loop_display(path_tuple):
-                """Возвращает детерминированное отображение для канонического ключа."""
-                unique_nodes = set(path_tuple)
-                if len(unique_nodes) == 2:
-                    a, b = sorted(unique_nodes)
-                    return f"{a} -> {b} -> {a}"
-                return " -> ".join(path_tuple)
-
-            # Собираем навигационные циклы 2-3 страниц, чтобы не плодить дубликаты issues
-            loop_events = []
-            for client_id, group in df_hits_sorted.groupby('ym:pv:clientID'):
-                urls = group['ym:pv:URL'].tolist()
-                for idx in range(len(urls)):
-                    for window in (2, 3):  # A->B->A and A->B->C->A
-                        if idx >= window:
-                            seq = urls[idx-window:idx+1]
-                            norm_seq = [normalize_issue_url(u) for u in seq]
-                            if norm_seq[0] and norm_seq[-1] and norm_seq[0] == norm_seq[-1] and len(set(norm_seq)) > 1:
-                                key = canonical_loop_key(tuple(norm_seq))
-                                display = canonical_loop_display(tuple(norm_seq))
-                                loop_events.append((key, display, client_id))
-
-            if loop_events:
-                from collections import defaultdict
-                path_counts = defaultdict(int)
-                path_users = defaultdict(set)
-                path_display = {}
-                for path_key, display_path, client_id in loop_events:
-                    path_counts[path_key] += 1
-                    path_users[path_key].add(client_id)
-                    if path_key not in path_display:
-                        path_display[path_key] = display_path
-
-                top_loops = sorted(path_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-                for path_key, pattern_count in top_loops:
-                    loop_path = path_display.get(path_key, " -> ".join(path_key))
-                    users_count = len(path_users[path_key])
-                    # Берем вторую страницу как проблемную точку для метрик, если есть
-                    target_url = path_key[1] if len(path_key) > 1 else path_key[0]
-                    nav_back_targets.add(target_url)
-                    page_metrics = PageMetrics.objects.filter(version=version, url=target_url).first()
-                    metrics_context = f"Навигационный цикл: {loop_path}. Повторений: {pattern_count}, пользователей: {users_count}"
-                    impact = min(pattern_count * 0.12, 10.0)
-                    trend = self._calculate_trend('NAVIGATION_BACK', loop_path, impact)
-                    priority = self._calculate_priority('WARNING', impact, users_count, trend)
-
-                    ai_text = analyze_issue_with_ai(
-                        issue_type='NAVIGATION_BACK',
-                        location=loop_path,
-                        metrics_context=metrics_context,
-                        page_title=page_metrics.page_title if page_metrics else None,
-                        page_metrics={'avg_time': page_metrics.avg_time_on_page if page_metrics else None} if page_metrics else None,
-                        dominant_cohort=page_metrics.dominant_cohort if page_metrics else None,
-                        dominant_device=page_metrics.dominant_device if page_metrics else None
-                    )
-                    issues.append(UXIssue(
-                        version=version,
-                        issue_type='NAVIGATION_BACK',
-                        severity='WARNING',
-                        description=f"Пользователи ходят по петле {loop_path} ({pattern_count} паттернов, {users_count} пользователей).",
-                        location_url=loop_path,
-                        affected_sessions=users_count,
-                        impact_score=impact,
-                        ai_hypothesis=ai_text,
-                        detected_version_name=version.name,
-                        trend=trend,
-                        priority=priority,
-                        recommended_specialists=self._recommend_specialists('LOOPING')
-                    ))
-
-        # E. HIGH_BOUNCE после учета back-циклов: если страница уже в back loop, не плодим дубль
-        bounced_visits = df_visits[df_visits['ym:s:visitDuration'] < 15]['ym:s:clientID']
-        bounced_hits = df_hits[df_hits['ym:pv:clientID'].isin(bounced_visits)].copy()
-        
-        if not bounced_hits.empty:
-            bounced_hits['norm_url'] = bounced_hits['ym:pv:URL'].apply(normalize_issue_url)
-            bounce_stats = bounced_hits['norm_url'].value_counts().head(5)
-            for norm_url, count in bounce_stats.items():
-                 if not norm_url:
-                     continue
-                 if norm_url in nav_back_targets:
-                     continue  # уже покрыто back-loop проблемой
-                 representative_url = pick_representative_url(bounced_hits, 'norm_url', norm_url)
-                 page_metrics = PageMetrics.objects.filter(version=version, url=representative_url).first()
-                 if not page_metrics:
-                     page_metrics = PageMetrics.objects.filter(version=version, url=norm_url).first()
-                 impact = min(count * 0.2, 10.0)
-                 trend = self._calculate_trend('HIGH_BOUNCE', norm_url, impact)
-                 priority = self._calculate_priority('CRITICAL', impact, count, trend)
-                 ai_text = analyze_issue_with_ai(
-                     issue_type='HIGH_BOUNCE',
-                     location=norm_url,
-                     metrics_context=f"Количество отказов: {count}",
-                     page_title=page_metrics.page_title if page_metrics else None,
-                     page_metrics={'exit_rate': page_metrics.exit_rate if page_metrics else None,
-                                  'avg_time': page_metrics.avg_time_on_page if page_metrics else None} if page_metrics else None,
-                     dominant_cohort=page_metrics.dominant_cohort if page_metrics else None,
-                     dominant_device=page_metrics.dominant_device if page_metrics else None
-                 )
-                 issues.append(UXIssue(
-                    version=version,
-                    issue_type='HIGH_BOUNCE',
-                    severity='CRITICAL',
-                    description=f"Высокий отскок: {count} пользователей ушли сразу.",
-                    location_url=norm_url,
-                    affected_sessions=count,
-                    impact_score=impact,
-                    ai_hypothesis=ai_text,
-                    detected_version_name=version.name,
-                    trend=trend,
-                    priority=priority,
-                    recommended_specialists=self._recommend_specialists('HIGH_BOUNCE')
-                ))
+        names = resolve_detectors(detectors)
+        pages = PageMetricsIndex.load(version)
+        data = self.detector_inputs(df_hits, df_visits, pages, required_inputs(names))
+        findings, timings = run_detectors(data, detectors, workers)
+        for name in names:
+            if detectors and name not in detectors:
+                self.stdout.write(f"  {name}: dependency, {timings[name]:.2f}s")
+                continue
+            found = sum(finding.issue_type == name for finding in findings)
+            self.stdout.write(f"  {name}: {found} found in {timings[name]:.2f}s")
 
-        # F. FORM_FIELD_ERRORS (Ошибки ввода в формах)
-        form_pattern = r'/form|/apply|/request|/anket|/zayav'
-        form_hits = df_hits[df_hits['ym:pv:URL'].astype(str).str.contains(form_pattern, na=False, regex=True)]
-        
-        if not form_hits.empty:
-            # Нормализуем время и режем на «квазисессии» с разрывом >30 минут, чтобы не суммировать дни
-            form_hits = form_hits.copy()
-            form_hits['ym:pv:dateTime'] = pd.to_datetime(form_hits['ym:pv:dateTime'], utc=True, errors='coerce')
-            form_hits = form_hits.dropna(subset=['ym:pv:dateTime'])
-            form_hits = form_hits.sort_values(['ym:pv:clientID', 'ym:pv:dateTime'])
-            form_hits['time_diff'] = form_hits.groupby('ym:pv:clientID')['ym:pv:dateTime'].diff().dt.total_seconds().fillna(0)
-            form_hits['session_group'] = form_hits.groupby('ym:pv:clientID')['time_diff'].transform(lambda x: (x > 1800).cumsum())
-            form_hits['session_key'] = form_hits['ym:pv:clientID'].astype(str) + "_" + form_hits['session_group'].astype(str)
-
-            form_sessions = form_hits.groupby('session_key').agg(
-                client_id=('ym:pv:clientID', 'first'),
-                url=('ym:pv:URL', 'first'),
-                min_time=('ym:pv:dateTime', 'min'),
-                max_time=('ym:pv:dateTime', 'max'),
-            )
-            form_sessions['duration'] = (form_sessions['max_time'] - form_sessions['min_time']).dt.total_seconds()
-            # Отсекаем явно сломанные длительности (>2 часов)
-            form_sessions = form_sessions[form_sessions['duration'] <= 7200]
-            
-            # Долго на форме (>60 сек) и нет цели
-            long_form = form_sessions[form_sessions['duration'] > 60]
-            if not long_form.empty:
-                long_form_clients = long_form['client_id']
-                # Проверяем, есть ли у этих пользователей goals
-                if 'ym:s:goalsID' in df_visits.columns:
-                    has_goals = df_visits[
-                        df_visits['ym:s:clientID'].isin(long_form_clients) & 
-                        ~df_visits['ym:s:goalsID'].isna() &
-                        (df_visits['ym:s:goalsID'].astype(str) != '[]')
-                    ]
-                    problem_clients = set(long_form_clients) - set(has_goals['ym:s:clientID'])
-                else:
-                    problem_clients = set(long_form_clients)
-                
-                if problem_clients:
-                    form_urls = long_form[long_form['client_id'].isin(problem_clients)]['url'].value_counts().head(5)
-                    for url, count in form_urls.items():
-                        norm_url = normalize_issue_url(url)
-                        page_metrics = PageMetrics.objects.filter(version=version, url=norm_url or url).first()
-                        avg_duration = long_form[long_form['url'] == url]['duration'].mean()
-                        metrics_context = f"Количество проблемных сессий: {count}, Среднее время на форме: {avg_duration:.1f} сек"
-                        
-                        ai_text = analyze_issue_with_ai(
-                            issue_type='FORM_FIELD_ERRORS',
-                            location=norm_url or url,
-                            metrics_context=metrics_context,
-                            page_title=page_metrics.page_title if page_metrics else None,
-                            page_metrics={'avg_time': avg_duration} if page_metrics else None,
-                            dominant_cohort=page_metrics.dominant_cohort if page_metrics else None,
-                            dominant_device=page_metrics.dominant_device if page_metrics else None
-                        )
-                        issues.append(UXIssue(
-                            version=version,
-                            issue_type='FORM_FIELD_ERRORS',
-                            severity='WARNING',
-                            description=f"Пользователи проводят {avg_duration:.1f} с на форме и не отправляют (сессий: {count}).",
-                            location_url=norm_url or url,
-                            affected_sessions=count,
-                            impact_score=min(count * 0.15, 10.0),
-                            ai_hypothesis=ai_text
-                        ))
-
-        # G. FUNNEL_DROPOFF (Критические точки отказа в воронках)
-        # Для приемной комиссии/банка: определяем популярные пути
-        funnel_steps = ['/', '/lists', '/rating', '/apply']
-        
-        for i in range(len(funnel_steps) - 1):
-            step1_url = normalize_issue_url(funnel_steps[i])
-            step2_url = normalize_issue_url(funnel_steps[i+1])
-            
-            step1_users = set(df_hits[df_hits['norm_url'] == step1_url]['ym:pv:clientID'])
-            step2_users = set(df_hits[df_hits['norm_url'] == step2_url]['ym:pv:clientID'])
-            
-            # Порог по количеству, чтобы не создавать шумные дропы
-            if step1_users and len(step1_users) >= 50:
-                conversion = len(step2_users & step1_users) / len(step1_users)
-                
-                if conversion < 0.3:  # <30% конверсия = критическая точка
-                    lost_users = len(step1_users) - len(step2_users & step1_users)
-                    page_metrics = PageMetrics.objects.filter(version=version, url=step1_url).first() or PageMetrics.objects.filter(version=version, url=funnel_steps[i]).first()
-                    metrics_context = f"Конверсия {step1_url} -> {step2_url}: {conversion*100:.1f}%, Потеряно пользователей: {lost_users}"
-                    
-                    ai_text = analyze_issue_with_ai(
-                        issue_type='FUNNEL_DROPOFF',
-                        location=step1_url,
-                        metrics_context=metrics_context,
-                        page_title=page_metrics.page_title if page_metrics else None,
-                        page_metrics={'exit_rate': page_metrics.exit_rate if page_metrics else None} if page_metrics else None,
-                        dominant_cohort=page_metrics.dominant_cohort if page_metrics else None,
-                        dominant_device=page_metrics.dominant_device if page_metrics else None
-                    )
-                    issues.append(UXIssue(
-                        version=version,
-                        issue_type='FUNNEL_DROPOFF',
-                        severity='CRITICAL',
-                        description=f"Критический отвал: только {conversion*100:.1f}% переходят с {step1_url} на {step2_url}.",
-                        location_url=step1_url,
-                        affected_sessions=lost_users,
-                        impact_score=min(lost_users * 0.2, 10.0),
-                        ai_hypothesis=ai_text
-                    ))
-
-        # H. SCAN_AND_DROP: высокие выходы при глубоком скролле и коротком времени
-        scan_drop_candidates = PageMetrics.objects.filter(
-            version=version,
-            avg_scroll_depth__gte=80,
-            total_views__gte=MIN_PAGE_VIEWS_FOR_PAGE_ALERT
-        ).order_by('-exit_rate')[:5]
-        for metric in scan_drop_candidates:
-            if metric.exit_rate and metric.exit_rate > 70 and metric.avg_time_on_page < 30:
-                norm_url = normalize_issue_url(metric.url)
-                impact = min(metric.exit_rate / 10, 10.0)
-                ai_text = analyze_issue_with_ai(
-                    issue_type='SCAN_AND_DROP',
-                    location=norm_url,
-                    metrics_context=f"Exit rate: {metric.exit_rate:.1f}%, Avg time: {metric.avg_time_on_page:.1f}s, Scroll: {metric.avg_scroll_depth:.1f}%",
-                    page_title=metric.page_title,
-                    page_metrics={
-                        'exit_rate': metric.exit_rate,
-                        'avg_time': metric.avg_time_on_page,
-                        'scroll_depth': metric.avg_scroll_depth,
-                    },
-                    dominant_cohort=metric.dominant_cohort,
-                    dominant_device=metric.dominant_device
-                )
-                issues.append(UXIssue(
-                    version=version,
-                    issue_type='SCAN_AND_DROP',
-                    severity='WARNING',
-                    description=f"Быстрый просмотр и уход (выход {metric.exit_rate:.1f}%, время {metric.avg_time_on_page:.1f} с).",
-                    location_url=norm_url,
-                    affected_sessions=int(metric.total_views),
-                    impact_score=impact,
-                    ai_hypothesis=ai_text
-                ))
+        built = [self.build_issue(version, finding, pages) for finding in findings]
+        issues = [issue for issue, _ in built]
+        if merge:
+            saved = self.merge_issues(version, issues, issue_types=detectors)
+        else:
+            saved = UXIssue.objects.bulk_create(issues)
+        self.stdout.write(f"Найдено {len(issues)} UX-проблем.")
+        self.enrich_issues(saved, [ai_request for _, ai_request in built])
 
-        # J. DEAD_CLICK: страницы с высоким выходом и почти нулевым вовлечением
-        dead_candidates = PageMetrics.objects.filter(
-            version=version,
-            total_views__gte=MIN_PAGE_VIEWS_FOR_PAGE_ALERT,
-            exit_rate__gte=60,
-            avg_time_on_page__lte=5
-        ).order_by('-exit_rate')[:5]
-        for metric in dead_candidates:
-            if metric.avg_scroll_depth is not None and metric.avg_scroll_depth > 20:
-                continue  # не считаем, если есть скролл
-            norm_url = normalize_issue_url(metric.url)
-            impact = min(metric.exit_rate / 8, 10.0)
-            ai_text = analyze_issue_with_ai(
-                issue_type='DEAD_CLICK',
-                location=norm_url,
-                metrics_context=f"Exit rate: {metric.exit_rate:.1f}%, Avg time: {metric.avg_time_on_page:.1f}s, Scroll: {metric.avg_scroll_depth}",
-                page_title=metric.page_title,
-                page_metrics={
-                    'exit_rate': metric.exit_rate,
-                    'avg_time': metric.avg_time_on_page,
-                    'scroll_depth': metric.avg_scroll_depth,
-                },
-                dominant_cohort=metric.dominant_cohort,
-                dominant_device=metric.dominant_device
-            )
-            issues.append(UXIssue(
-                version=version,
-                issue_type='DEAD_CLICK',
-                severity='WARNING',
-                description=f"Похоже на мёртвые клики: выход {metric.exit_rate:.1f}%, время {metric.avg_time_on_page:.1f} с.",
-                location_url=norm_url,
-                affected_sessions=int(metric.total_views),
-                impact_score=impact,
-                ai_hypothesis=ai_text
-            ))
+    def enrich_issues(self, issues, ai_requests):
+        """
+        Запрашивает AI-гипотезы для сохраненных проблем с заглушкой (issues[i] - проблема запроса ai_requests[i])
+        конкурентно, с ограничением частоты, параллельности и дедлайном (ai_enrich.py),
+        и записывает ответы одним bulk_update. Не успевшие к дедлайну остаются с заглушкой.
+        Без кредов AI проход пропускается: analyze_issue_with_ai вернул бы те же заглушки.
+        """
+        if not ai_configured():
+            return
+        stub_texts = set(get_stub_text_variants(include_legacy=True))
+        pending = [
+            (issue, ai_request) for issue, ai_request in zip(issues, ai_requests)
+            if not issue.ai_hypothesis or issue.ai_hypothesis in stub_texts
+        ]
+        if not pending:
+            return
+        started = time.time()
+        results = enrich_concurrently(
+            [ai_request for _, ai_request in pending], analyze_issue_with_ai,
+        )
+        changed = []
+        for (issue, _), ai_text in zip(pending, results):
+            if ai_text and ai_text != issue.ai_hypothesis:
+                issue.ai_hypothesis = ai_text
+                changed.append(issue)
+        if changed:
+            UXIssue.objects.bulk_update(changed, ['ai_hypothesis'], batch_size=500)
+        missed = sum(ai_text is None for ai_text in results)
+        self.stdout.write(
+            f"AI-гипотезы: {len(changed)} обновлено из {len(pending)} за {time.time() - started:.1f}s"
+            + (f", {missed} не успели к дедлайну." if missed else ".")
+        )
 
-        # I. SEARCH_FAIL: страницы поиска с высоким exit
-        search_metrics = PageMetrics.objects.filter(
+    def detector_inputs(self, df_hits, df_visits, pages, inputs):
+        """
+        Входы детекторов: hits - общий кадр (одна сортировка и нормализация URL, hit_frame.py),
+        visits - визиты с нормализованным startURL, page_metrics - PageMetricsIndex версии.
+        """
+        data = {}
+        if 'hits' in inputs:
+            data['hits'] = build_hit_frame(df_hits)
+        if 'visits' in inputs:
+            start_urls = df_visits['ym:s:startURL'] if 'ym:s:startURL' in df_visits.columns else pd.Series(None, index=df_visits.index, dtype=object)
+            data['visits'] = df_visits.assign(norm_start_url=issue_urls(start_urls))
+        if 'page_metrics' in inputs:
+            data['page_metrics'] = pages
+        return data
+
+    def build_issue(self, version, finding, pages):
+        """
+        UXIssue из находки детектора: метрики страницы из pages (PageMetricsIndex), trend/priority
+        и заглушка вместо AI-гипотезы. Возвращает (issue, аргументы analyze_issue_with_ai для enrich_issues).
+        """
+        page = pages.find(finding.page_urls) or {}
+        ai_metrics = None
+        if page:
+            ai_metrics = {key: page[PAGE_METRIC_FIELDS[key]] for key in finding.ai_fields}
+            ai_metrics.update(finding.ai_metrics or {})
+
+        extra = {}
+        if finding.tracked:
+            trend = self._calculate_trend(finding.issue_type, finding.location_url, finding.impact_score)
+            extra = {
+                'detected_version_name': version.name,
+                'trend': trend,
+                'priority': self._calculate_priority(finding.severity, finding.impact_score, finding.affected_sessions, trend),
+                'recommended_specialists': self._recommend_specialists(finding.specialists_type or finding.issue_type),
+            }
+        ai_request = dict(
+            issue_type=finding.issue_type,
+            location=finding.location_url,
+            metrics_context=finding.metrics_context,
+            page_title=page.get('page_title'),
+            page_metrics=ai_metrics,
+            dominant_cohort=page.get('dominant_cohort'),
+            dominant_device=page.get('dominant_device'),
+        )
+        issue = UXIssue(
             version=version,
-            url__icontains='search',
-            total_views__gte=MIN_PAGE_VIEWS_FOR_PAGE_ALERT
-        ).order_by('-exit_rate')[:5]
-        for metric in search_metrics:
-            if metric.exit_rate and metric.exit_rate > 70:
-                norm_url = normalize_issue_url(metric.url)
-                impact = min(metric.exit_rate / 8, 10.0)
-                ai_text = analyze_issue_with_ai(
-                    issue_type='SEARCH_FAIL',
-                    location=norm_url,
-                    metrics_context=f"Search exit rate: {metric.exit_rate:.1f}%, Avg time: {metric.avg_time_on_page:.1f}s",
-                    page_title=metric.page_title,
-                    page_metrics={
-                        'exit_rate': metric.exit_rate,
-                        'avg_time': metric.avg_time_on_page,
-                    },
-                    dominant_cohort=metric.dominant_cohort,
-                    dominant_device=metric.dominant_device
-                )
-                issues.append(UXIssue(
-                    version=version,
-                    issue_type='SEARCH_FAIL',
-                    severity='WARNING',
-                    description=f"Страница поиска с высоким выходом ({metric.exit_rate:.1f}%).",
-                    location_url=norm_url,
-                    affected_sessions=int(metric.total_views),
-                    impact_score=impact,
-                    ai_hypothesis=ai_text
-                ))
+            issue_type=finding.issue_type,
+            severity=finding.severity,
+            description=finding.description,
+            location_url=finding.location_url,
+            affected_sessions=finding.affected_sessions,
+            impact_score=finding.impact_score,
+            ai_hypothesis=generate_stub_hypothesis(finding.issue_type),
+            **extra
+        )
+        return issue, ai_request
 
-        UXIssue.objects.bulk_create(issues)
-        self.stdout.write(f"Найдено {len(issues)} UX-проблем.")
+    def merge_issues(self, version, issues, issue_types=None):
+        """
+        Сливает свежий результат детекторов с проблемами версии по ключу (тип, URL):
+        совпавшие обновляются (AI-текст сохраняется, если уже был), новые создаются,
+        больше не найденные удаляются. issue_types - сливать только эти типы (запуск части детекторов).
+        Возвращает сохраненные проблемы в порядке issues.
+        """
+        current_issues = UXIssue.objects.filter(version=version)
+        if issue_types:
+            current_issues = current_issues.filter(issue_type__in=issue_types)
+        existing = {}
+        for issue in current_issues.order_by('id'):
+            existing.setdefault((issue.issue_type, issue.location_url), issue)
+        fields = ['severity', 'description', 'affected_sessions', 'impact_score', 'trend', 'priority',
+                  'recommended_specialists', 'detected_version_name', 'ai_hypothesis', 'ai_solution']
+
+        to_create, to_update, saved = [], [], []
+        for issue in issues:
+            current = existing.pop((issue.issue_type, issue.location_url), None)
+            if current is None:
+                to_create.append(issue)
+                saved.append(issue)
+                continue
+            ai_hypothesis, ai_solution = current.ai_hypothesis, current.ai_solution
+            for field in fields:
+                setattr(current, field, getattr(issue, field))
+            if ai_hypothesis:
+                current.ai_hypothesis, current.ai_solution = ai_hypothesis, ai_solution
+            to_update.append(current)
+            saved.append(current)
+
+        stale_ids = [issue.id for issue in existing.values()]
+        UXIssue.objects.filter(version=version, id__in=stale_ids).delete()
+        UXIssue.objects.bulk_create(to_create)
+        UXIssue.objects.bulk_update(to_update, fields, batch_size=500)
+        self.stdout.write(
+            f"Issues merged: {len(to_update)} updated, {len(to_create)} new, {len(stale_ids)} resolved."
+        )
+        return saved
 
     def build_previous_issue_index(self, version):
         """
         Собирает последнюю известную проблему на каждую пару (тип, URL) в более старых версиях.
         Используется для расчета динамики.
         """
+        # Порядок по дате релиза, а не по времени записи: версии могут грузиться параллельно
         older_issues = UXIssue.objects.filter(
             version__release_date__lt=version.release_date
-        ).order_by('-created_at')
+        ).order_by('-version__release_date', '-created_at')
 
         index = {}
         for issue in older_issues:
@@ -1038,6 +969,24 @@ class Command(BaseCommand):
                 index[key] = issue
         return index
 
+    def refresh_issue_trends(self, version):
+        """
+        Пересчитывает trend/priority проблем версии по уже загруженным более старым версиям.
+        Нужен, когда версии грузились параллельно и предыдущая на момент анализа еще не была готова.
+        """
+        self.prev_issue_index = self.build_previous_issue_index(version)
+        changed = []
+        for issue in UXIssue.objects.filter(version=version, issue_type__in=TREND_ISSUE_TYPES):
+            trend = self._calculate_trend(issue.issue_type, issue.location_url, issue.impact_score or 0)
+            priority = self._calculate_priority(issue.severity, issue.impact_score or 0, issue.affected_sessions, trend)
+            if trend != issue.trend or priority != issue.priority:
+                issue.trend = trend
+                issue.priority = priority
+                changed.append(issue)
+        if changed:
+            UXIssue.objects.bulk_update(changed, ['trend', 'priority'], batch_size=500)
+        self.stdout.write(f"Refreshed trend for {len(changed)} issues of {version.name}.")
+
     def _calculate_trend(self, issue_type, location_url, impact_score):
         """
         Возвращает строковый код динамики: new/worse/improved/stable.
@@ -1109,24 +1058,13 @@ class Command(BaseCommand):
         
         self.stdout.write("Calculating goal achievements...")
         
-        # 2a. Identifier goals (ym:s:goalsID from Visits)
-        if 'ym:s:goalsID' in df_visits.columns:
-            # Expand goalsID list/string
-            # Metrica often sends '[12345, 67890]' string
-            def check_goal_id(row_val, target_id):
-                return str(target_id) in str(row_val)
-
-            for goal in goals_config:
-                if goal['match']['type'] == 'identifier':
-                    goal_id = goal['ym_goal_id']
-                    col_name = f"goal_{goal['code']}"
-                    # Check if any visit of this user has this goal ID
-                    # We do this by aggregating: did the user EVER have this goal?
-                    
-                    # Helper series
-                    has_goal = df_visits['ym:s:goalsID'].apply(lambda x: check_goal_id(x, goal_id)).astype(int)
-                    user_goal_counts = df_visits.assign(temp_goal=has_goal).groupby('ym:s:clientID')['temp_goal'].max()
-                    user_behavior[col_name] = user_goal_counts
+        # 2a. Identifier goals: did the user EVER have this goal ID?
+        # Клиенты с целью - индексный запрос к SessionGoal вместо разбора goalsID каждого визита
+        for goal in goals_config:
+            if goal['match']['type'] == 'identifier':
+                col_name = f"goal_{goal['code']}"
+                achieved = clients_with_goal(version, goal['ym_goal_id'])
+                user_behavior[col_name] = user_behavior.index.isin(achieved).astype(int)
 
         # 2b. URL/Click goals (from Hits)
         # Group hits by clientID
@@ -1290,7 +1228,7 @@ class Command(BaseCommand):
             agg["duration_sum"] += cluster_data['avg_duration'].sum()
             agg["depth_sum"] += cluster_data['avg_depth'].sum()
             # Собираем client_ids для воронок
-            agg["client_ids"].extend(list(cluster_data.index.astype(str)))
+            agg["client_ids"].extend(int(client_id) for client_id in cluster_data.index)
             for gc in goal_cols:
                 agg["goal_sums"][gc] += cluster_data[gc].sum()
             for ic in interest_cols:
@@ -1367,14 +1305,18 @@ class Command(BaseCommand):
             )
             self.stdout.write(f"Сохранена когорта: {final_name} ({total_users} пользователей)")
 
-    def calculate_daily_stats(self, version):
+    def calculate_daily_stats(self, version, dates=None):
+        """Дневная статистика версии; dates - пересчитать только эти дни (--append)."""
         self.stdout.write("Calculating daily stats...")
         from django.db.models import Count, Avg, Sum, Q
         from django.db.models.functions import TruncDate
         
         stats = VisitSession.objects.filter(version=version).annotate(
             date=TruncDate('start_time')
-        ).values('date').annotate(
+        )
+        if dates is not None:
+            stats = stats.filter(date__in=dates)
+        stats = stats.values('date').annotate(
             total_sessions=Count('id'),
             total_bounces=Count('id', filter=Q(bounced=True)),
             avg_duration=Avg('duration_sec')
@@ -1390,28 +1332,18 @@ class Command(BaseCommand):
                 avg_duration=stat['avg_duration'] or 0
             ))
         
-        DailyStat.objects.bulk_create(daily_stats, ignore_conflicts=True)
+        DailyStat.objects.bulk_create(
+            daily_stats,
+            update_conflicts=True,
+            unique_fields=['version', 'date'],
+            update_fields=['total_sessions', 'total_bounces', 'avg_duration'],
+        )
 
     def update_issue_lifecycle(self, version):
         """Фиксирует появление/исчезновение проблем между версиями."""
         self.stdout.write("Updating issue lifecycle...")
         from analytics.models import UXIssue, IssueLifecycle, ProductVersion
 
-        def norm(raw_url: str) -> str:
-            if not isinstance(raw_url, str):
-                return ""
-            parsed = urllib.parse.urlparse(raw_url.strip())
-            netloc = parsed.netloc.lower()
-            path = (parsed.path or "/").rstrip("/") or "/"
-            query_dict = urllib.parse.parse_qs(parsed.query, keep_blank_values=False)
-            for noisy in ['referer', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term', 'yclid', '_openstat', 'from', 'ref']:
-                query_dict.pop(noisy, None)
-            clean_query = urllib.parse.urlencode({k: v[0] if len(v) == 1 else v for k, v in query_dict.items()}, doseq=True)
-            scheme = parsed.scheme.lower() if parsed.scheme else ("https" if netloc else "")
-            if netloc or scheme:
-                return urllib.parse.urlunparse((scheme, netloc, path, '', clean_query, ''))
-            return path + (f"?{clean_query}" if clean_query else "")
-
         prev_version = ProductVersion.objects.filter(release_date__lt=version.release_date).order_by('-release_date').first()
         # очищаем записи для пересчета
         IssueLifecycle.objects.filter(version_first_seen=version).delete()
@@ -1422,8 +1354,8 @@ class Command(BaseCommand):
         if prev_version:
             prev = UXIssue.objects.filter(version=prev_version)
 
-        prev_index = {(iss.issue_type, norm(iss.location_url)): iss for iss in prev}
-        current_index = {(iss.issue_type, norm(iss.location_url)): iss for iss in current}
+        prev_index = {(iss.issue_type, normalize_issue_url(iss.location_url)): iss for iss in prev}
+        current_index = {(iss.issue_type, normalize_issue_url(iss.location_url)): iss for iss in current}
 
         lifecycles = []
         for key, issue in current_index.items():
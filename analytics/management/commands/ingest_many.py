@@ -0,0 +1,111 @@
+"""
+Параллельная загрузка нескольких версий продукта.
+
+Манифест (YAML) - список версий (или словарь с ключом versions):
+
+    versions:
+      - name: "v1.0 (2022)"
+        year: 2022
+        visits: 2022_yandex_metrika_visits.parquet
+        hits: 2022_yandex_metrika_hits.parquet
+      - name: "v2.0 (2024)"
+        year: 2024
+        visits: 2024_yandex_metrika_visits.parquet
+        hits: 2024_yandex_metrika_hits.parquet
+        options: {stream: true, batch_rows: 200000}   # любые опции ingest_data
+
+Каждая версия грузится командой ingest_data в отдельном процессе со своим
+соединением с БД. После завершения всех версий выполняется общий проход:
+пересчет trend/priority и IssueLifecycle в порядке дат релиза.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from analytics.models import ProductVersion
+from analytics.ingest_workers import init_worker, ingest_version
+from analytics.management.commands.ingest_data import Command as IngestCommand
+
+
+def load_manifest(path):
+    """Читает манифест и проверяет обязательные поля версий."""
+    if not os.path.exists(path):
+        raise CommandError(f"Manifest not found: {path}")
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f) or []
+    entries = data.get('versions', []) if isinstance(data, dict) else data
+    if not entries:
+        raise CommandError(f"No versions in manifest {path}")
+    for entry in entries:
+        missing = [key for key in ('name', 'visits', 'hits', 'year') if not entry.get(key)]
+        if missing:
+            raise CommandError(f"Manifest entry {entry!r} is missing: {', '.join(missing)}")
+        for key in ('visits', 'hits'):
+            if not os.path.exists(entry[key]):
+                raise CommandError(f"{entry['name']}: file not found: {entry[key]}")
+    names = [entry['name'] for entry in entries]
+    if len(set(names)) != len(names):
+        raise CommandError("Version names in manifest must be unique")
+    return entries
+
+
+class Command(BaseCommand):
+    help = 'Ingests several product versions in parallel (one process per version) from a YAML manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manifest', type=str, required=True, help='Path to versions YAML manifest')
+        parser.add_argument('--workers', type=int, default=2, help='Number of parallel worker processes')
+        parser.add_argument('--clear', action='store_true', help='Clear existing data for every version before loading')
+        parser.add_argument('--verbose-output', action='store_true', help='Print full ingest_data output of every version')
+
+    def handle(self, *args, **options):
+        entries = load_manifest(options['manifest'])
+        if options['clear']:
+            for entry in entries:
+                entry['clear'] = True
+        workers = max(1, min(options['workers'], len(entries)))
+        if workers > 1 and connection.vendor == 'sqlite':
+            # SQLite допускает только одного писателя - параллельные процессы упрутся в "database is locked"
+            self.stdout.write(self.style.WARNING("SQLite: using a single worker process."))
+            workers = 1
+
+        self.stdout.write(f"Ingesting {len(entries)} version(s) with {workers} worker(s)...")
+        started = time.perf_counter()
+        # Соединения родителя не должны утечь в дочерние процессы
+        connections.close_all()
+
+        failed = []
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as pool:
+            futures = [pool.submit(ingest_version, entry) for entry in entries]
+            for future in as_completed(futures):
+                name, ok, elapsed, output = future.result()
+                if options['verbose_output']:
+                    self.stdout.write(output)
+                if ok:
+                    self.stdout.write(self.style.SUCCESS(f"✅ {name}: done in {elapsed:.1f}s"))
+                else:
+                    failed.append(name)
+                    tail = "\n".join(output.strip().splitlines()[-15:])
+                    self.stdout.write(self.style.ERROR(f"❌ {name}: failed after {elapsed:.1f}s\n{tail}"))
+
+        # Общий проход по версиям: динамика и lifecycle зависят от предыдущих версий,
+        # которые при параллельной загрузке могли быть еще не готовы
+        self.stdout.write("Cross-version pass (trend, issue lifecycle)...")
+        ingest_cmd = IngestCommand()
+        ingest_cmd.stdout = self.stdout
+        names = [entry['name'] for entry in entries if entry['name'] not in failed]
+        for version in ProductVersion.objects.filter(name__in=names).order_by('release_date', 'id'):
+            ingest_cmd.refresh_issue_trends(version)
+            ingest_cmd.update_issue_lifecycle(version)
+
+        total = time.perf_counter() - started
+        if failed:
+            self.stdout.write(self.style.WARNING(f"Finished in {total:.1f}s, failed: {', '.join(failed)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"All versions ingested in {total:.1f}s"))
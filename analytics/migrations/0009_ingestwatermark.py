@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0008_issuelifecycle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('max_visit_time', models.DateTimeField(blank=True, null=True)),
+                ('max_hit_time', models.DateTimeField(blank=True, null=True)),
+                ('ingested_files', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('version', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='watermark', to='analytics.productversion')),
+            ],
+        ),
+    ]
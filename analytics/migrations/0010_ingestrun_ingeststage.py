@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0009_ingestwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('RUNNING', 'Выполняется'), ('DONE', 'Завершен'), ('FAILED', 'Ошибка')], default='RUNNING', max_length=20)),
+                ('options', models.JSONField(default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_runs', to='analytics.productversion')),
+            ],
+            options={
+                'ordering': ['-started_at', '-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='IngestStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('RUNNING', 'Выполняется'), ('DONE', 'Завершена'), ('FAILED', 'Ошибка'), ('SKIPPED', 'Пропущена')], default='RUNNING', max_length=20)),
+                ('error', models.TextField(blank=True, default='')),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_sec', models.FloatField(blank=True, null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='analytics.ingestrun')),
+            ],
+            options={
+                'ordering': ['id'],
+                'unique_together': {('run', 'name')},
+            },
+        ),
+    ]
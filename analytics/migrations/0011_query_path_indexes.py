@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:27
+
+from django.db import migrations, models
+
+# Только PostgreSQL: составные индексы из Meta пересоздаются покрывающими (INCLUDE -
+# index-only scan для путей и агрегатов длительности/отказов), плюс индексы под разбивки
+# дашборда и BRIN по времени хитов. Имена индексов из Meta сохраняются.
+POSTGRES_INDEXES = [
+    ('pagehit_session_ts_idx', 'analytics_pagehit', '(session_id, "timestamp") INCLUDE (url)'),
+    ('visit_version_start_idx', 'analytics_visitsession', '(version_id, start_time) INCLUDE (duration_sec, bounced)'),
+    ('visit_version_device_idx', 'analytics_visitsession',
+     '(version_id, device_category) INCLUDE (duration_sec, bounced)'),
+    ('visit_version_browser_idx', 'analytics_visitsession', '(version_id, browser) INCLUDE (duration_sec, bounced)'),
+    ('pagehit_timestamp_brin', 'analytics_pagehit', 'USING brin ("timestamp")'),
+]
+META_INDEXES = {'pagehit_session_ts_idx': '(session_id, "timestamp")', 'visit_version_start_idx': '(version_id, start_time)'}
+
+
+def create_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, definition in POSTGRES_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+        schema_editor.execute(f'CREATE INDEX {name} ON {table} {definition}')
+
+
+def drop_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, _ in POSTGRES_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+        if name in META_INDEXES:
+            schema_editor.execute(f'CREATE INDEX {name} ON {table} {META_INDEXES[name]}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0010_ingestrun_ingeststage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pagehit',
+            index=models.Index(fields=['session', 'timestamp'], name='pagehit_session_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visitsession',
+            index=models.Index(fields=['version', 'client_id'], name='visit_version_client_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visitsession',
+            index=models.Index(fields=['version', 'start_time'], name='visit_version_start_idx'),
+        ),
+        migrations.RunPython(create_postgres_indexes, drop_postgres_indexes),
+    ]
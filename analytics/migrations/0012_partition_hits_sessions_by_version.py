@@ -0,0 +1,142 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_hit_version(apps, schema_editor):
+    # version_id хита = version_id его сессии, одним UPDATE
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == 'postgresql':
+            cursor.execute(
+                "UPDATE analytics_pagehit ph SET version_id = vs.version_id "
+                "FROM analytics_visitsession vs WHERE vs.id = ph.session_id"
+            )
+        else:
+            cursor.execute(
+                "UPDATE analytics_pagehit SET version_id = ("
+                "SELECT version_id FROM analytics_visitsession vs WHERE vs.id = analytics_pagehit.session_id)"
+            )
+
+
+# Копия DDL analytics.partitions на момент миграции: миграция не должна меняться вместе с модулем
+PARTITIONED_TABLES = ('analytics_pagehit', 'analytics_visitsession')
+PARTITION_KEY = 'version_id'
+
+
+def _table_definition(cursor, table):
+    """Ограничения (имя, тип, определение) и определения индексов, не связанных с ограничениями."""
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u', 'f', 'c') ORDER BY conname",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes i WHERE i.tablename = %s AND NOT EXISTS ("
+        "SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname AND c.conrelid = to_regclass(%s)"
+        ") ORDER BY indexname",
+        [table, table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    return constraints, indexes
+
+
+def _rebuild_table(connection, cursor, table, partitioned):
+    """
+    Пересоздает таблицу секционированной по version_id (partitioned=True) или обычной,
+    сохраняя данные, ограничения, индексы и последовательность id.
+    Секции создаются для всех версий, уже присутствующих в таблице, плюс DEFAULT.
+    """
+    qn = connection.ops.quote_name
+    old = f"{table}__old"
+    constraints, indexes = _table_definition(cursor, table)
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {qn(table)}")
+    max_id = cursor.fetchone()[0]
+
+    cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old)}")
+    partition_clause = f" PARTITION BY LIST ({PARTITION_KEY})" if partitioned else ""
+    cursor.execute(f"CREATE TABLE {qn(table)} (LIKE {qn(old)}){partition_clause}")
+    if partitioned:
+        cursor.execute(f"CREATE TABLE {qn(f'{table}_default')} PARTITION OF {qn(table)} DEFAULT")
+        cursor.execute(f"SELECT DISTINCT {PARTITION_KEY} FROM {qn(old)} ORDER BY 1")
+        for (version_id,) in cursor.fetchall():
+            cursor.execute(
+                f"CREATE TABLE {qn(f'{table}_v{version_id}')} PARTITION OF {qn(table)} "
+                f"FOR VALUES IN ({int(version_id)})"
+            )
+    cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old)}")
+    cursor.execute(f"DROP TABLE {qn(old)}")
+
+    # Identity-столбцы на секционированных таблицах появились только в PostgreSQL 17 - используем sequence
+    sequence = f"{table}_id_seq"
+    cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {qn(sequence)} OWNED BY {qn(table)}.id")
+    cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+    cursor.execute("SELECT setval(%s, %s, false)", [sequence, max_id + 1])
+
+    for name, kind, definition in constraints:
+        if kind == 'p':
+            definition = f"PRIMARY KEY (id, {PARTITION_KEY})" if partitioned else "PRIMARY KEY (id)"
+        cursor.execute(f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}")
+    for definition in indexes:
+        cursor.execute(definition)
+
+
+def partition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            _rebuild_table(connection, cursor, table, partitioned=True)
+
+
+def unpartition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            _rebuild_table(connection, cursor, table, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0011_query_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagehit',
+            name='version',
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                to='analytics.productversion',
+            ),
+        ),
+        migrations.RunPython(backfill_hit_version, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='pagehit',
+            name='version',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, related_name='+', to='analytics.productversion',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='pagehit',
+            name='session',
+            field=models.ForeignKey(
+                db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='hits',
+                to='analytics.visitsession',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='visitsession',
+            name='visit_id',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='visitsession',
+            constraint=models.UniqueConstraint(fields=('version', 'visit_id'), name='visit_version_visit_id_uniq'),
+        ),
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,183 @@
+import re
+import urllib.parse
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# На PostgreSQL pagehit_session_ts_idx покрывающий (0011): при удалении строкового url он
+# удаляется вместе со столбцом и пересоздается с INCLUDE (url_id)
+SESSION_TS_INDEX = 'pagehit_session_ts_idx'
+
+
+def _recreate_session_ts_index(schema_editor, definition):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {SESSION_TS_INDEX}')
+    schema_editor.execute(f'CREATE INDEX {SESSION_TS_INDEX} ON analytics_pagehit {definition}')
+
+
+def include_url_id(apps, schema_editor):
+    _recreate_session_ts_index(schema_editor, '(session_id, "timestamp") INCLUDE (url_id)')
+
+
+def without_include(apps, schema_editor):
+    _recreate_session_ts_index(schema_editor, '(session_id, "timestamp")')
+
+
+def include_url(apps, schema_editor):
+    _recreate_session_ts_index(schema_editor, '(session_id, "timestamp") INCLUDE (url)')
+
+
+# Канонические формы URL - копия url_intern.canonical_forms (и нормализаций из utils/funnel_discovery)
+# на момент миграции: миграция не должна меняться вместе с этими модулями
+NAME_MAX_LENGTH = 255
+NOISY_QUERY_PARAMS = ['referer', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term', 'yclid', '_openstat', 'from', 'ref']
+
+
+def _issue_url(raw_url):
+    if not isinstance(raw_url, str):
+        return ""
+    parsed = urllib.parse.urlparse(raw_url.strip())
+    netloc = parsed.netloc.lower()
+    path = (parsed.path or "/").rstrip("/") or "/"
+    query_dict = urllib.parse.parse_qs(parsed.query, keep_blank_values=False)
+    for noisy in NOISY_QUERY_PARAMS:
+        query_dict.pop(noisy, None)
+    clean_query = urllib.parse.urlencode({k: v[0] if len(v) == 1 else v for k, v in query_dict.items()}, doseq=True)
+    scheme = parsed.scheme.lower() if parsed.scheme else ("https" if netloc else "")
+    if netloc or scheme:
+        return urllib.parse.urlunparse((scheme, netloc, path, '', clean_query, ''))
+    return path + (f"?{clean_query}" if clean_query else "")
+
+
+def _discovery_url(url):
+    if not isinstance(url, str):
+        return ""
+    path = (urllib.parse.urlparse(url.strip()).path or "/").rstrip("/") or "/"
+    path = path.replace('/base/', '/bachelor/')
+    path = re.sub(r'\.(php|html|htm|aspx|jsp)$', '', path, flags=re.IGNORECASE)
+    parts = []
+    for part in (p for p in path.split('/') if p):
+        if part.isdigit() and len(part) > 3:
+            continue
+        if part.isdigit() and (part.startswith('20') or part.startswith('19')):
+            continue
+        if len(part) <= 2 and part.isalnum():
+            continue
+        parts.append(part)
+    if len(parts) > 4:
+        return '/' + '/'.join(parts[:4]) + '/'
+    return '/' + '/'.join(parts) + '/' if parts else '/'
+
+
+def _friendly_segment(url):
+    path = urllib.parse.urlparse(url).path or url
+    clean = path.strip('/')
+    if not clean:
+        return "Homepage"
+    segment = urllib.parse.unquote(clean.split('/')[-1])
+    if '.' in segment:
+        segment = segment.split('.')[0]
+    return segment.replace('-', ' ').replace('_', ' ').strip().title() or path
+
+
+def _page_name(url):
+    if not url:
+        return "Unknown page"
+    if '->' in url:
+        parts = [p.strip() for p in url.split('->') if p.strip()]
+        if not parts:
+            return "Unknown page"
+        friendly_parts = [_friendly_segment(p) for p in parts]
+        combined = " -> ".join(friendly_parts[:3])
+        if len(friendly_parts) > 3:
+            combined += " -> ..."
+        return combined
+    return _friendly_segment(url)
+
+
+def _canonical_forms(raw):
+    return {
+        'issue_url': _issue_url(raw),
+        'discovery_url': _discovery_url(raw),
+        'name': _page_name(raw)[:NAME_MAX_LENGTH],
+    }
+
+
+def fill_urls(apps, schema_editor):
+    """Справочник из уникальных URL хитов (с каноническими формами) и url_id хитов одним UPDATE."""
+    Url = apps.get_model('analytics', 'Url')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT url_raw FROM analytics_pagehit")
+        raws = [row[0] for row in cursor.fetchall()]
+    Url.objects.bulk_create([Url(raw=raw, **_canonical_forms(raw)) for raw in raws], batch_size=1000)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "UPDATE analytics_pagehit ph SET url_id = u.id FROM analytics_url u WHERE u.raw = ph.url_raw"
+            )
+            # Отложенные проверки FK - сейчас, иначе следующий ALTER TABLE упадет на pending trigger events
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        else:
+            cursor.execute(
+                "UPDATE analytics_pagehit SET url_id = ("
+                "SELECT id FROM analytics_url u WHERE u.raw = analytics_pagehit.url_raw)"
+            )
+
+
+def restore_url_strings(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("UPDATE analytics_pagehit ph SET url_raw = u.raw FROM analytics_url u WHERE u.id = ph.url_id")
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        else:
+            cursor.execute(
+                "UPDATE analytics_pagehit SET url_raw = ("
+                "SELECT raw FROM analytics_url u WHERE u.id = analytics_pagehit.url_id)"
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0012_partition_hits_sessions_by_version'),
+    ]
+
+    operations = [
+        # При откате выполняется последней: возвращает индекс 0011 с INCLUDE (url)
+        migrations.RunPython(migrations.RunPython.noop, include_url),
+        migrations.CreateModel(
+            name='Url',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('raw', models.CharField(max_length=500, unique=True)),
+                ('issue_url', models.TextField()),
+                ('discovery_url', models.TextField()),
+                ('name', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.RenameField(model_name='pagehit', old_name='url', new_name='url_raw'),
+        migrations.AddField(
+            model_name='pagehit',
+            name='url',
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.PROTECT, related_name='hits', to='analytics.url',
+            ),
+        ),
+        # При откате строковый столбец возвращается пустым, заполняется из справочника и снова становится NOT NULL
+        migrations.AlterField(
+            model_name='pagehit', name='url_raw', field=models.URLField(max_length=500, null=True),
+        ),
+        migrations.RunPython(fill_urls, restore_url_strings),
+        migrations.RemoveField(model_name='pagehit', name='url_raw'),
+        migrations.AlterField(
+            model_name='pagehit',
+            name='url',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT, related_name='hits', to='analytics.url',
+            ),
+        ),
+        migrations.RunPython(include_url_id, without_include),
+    ]
@@ -0,0 +1,101 @@
+from django.db import migrations, models
+
+# Строки, которые CAST к bigint примет как есть (все остальное нормализуется в Python)
+PLAIN_INT_RE = r'^-?[0-9]{1,18}$'
+
+# Копия строковой ветки ingest_utils.normalize_client_ids на момент миграции:
+# миграция не должна меняться вместе с модулем
+_INT64_MAX = 2 ** 63 - 1
+_UINT64_SPAN = 2 ** 64
+_DIGITS_RE = r'^-?\d+$'
+
+
+def _floats_to_keys(nums):
+    """float64 -> Int64 (округление), NaN/inf/переполнение -> NA; [2^63, 2^64) - битовый образ uint64."""
+    import numpy as np
+    import pandas as pd
+
+    ok = np.isfinite(nums) & (nums >= -2.0 ** 63) & (nums < 2.0 ** 64)
+    out = np.zeros(len(nums), dtype=np.int64)
+    rounded = np.round(nums[ok])
+    high = rounded >= 2.0 ** 63
+    values = np.empty(len(rounded), dtype=np.int64)
+    values[~high] = rounded[~high].astype(np.int64)
+    values[high] = rounded[high].astype(np.uint64).view(np.int64)
+    out[ok] = values
+    return pd.arrays.IntegerArray(out, ~ok)
+
+
+def _client_keys(values):
+    """Строковые идентификаторы -> int64-ключи (Int64, NA - не число)."""
+    import numpy as np
+    import pandas as pd
+
+    text = values.astype('string').str.strip().str.replace(r'\.0+$', '', regex=True)
+    digits = text.str.match(_DIGITS_RE).fillna(False).to_numpy(dtype=bool)
+    result = pd.Series(pd.NA, index=values.index, dtype='Int64')
+    if digits.any():
+        exact = [int(v) for v in text[digits].tolist()]
+        exact = [
+            v if -_INT64_MAX <= v <= _INT64_MAX else v - _UINT64_SPAN if _INT64_MAX < v < _UINT64_SPAN else None
+            for v in exact
+        ]
+        result[digits] = pd.array(exact, dtype='Int64')
+    rest = ~digits & text.notna().to_numpy()
+    if rest.any():
+        nums = pd.to_numeric(text[rest], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        result[rest] = _floats_to_keys(nums)
+    return result
+
+
+def normalize_text_ids(apps, schema_editor):
+    """
+    visit_id/client_id хранились строками; перед сменой типа редкие нестандартные значения
+    ("123.0", 19-20 цифр uint64, пустые) приводятся к тем же int64-ключам, что дает ingest.
+    """
+    import pandas as pd
+
+    VisitSession = apps.get_model('analytics', 'VisitSession')
+    for field in ('visit_id', 'client_id'):
+        odd = list(VisitSession.objects.exclude(**{f'{field}__regex': PLAIN_INT_RE}).values_list('id', field))
+        if not odd:
+            continue
+        keys = _client_keys(pd.Series([raw for _, raw in odd], dtype=object)).fillna(0)
+        for (pk, _), key in zip(odd, keys.tolist()):
+            VisitSession.objects.filter(id=pk).update(**{field: str(key)})
+
+
+def member_ids_to_int(apps, schema_editor):
+    UserCohort = apps.get_model('analytics', 'UserCohort')
+    for cohort in UserCohort.objects.exclude(member_client_ids=[]):
+        cohort.member_client_ids = [int(cid) for cid in cohort.member_client_ids or []]
+        cohort.save(update_fields=['member_client_ids'])
+
+
+def member_ids_to_str(apps, schema_editor):
+    UserCohort = apps.get_model('analytics', 'UserCohort')
+    for cohort in UserCohort.objects.exclude(member_client_ids=[]):
+        cohort.member_client_ids = [str(cid) for cid in cohort.member_client_ids or []]
+        cohort.save(update_fields=['member_client_ids'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0013_url_dimension'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_text_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='visitsession',
+            name='visit_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='visitsession',
+            name='client_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.RunPython(member_ids_to_int, member_ids_to_str),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_session_goals(apps, schema_editor):
+    # Цели уже загруженных сессий - одним INSERT ... SELECT из goals_id
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "INSERT INTO analytics_sessiongoal (session_id, version_id, goal_id) "
+                "SELECT DISTINCT vs.id, vs.version_id, g.value::bigint FROM analytics_visitsession vs "
+                "CROSS JOIN LATERAL jsonb_array_elements_text("
+                "CASE WHEN jsonb_typeof(vs.goals_id) = 'array' THEN vs.goals_id ELSE '[]'::jsonb END"
+                ") AS g(value) ON CONFLICT DO NOTHING"
+            )
+        else:
+            cursor.execute(
+                "INSERT OR IGNORE INTO analytics_sessiongoal (session_id, version_id, goal_id) "
+                "SELECT vs.id, vs.version_id, CAST(g.value AS INTEGER) FROM analytics_visitsession vs, json_each(vs.goals_id) g "
+                "WHERE json_type(vs.goals_id) = 'array'"
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0014_integer_client_visit_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionGoal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('goal_id', models.BigIntegerField()),
+                ('session', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='goals', to='analytics.visitsession')),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='analytics.productversion')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['version', 'goal_id', 'session'], name='sessiongoal_version_goal_idx')],
+                'constraints': [models.UniqueConstraint(fields=('session', 'goal_id'), name='sessiongoal_session_goal_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_session_goals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,100 @@
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+AGENT_COLUMNS = ('browser', 'os', 'screen_width', 'screen_height', 'device_category')
+INT_COLUMNS = ('screen_width', 'screen_height')
+
+
+def _same(column: str) -> str:
+    # Равенство с учетом NULL через COALESCE (в отличие от IS NOT DISTINCT FROM позволяет hash join)
+    missing = '-1' if column in INT_COLUMNS else 'chr(1)'
+    return f"COALESCE(a.{column}, {missing}) = COALESCE(ph.{column}, {missing})"
+
+
+def agent_key(values):
+    # Копия agent_intern.agent_key на момент миграции: JSON-список значений в порядке AGENT_COLUMNS
+    return json.dumps(list(values), ensure_ascii=False)
+
+
+def fill_agents(apps, schema_editor):
+    """Справочник из уникальных наборов полей хитов и agent_id хитов одним UPDATE."""
+    Agent = apps.get_model('analytics', 'Agent')
+    connection = schema_editor.connection
+    columns = ', '.join(AGENT_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT DISTINCT {columns} FROM analytics_pagehit")
+        agents = cursor.fetchall()
+    Agent.objects.bulk_create(
+        [Agent(key=agent_key(agent), **dict(zip(AGENT_COLUMNS, agent))) for agent in agents], batch_size=1000,
+    )
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            match = ' AND '.join(_same(column) for column in AGENT_COLUMNS)
+            cursor.execute(f"UPDATE analytics_pagehit ph SET agent_id = a.id FROM analytics_agent a WHERE {match}")
+            # Отложенные проверки FK - сейчас, иначе следующий ALTER TABLE упадет на pending trigger events
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        else:
+            match = ' AND '.join(f"a.{column} IS analytics_pagehit.{column}" for column in AGENT_COLUMNS)
+            cursor.execute(f"UPDATE analytics_pagehit SET agent_id = (SELECT id FROM analytics_agent a WHERE {match})")
+
+
+def restore_agent_fields(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            assignments = ', '.join(f"{column} = a.{column}" for column in AGENT_COLUMNS)
+            cursor.execute(
+                f"UPDATE analytics_pagehit ph SET {assignments} FROM analytics_agent a WHERE a.id = ph.agent_id"
+            )
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        else:
+            columns = ', '.join(AGENT_COLUMNS)
+            cursor.execute(
+                f"UPDATE analytics_pagehit SET ({columns}) = ("
+                f"SELECT {columns} FROM analytics_agent a WHERE a.id = analytics_pagehit.agent_id)"
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0015_session_goals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Agent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=500, unique=True)),
+                ('browser', models.CharField(max_length=100, null=True)),
+                ('os', models.CharField(max_length=100, null=True)),
+                ('screen_width', models.IntegerField(null=True)),
+                ('screen_height', models.IntegerField(null=True)),
+                ('device_category', models.CharField(max_length=50, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pagehit',
+            name='agent',
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.PROTECT, related_name='hits', to='analytics.agent',
+            ),
+        ),
+        # При откате колонки хитов возвращаются пустыми (все nullable) и заполняются из справочника
+        migrations.RunPython(fill_agents, restore_agent_fields),
+        migrations.RemoveField(model_name='pagehit', name='browser'),
+        migrations.RemoveField(model_name='pagehit', name='os'),
+        migrations.RemoveField(model_name='pagehit', name='screen_width'),
+        migrations.RemoveField(model_name='pagehit', name='screen_height'),
+        migrations.RemoveField(model_name='pagehit', name='device_category'),
+        migrations.AlterField(
+            model_name='pagehit',
+            name='agent',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT, related_name='hits', to='analytics.agent',
+            ),
+        ),
+    ]
@@ -12,8 +12,9 @@ class ProductVersion(models.Model):
 class VisitSession(models.Model):
     """Сессия пользователя (Visit)"""
     version = models.ForeignKey(ProductVersion, on_delete=models.CASCADE)
-    visit_id = models.CharField(max_length=100, unique=True) # ID из метрики
-    client_id = models.CharField(max_length=100)
+    # ID из метрики - int64-ключи normalize_client_ids (uint64 выше 2^63 - 1 хранятся с тем же битовым образом)
+    visit_id = models.BigIntegerField() # уникален в пределах версии
+    client_id = models.BigIntegerField()
     start_time = models.DateTimeField()
     duration_sec = models.IntegerField(default=0)
     device_category = models.CharField(max_length=50) # mobile/desktop
@@ -39,11 +40,55 @@ class VisitSession(models.Model):
     # Список ID целей Yandex Metrica, например: [39566071, 53631805]
     goals_id = models.JSONField(default=list, null=True, blank=True, help_text="Список ID целей, достигнутых в этой сессии")
 
+    class Meta:
+        # Воронки/когорты фильтруют по (версия, client_id), графики по дням - по (версия, start_time).
+        # На PostgreSQL миграция 0011 дополнительно делает покрывающие индексы (INCLUDE)
+        indexes = [
+            models.Index(fields=['version', 'client_id'], name='visit_version_client_idx'),
+            models.Index(fields=['version', 'start_time'], name='visit_version_start_idx'),
+        ]
+        # На PostgreSQL таблица секционирована по version_id - уникальность должна включать ключ секции
+        constraints = [
+            models.UniqueConstraint(fields=['version', 'visit_id'], name='visit_version_visit_id_uniq'),
+        ]
+
+class Url(models.Model):
+    """
+    Справочник URL хитов: каждая строка адреса хранится один раз, хиты ссылаются на нее по id.
+    Канонические формы считаются при добавлении URL (см. url_intern.py), а не в каждом детекторе/представлении.
+    """
+    raw = models.CharField(max_length=500, unique=True)  # исходный ym:pv:URL
+    issue_url = models.TextField()  # normalize_issue_url: без utm/referer и trailing slash (проблемы, пути, воронки)
+    discovery_url = models.TextField()  # normalize_url_for_discovery: только путь без ID/дат (поиск воронок)
+    name = models.CharField(max_length=255)  # get_readable_page_name
+
+    def __str__(self):
+        return self.raw
+
+class Agent(models.Model):
+    """
+    Справочник окружения хитов: браузер, ОС, экран и тип устройства одной строкой.
+    Хиты ссылаются на набор по id вместо пяти повторяющихся колонок (см. agent_intern.py).
+    """
+    key = models.CharField(max_length=500, unique=True)  # agent_key(): JSON-список значений полей (NULL -> null)
+    browser = models.CharField(max_length=100, null=True)  # из ym:pv:browser
+    os = models.CharField(max_length=100, null=True)  # из ym:pv:operatingSystem
+    screen_width = models.IntegerField(null=True)  # из ym:pv:screenWidth
+    screen_height = models.IntegerField(null=True)  # из ym:pv:screenHeight
+    device_category = models.CharField(max_length=50, null=True)  # из ym:pv:deviceCategory
+
+    def __str__(self):
+        return self.key
+
 class PageHit(models.Model):
     """Действие внутри сессии (Hit)"""
-    session = models.ForeignKey(VisitSession, related_name='hits', on_delete=models.CASCADE)
+    # Без FK-ограничения в БД: на PostgreSQL сессии секционированы, и id сессии уникален
+    # только вместе с version_id (каскадное удаление по-прежнему делает Django)
+    session = models.ForeignKey(VisitSession, related_name='hits', on_delete=models.CASCADE, db_constraint=False)
+    # Денормализованная версия сессии: фильтр без JOIN и ключ секционирования на PostgreSQL
+    version = models.ForeignKey(ProductVersion, on_delete=models.CASCADE, related_name='+')
     timestamp = models.DateTimeField()
-    url = models.URLField(max_length=500)
+    url = models.ForeignKey(Url, on_delete=models.PROTECT, related_name='hits')
     page_title = models.CharField(max_length=255, null=True)
     action_type = models.CharField(max_length=50, default='view') # view, click, scroll
     
@@ -56,11 +101,33 @@ class PageHit(models.Model):
     scroll_depth = models.IntegerField(null=True)  # из ym:pv:params если доступно (31%)
     referrer_url = models.CharField(max_length=500, null=True)  # из ym:pv:referer (58%)
     is_exit = models.BooleanField(default=False)  # рассчитывается (последний hit в сессии)
-    browser = models.CharField(max_length=100, null=True)  # из ym:pv:browser (99.9%)
-    os = models.CharField(max_length=100, null=True)  # из ym:pv:operatingSystem (99.9%)
-    screen_width = models.IntegerField(null=True)  # из ym:pv:screenWidth (100%)
-    screen_height = models.IntegerField(null=True)  # из ym:pv:screenHeight (100%)
-    device_category = models.CharField(max_length=50, null=True)  # из ym:pv:deviceCategory (100%)
+    # browser/os/screen_width/screen_height/device_category хита - в справочнике Agent
+    agent = models.ForeignKey(Agent, on_delete=models.PROTECT, related_name='hits')
+
+    class Meta:
+        # Пути и воронки читают хиты сессий по порядку времени (session_id, timestamp) и берут url_id
+        indexes = [
+            models.Index(fields=['session', 'timestamp'], name='pagehit_session_ts_idx'),
+        ]
+
+class SessionGoal(models.Model):
+    """
+    Достигнутая в сессии цель: строка на пару (сессия, goal_id) из VisitSession.goals_id.
+    Заполняется при загрузке (session_goals.py); "сессии/клиенты с целью X" - поиск по индексу,
+    а не разбор JSON-списка каждой сессии.
+    """
+    # Без FK-ограничения в БД по той же причине, что у PageHit.session (секционированные сессии)
+    session = models.ForeignKey(VisitSession, related_name='goals', on_delete=models.CASCADE, db_constraint=False)
+    version = models.ForeignKey(ProductVersion, on_delete=models.CASCADE, related_name='+')
+    goal_id = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['version', 'goal_id', 'session'], name='sessiongoal_version_goal_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'goal_id'], name='sessiongoal_session_goal_uniq'),
+        ]
 
 class UXIssue(models.Model):
     """Обнаруженная проблема (Результат работы алгоритмов)"""
@@ -108,6 +175,66 @@ class UXIssue(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class IngestWatermark(models.Model):
+    """Отметка загрузки версии: до какого момента данные уже в БД и какие файлы загружены (для --append)"""
+    version = models.OneToOneField(ProductVersion, on_delete=models.CASCADE, related_name='watermark')
+    max_visit_time = models.DateTimeField(null=True, blank=True)  # max ym:s:dateTime в БД
+    max_hit_time = models.DateTimeField(null=True, blank=True)  # max ym:pv:dateTime в БД
+    # [{path, size, mtime}] - уже загруженные файлы/партиции
+    ingested_files = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.version.name}: visits <= {self.max_visit_time}, hits <= {self.max_hit_time}"
+
+
+class IngestRun(models.Model):
+    """Запуск ingest_data для версии: статус и время, стадии - в IngestStage (для --resume)"""
+    STATUS_CHOICES = [
+        ('RUNNING', 'Выполняется'),
+        ('DONE', 'Завершен'),
+        ('FAILED', 'Ошибка'),
+    ]
+
+    version = models.ForeignKey(ProductVersion, on_delete=models.CASCADE, related_name='ingest_runs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='RUNNING')
+    options = models.JSONField(default=dict)  # аргументы команды (пути, режимы)
+    error = models.TextField(blank=True, default='')
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-started_at', '-id']
+
+    def __str__(self):
+        return f"{self.version.name} run #{self.id} ({self.status})"
+
+
+class IngestStage(models.Model):
+    """Стадия запуска ingest_data (load, time_on_page, analysis...) со статусом и длительностью"""
+    STATUS_CHOICES = [
+        ('RUNNING', 'Выполняется'),
+        ('DONE', 'Завершена'),
+        ('FAILED', 'Ошибка'),
+        ('SKIPPED', 'Пропущена'),
+    ]
+
+    run = models.ForeignKey(IngestRun, on_delete=models.CASCADE, related_name='stages')
+    name = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='RUNNING')
+    error = models.TextField(blank=True, default='')
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_sec = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('run', 'name')
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.name}: {self.status}"
+
+
 class IssueLifecycle(models.Model):
     """Отслеживание появления/исчезновения проблемы между версиями"""
     STATUS_CHOICES = [
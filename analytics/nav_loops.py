@@ -0,0 +1,83 @@
+"""
+Навигационные петли NAVIGATION_BACK: A -> B -> A и A -> B -> C -> A в хитах клиента.
+Считается векторно по общему кадру хитов (hit_frame.py), где нормализованные URL уже
+закодированы целыми числами в порядке строк: петли ищутся сдвигами массива кодов внутри границ клиента,
+канонический ключ петли - набор целых (пара вершин для двувершинных петель), а число
+повторений и пользователей - один groupby по ключам.
+"""
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Сколько самых частых петель возвращать
+TOP_LOOPS = 5
+
+
+def _window_events(codes: np.ndarray, clients: np.ndarray, empty: int, window: int) -> pd.DataFrame:
+    """
+    Петли длины window (2: A-B-A, 3: A-B-C-A), заканчивающиеся на хитах [window:].
+    Ключ - (k0, k1, k2, k3): пара вершин (меньшая, большая, -1, -1) для двувершинных петель
+    или сама последовательность для трехвершинных.
+    """
+    end = np.arange(window, len(codes))
+    first = codes[:-window]
+    last = codes[window:]
+    mask = (clients[:-window] == clients[window:]) & (clients[window:] >= 0) & (first == last) & (first != empty)
+    if window == 2:
+        middle = codes[1:-1]
+        mask &= middle != first
+        first, middle, end = first[mask], middle[mask], end[mask]
+        keys = (np.minimum(first, middle), np.maximum(first, middle), np.full(len(first), -1), np.full(len(first), -1))
+    else:
+        second, third = codes[1:-2], codes[2:-1]
+        mask &= ~((second == first) & (third == first))
+        first, second, third, end = first[mask], second[mask], third[mask], end[mask]
+        three_nodes = (second != first) & (third != first) & (second != third)
+        other = np.where(second != first, second, third)
+        keys = (
+            np.where(three_nodes, first, np.minimum(first, other)),
+            np.where(three_nodes, second, np.maximum(first, other)),
+            np.where(three_nodes, third, -1),
+            np.where(three_nodes, first, -1),
+        )
+    return pd.DataFrame({
+        'k0': keys[0], 'k1': keys[1], 'k2': keys[2], 'k3': keys[3],
+        'client': clients[end],
+    })
+
+
+def find_navigation_loops(hits: pd.DataFrame, top: int = TOP_LOOPS) -> List[Tuple[tuple, str, int, int]]:
+    """
+    Самые частые петли в кадре build_hit_frame:
+    [(ключ - кортеж URL, отображение "A -> B -> A", повторений, пользователей)].
+    При равном числе повторений петли идут по URL (коды категорий - в порядке строк),
+    а не по порядку встречи, который зависит от сортировки клиентов.
+    """
+    if len(hits) < 3:
+        return []
+    codes = hits['norm_url'].cat.codes.to_numpy(dtype=np.int64)
+    uniques = np.asarray(hits['norm_url'].cat.categories, dtype=object)
+    empty_matches = np.flatnonzero(uniques == "")
+    empty = int(empty_matches[0]) if len(empty_matches) else -1
+    clients = hits['client'].to_numpy()
+
+    events = pd.concat([_window_events(codes, clients, empty, window) for window in (2, 3)], ignore_index=True)
+    if events.empty:
+        return []
+    stats = events.groupby(['k0', 'k1', 'k2', 'k3']).agg(count=('client', 'size'), users=('client', 'nunique'))
+    stats = stats.sort_values('count', ascending=False, kind='stable').head(top)
+
+    loops = []
+    for (k0, k1, k2, k3), row in stats.iterrows():
+        if k2 < 0:
+            a, b = uniques[k0], uniques[k1]
+            key, display = (a, b), f"{a} -> {b} -> {a}"
+        else:
+            key = tuple(uniques[code] for code in (k0, k1, k2, k3))
+            display = " -> ".join(key)
+        loops.append((key, display, int(row['count']), int(row['users'])))
+    return loops
+
+
+__all__ = ['TOP_LOOPS', 'find_navigation_loops']
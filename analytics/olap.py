@@ -0,0 +1,186 @@
+"""
+Аналитический движок для агрегатов дашборда, сравнения версий, PageMetrics и воронок.
+При ANALYTICS_ENGINE='duckdb' GROUP BY выполняет встроенный DuckDB (в процессе, без сервиса)
+по колоночному снимку версии (hit_snapshot.py): таблицы Arrow из memory map сканируются
+без копирования, строки через ORM не выбираются. Если движок выключен, пакет duckdb
+не установлен или у версии нет снимка, функции возвращают None - вызывающий код
+считает то же самое через ORM.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+import pyarrow as pa
+from django.conf import settings
+
+from analytics.hit_snapshot import read_hits, read_sessions
+from analytics.models import Agent
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Разрезы визитов (колонки sessions снимка), по которым строятся сравнения и дашборд
+SPLIT_FIELDS = ('device_category', 'browser', 'os')
+# Шаги воронки кодируются битами BIGINT-маски сессии
+MAX_FUNNEL_STEPS = 62
+
+
+def enabled() -> bool:
+    return duckdb is not None and getattr(settings, 'ANALYTICS_ENGINE', 'orm') == 'duckdb'
+
+
+def _query(version_id: int, sql: str, params: Optional[list] = None, **tables: pa.Table) -> Optional[List[Dict[str, Any]]]:
+    """
+    Выполняет sql над таблицами снимка версии (hits, sessions) и дополнительными tables.
+    Возвращает строки словарями или None, если DuckDB недоступен или снимка нет.
+    """
+    if not enabled():
+        return None
+    hits, sessions = read_hits(version_id), read_sessions(version_id)
+    if hits is None or sessions is None:
+        return None
+    con = duckdb.connect()
+    try:
+        for name, table in {'hits': hits, 'sessions': sessions, **tables}.items():
+            con.register(name, table)
+        cursor = con.execute(sql, params or [])
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+    finally:
+        con.close()
+
+
+def visit_stats(version) -> Optional[Dict[str, Any]]:
+    """{'visits', 'bounce' (доля 0..1), 'bounce_count', 'duration'} по визитам версии."""
+    rows = _query(version.id, """
+        SELECT count(*) AS visits, avg(bounced::INTEGER) AS bounce,
+               count(*) FILTER (WHERE bounced) AS bounce_count, avg(duration_sec) AS duration
+        FROM sessions
+    """)
+    return rows[0] if rows is not None else None
+
+
+def visit_split(version, field: str, limit: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    """Разрез визитов по field (SPLIT_FIELDS): {field, 'visits', 'bounce', 'duration'}, по убыванию visits."""
+    if field not in SPLIT_FIELDS:
+        raise ValueError(f"Unknown split field: {field}")
+    return _query(version.id, f"""
+        SELECT {field}, count(*) AS visits, avg(bounced::INTEGER) AS bounce, avg(duration_sec) AS duration
+        FROM sessions
+        GROUP BY {field}
+        ORDER BY visits DESC, {field} NULLS LAST
+        {f'LIMIT {int(limit)}' if limit else ''}
+    """)
+
+
+def page_stats(version, url_ids: Optional[Iterable[int]] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Агрегаты PageMetrics по url_id (как в calculate_page_metrics): total_views, unique_visitors,
+    avg_time, exit_count, avg_scroll, dominant_device и page_title (самые частые непустые
+    значения, при равенстве - меньшее). url_ids - только эти страницы.
+    """
+    if not enabled():
+        return None
+    # Справочник окружений мал (сотни строк) - тип устройства хита берется join'ом в DuckDB
+    agents = list(Agent.objects.values_list('id', 'device_category'))
+    tables = {'agents': pa.table({
+        'id': pa.array([agent_id for agent_id, _ in agents], type=pa.int64()),
+        'device_category': pa.array([device for _, device in agents], type=pa.string()),
+    })}
+    scope = "hits"
+    if url_ids is not None:
+        tables['wanted'] = pa.table({'url_id': pa.array(list(url_ids), type=pa.int64())})
+        scope = "(SELECT * FROM hits WHERE url_id IN (SELECT url_id FROM wanted))"
+    return _query(version.id, f"""
+        WITH scope AS (SELECT * FROM {scope}),
+        stats AS (
+            SELECT url_id, count(*) AS total_views, count(DISTINCT client_id) AS unique_visitors,
+                   avg(time_on_page) AS avg_time, count(*) FILTER (WHERE is_exit) AS exit_count,
+                   avg(scroll_depth) AS avg_scroll
+            FROM scope GROUP BY url_id
+        ),
+        devices AS (
+            SELECT url_id, first(value ORDER BY n DESC, value) AS value FROM (
+                SELECT h.url_id, a.device_category AS value, count(*) AS n
+                FROM scope h JOIN agents a ON a.id = h.agent_id
+                WHERE a.device_category <> '' GROUP BY ALL
+            ) GROUP BY url_id
+        ),
+        titles AS (
+            SELECT url_id, first(value ORDER BY n DESC, value) AS value FROM (
+                SELECT url_id, page_title::VARCHAR AS value, count(*) AS n
+                FROM scope WHERE page_title <> '' GROUP BY ALL
+            ) GROUP BY url_id
+        )
+        SELECT stats.*, devices.value AS dominant_device, titles.value AS page_title
+        FROM stats LEFT JOIN devices USING (url_id) LEFT JOIN titles USING (url_id)
+    """, **tables)
+
+
+def entry_bounces(version, pages: Optional[Iterable[str]] = None) -> Optional[Dict[str, Dict[str, int]]]:
+    """{entry_page: {'sessions', 'bounces'}} - сессии, начавшиеся на странице (pages - только эти)."""
+    tables, where = {}, ""
+    if pages is not None:
+        tables['wanted'] = pa.table({'entry_page': pa.array(list(pages), type=pa.string())})
+        where = "WHERE entry_page::VARCHAR IN (SELECT entry_page FROM wanted)"
+    rows = _query(version.id, f"""
+        SELECT entry_page::VARCHAR AS entry_page, count(*) AS sessions, count(*) FILTER (WHERE bounced) AS bounces
+        FROM sessions {where} GROUP BY 1
+    """, **tables)
+    return {row['entry_page']: row for row in rows} if rows is not None else None
+
+
+def funnel_counts(
+    version,
+    step_url_ids: List[List[int]],
+    step_goal_ids: List[Optional[int]],
+    require_sequence: bool,
+    client_ids: Optional[Iterable[int]] = None,
+) -> Optional[List[int]]:
+    """
+    Число клиентов, достигших каждого шага воронки (как calculate_funnel_metrics).
+    Шаг засчитан в сессии, если в ней есть хит на URL из step_url_ids[k] или цель step_goal_ids[k];
+    для последовательной воронки шаг k требует в той же сессии и все предыдущие шаги.
+    """
+    if len(step_url_ids) > MAX_FUNNEL_STEPS:
+        return None
+    url_steps = [(step, url_id) for step, url_ids in enumerate(step_url_ids) for url_id in url_ids]
+    goal_steps = [(step, goal_id) for step, goal_id in enumerate(step_goal_ids) if goal_id]
+    tables = {
+        'step_urls': pa.table({
+            'step': pa.array([step for step, _ in url_steps], type=pa.int32()),
+            'url_id': pa.array([url_id for _, url_id in url_steps], type=pa.int64()),
+        }),
+        'step_goals': pa.table({
+            'step': pa.array([step for step, _ in goal_steps], type=pa.int32()),
+            'goal_id': pa.array([int(goal_id) for _, goal_id in goal_steps], type=pa.int64()),
+        }),
+    }
+    where = ""
+    if client_ids is not None:
+        tables['wanted'] = pa.table({'client_id': pa.array(sorted({int(cid) for cid in client_ids}), type=pa.int64())})
+        where = "WHERE s.client_id IN (SELECT client_id FROM wanted)"
+
+    reached = []
+    for step in range(len(step_url_ids)):
+        mask = (1 << (step + 1)) - 1 if require_sequence else 1 << step
+        condition = f"m.mask & {mask} = {mask}" if require_sequence else f"m.mask & {mask} <> 0"
+        reached.append(f"count(DISTINCT s.client_id) FILTER (WHERE {condition}) AS step_{step}")
+    rows = _query(version.id, f"""
+        WITH reached AS (
+            SELECT DISTINCT h.session_id, su.step FROM hits h JOIN step_urls su USING (url_id)
+            UNION
+            SELECT g.session_id, sg.step
+            FROM (SELECT session_id, unnest(goals) AS goal_id FROM sessions) g JOIN step_goals sg USING (goal_id)
+        ),
+        masks AS (SELECT session_id, bit_or(1::BIGINT << step) AS mask FROM reached GROUP BY session_id)
+        SELECT {', '.join(reached)}
+        FROM masks m JOIN sessions s USING (session_id) {where}
+    """, **tables)
+    return [rows[0][f'step_{step}'] for step in range(len(step_url_ids))] if rows is not None else None
+
+
+__all__ = [
+    'SPLIT_FIELDS', 'MAX_FUNNEL_STEPS', 'enabled', 'visit_stats', 'visit_split', 'page_stats', 'entry_bounces',
+    'funnel_counts',
+]
@@ -0,0 +1,72 @@
+"""
+PageMetrics версии в памяти: один запрос на версию вместо filter(url=...).first() на каждую проблему.
+Страницы ищутся по сырому URL (PageMetrics.url) и по канонической форме normalize_issue_url,
+которую для известных адресов дает справочник Url (Url.issue_url), без повторной нормализации.
+Строки анализа - словари (индекс передается в процессы пула детекторов без Django),
+для сравнения версий - объекты модели. Модели импортируются только в load.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from analytics.utils import normalize_issue_url
+
+# Поля PageMetrics, которые читают детекторы и контекст AI
+PAGE_METRIC_COLUMNS = (
+    'id', 'url', 'page_title', 'total_views', 'exit_rate', 'avg_time_on_page', 'avg_scroll_depth',
+    'dominant_cohort', 'dominant_device',
+)
+
+
+class PageMetricsIndex:
+    """
+    rows - строки PageMetrics в порядке id, urls и canonical_urls - их сырые и канонические URL.
+    При совпадении канонических форм остается последняя страница.
+    """
+
+    def __init__(self, rows: list, urls: List[str], canonical_urls: Iterable[str]):
+        self.rows = rows
+        self.by_url: Dict[str, object] = dict(zip(urls, rows))
+        self.by_canonical: Dict[str, object] = {
+            canonical: row for canonical, row in zip(canonical_urls, rows) if canonical
+        }
+
+    @classmethod
+    def load(cls, version, models: bool = False) -> 'PageMetricsIndex':
+        """Все PageMetrics версии: словари PAGE_METRIC_COLUMNS или (models=True) объекты модели."""
+        import pandas as pd
+        from analytics.models import PageMetrics
+        from analytics.url_intern import issue_urls
+
+        queryset = PageMetrics.objects.filter(version=version).order_by('id')
+        if models:
+            rows = list(queryset)
+            urls = [row.url for row in rows]
+        else:
+            rows = list(queryset.values(*PAGE_METRIC_COLUMNS))
+            urls = [row['url'] for row in rows]
+        return cls(rows, urls, issue_urls(pd.Series(urls, dtype=object)).tolist())
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, url: str):
+        """Страница с точно таким URL или None."""
+        return self.by_url.get(url)
+
+    def canonical(self, url: str):
+        """Страница с той же канонической формой, что у url, или None."""
+        return self.by_canonical.get(normalize_issue_url(url))
+
+    def find(self, urls: Iterable[str]) -> Optional[object]:
+        """Первая страница с точным URL из urls; если таких нет - первая по канонической форме."""
+        urls = list(urls)
+        for url in urls:
+            if url in self.by_url:
+                return self.by_url[url]
+        for url in urls:
+            row = self.canonical(url)
+            if row is not None:
+                return row
+        return None
+
+
+__all__ = ['PAGE_METRIC_COLUMNS', 'PageMetricsIndex']
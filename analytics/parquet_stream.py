@@ -0,0 +1,151 @@
+"""
+Потоковое чтение Parquet выгрузок Метрики.
+Файл читается record batch'ами через pyarrow.parquet.ParquetFile.iter_batches,
+поэтому пиковая память определяется размером батча, а не размером файла.
+Вместо одного файла можно передать каталог с партициями или список файлов -
+тогда чтение идет через pyarrow.dataset.
+"""
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DEFAULT_BATCH_ROWS = 100_000
+
+ParquetSource = Union[str, List[str]]
+
+
+def _is_single_file(path: ParquetSource) -> bool:
+    return isinstance(path, str) and os.path.isfile(path)
+
+
+def _dataset(path: ParquetSource) -> ds.Dataset:
+    return ds.dataset(path, format='parquet')
+
+
+def schema(path: ParquetSource) -> pa.Schema:
+    """Arrow-схема файла, каталога или списка файлов."""
+    if _is_single_file(path):
+        return pq.ParquetFile(path).schema_arrow
+    return _dataset(path).schema
+
+
+def parquet_files(path: str) -> List[str]:
+    """Файл -> [файл]; каталог -> все *.parquet внутри (рекурсивно, по порядку имен)."""
+    if os.path.isdir(path):
+        found = []
+        for root, _dirs, files in os.walk(path):
+            found.extend(os.path.join(root, name) for name in files if name.endswith('.parquet'))
+        return sorted(found)
+    return [path]
+
+
+def file_signature(path: str) -> Dict:
+    """Отпечаток файла для учета уже загруженных партиций: путь, размер, mtime."""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def available_columns(path: ParquetSource, wanted: Sequence[str]) -> List[str]:
+    """Колонки из wanted, которые реально есть в схеме файла (порядок сохраняется)."""
+    names = set(schema(path).names)
+    return [c for c in wanted if c in names]
+
+
+def count_rows(path: ParquetSource) -> int:
+    """Число строк по метаданным (без чтения данных)."""
+    if _is_single_file(path):
+        return pq.ParquetFile(path).metadata.num_rows
+    return _dataset(path).count_rows()
+
+
+def unique_values(path: ParquetSource, column: str) -> pd.Series:
+    """Уникальные значения одной колонки (читается только она)."""
+    table = _dataset(path).to_table(columns=[column])
+    return pc.unique(table.column(column)).to_pandas()
+
+
+def isin_filter(path: ParquetSource, keys: Dict[str, Iterable]) -> pc.Expression:
+    """
+    Фильтр для pyarrow.dataset: column IN values, условия по разным колонкам через OR.
+    Значения приводятся к типу колонки в файле; если ничего не задано - пустой результат.
+    """
+    file_schema = schema(path)
+    expr = None
+    for column, values in keys.items():
+        values = list(values)
+        if column not in file_schema.names or not values:
+            continue
+        cond = pc.field(column).isin(pa.array(values, type=file_schema.field(column).type))
+        expr = cond if expr is None else (expr | cond)
+    return expr if expr is not None else pc.scalar(False)
+
+
+def newer_than_filter(path: ParquetSource, column: str, moment: Optional[datetime],
+                      inclusive: bool = False) -> Optional[pc.Expression]:
+    """
+    Фильтр column > moment (или >= при inclusive) с учетом типа колонки:
+    строки Метрики "YYYY-MM-DD HH:MM:SS" (время в UTC) сравниваются лексикографически,
+    timestamp-колонки - как время. None, если moment не задан или колонки нет.
+    """
+    file_schema = schema(path)
+    if moment is None or column not in file_schema.names:
+        return None
+    field_type = file_schema.field(column).type
+    moment_utc = moment.astimezone(timezone.utc)
+    if pa.types.is_timestamp(field_type):
+        if field_type.tz is None:
+            moment_utc = moment_utc.replace(tzinfo=None)
+        value = pa.scalar(moment_utc, type=field_type)
+    else:
+        value = pa.scalar(moment_utc.strftime('%Y-%m-%d %H:%M:%S'), type=field_type)
+    field = pc.field(column)
+    return field >= value if inclusive else field > value
+
+
+def combine_filters(*filters: Optional[pc.Expression]) -> Optional[pc.Expression]:
+    """AND для фильтров, None пропускаются."""
+    result = None
+    for expr in filters:
+        if expr is None:
+            continue
+        result = expr if result is None else (result & expr)
+    return result
+
+
+def iter_frames(path: ParquetSource, columns: Optional[Sequence[str]] = None,
+                batch_rows: int = DEFAULT_BATCH_ROWS,
+                filter: Optional[pc.Expression] = None) -> Iterator[pd.DataFrame]:
+    """
+    Отдает данные по частям в виде pandas DataFrame не длиннее batch_rows строк.
+    С filter строки отбираются внутри pyarrow (row group'ы без совпадений
+    отсекаются по статистике) и до pandas не доходят.
+    """
+    columns = list(columns) if columns else None
+    if filter is None and _is_single_file(path):
+        batches = pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=columns)
+    else:
+        batches = _dataset(path).to_batches(columns=columns, filter=filter, batch_size=batch_rows)
+    for batch in batches:
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+__all__ = [
+    'DEFAULT_BATCH_ROWS',
+    'schema',
+    'parquet_files',
+    'file_signature',
+    'available_columns',
+    'count_rows',
+    'unique_values',
+    'isin_filter',
+    'newer_than_filter',
+    'combine_filters',
+    'iter_frames',
+]
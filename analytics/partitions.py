@@ -0,0 +1,119 @@
+"""
+Секционирование сырых таблиц по версии (только PostgreSQL).
+analytics_visitsession и analytics_pagehit - LIST-секционированные по version_id таблицы:
+у каждой версии своя секция <таблица>_v<id>, плюс секция DEFAULT для строк версий,
+секции которых еще не созданы. Запросы одной версии читают только ее секцию,
+--clear удаляет секцию целиком, а vacuum и перестройка индексов остаются локальными.
+На остальных СУБД функции ничего не делают.
+"""
+from typing import Dict, List
+
+from django.db import connection, transaction
+
+# Порядок важен при удалении: сначала хиты, потом сессии
+PARTITIONED_TABLES = ('analytics_pagehit', 'analytics_visitsession')
+PARTITION_KEY = 'version_id'
+# Ключ advisory-блокировки: DDL секций из параллельных загрузок (ingest_many) выполняется по очереди,
+# иначе CREATE/DROP секций разных версий взаимно блокируют родительские таблицы (deadlock)
+PARTITION_LOCK_KEY = 'analytics_partitions'
+
+
+def supports_partitions(conn=None) -> bool:
+    return (conn or connection).vendor == 'postgresql'
+
+
+def partition_name(table: str, version_id: int) -> str:
+    return f"{table}_v{version_id}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def _exists(cursor, name: str) -> bool:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+    return cursor.fetchone()[0]
+
+
+def is_partitioned(table: str, conn=None) -> bool:
+    conn = conn or connection
+    if not supports_partitions(conn):
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+        return cursor.fetchone() is not None
+
+
+def _lock(cursor):
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [PARTITION_LOCK_KEY])
+
+
+def _create_partition(cursor, table: str, version_id: int):
+    """
+    Создает секцию версии. Строки этой версии, успевшие попасть в DEFAULT-секцию,
+    переносятся в новую (иначе PostgreSQL не даст создать секцию).
+    """
+    qn = connection.ops.quote_name
+    name, default = partition_name(table, version_id), default_partition_name(table)
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {qn(default)} WHERE {PARTITION_KEY} = %s)", [version_id])
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"CREATE TABLE {qn(name)} PARTITION OF {qn(table)} FOR VALUES IN ({int(version_id)})")
+        return
+    cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(default)}")
+    cursor.execute(f"CREATE TABLE {qn(name)} PARTITION OF {qn(table)} FOR VALUES IN ({int(version_id)})")
+    cursor.execute(f"INSERT INTO {qn(name)} SELECT * FROM {qn(default)} WHERE {PARTITION_KEY} = %s", [version_id])
+    cursor.execute(f"DELETE FROM {qn(default)} WHERE {PARTITION_KEY} = %s", [version_id])
+    cursor.execute(f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(default)} DEFAULT")
+
+
+def ensure_version_partitions(version) -> List[str]:
+    """Создает недостающие секции версии. Возвращает имена созданных секций."""
+    created = []
+    if not supports_partitions():
+        return created
+    with transaction.atomic(), connection.cursor() as cursor:
+        _lock(cursor)
+        for table in reversed(PARTITIONED_TABLES):
+            if not is_partitioned(table):
+                continue
+            name = partition_name(table, version.id)
+            if _exists(cursor, name):
+                continue
+            _create_partition(cursor, table, version.id)
+            created.append(name)
+    return created
+
+
+def drop_version_partitions(version) -> Dict[str, int]:
+    """
+    Удаляет секции версии (DROP TABLE вместо построчного DELETE) и чистит ее строки
+    в DEFAULT-секции; пустые секции создаются заново, чтобы версию можно было сразу загрузить.
+    Возвращает {таблица: число удаленных строк}.
+    """
+    qn = connection.ops.quote_name
+    counts = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        _lock(cursor)
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(table):
+                continue
+            removed = 0
+            name = partition_name(table, version.id)
+            if _exists(cursor, name):
+                cursor.execute(f"SELECT count(*) FROM {qn(name)}")
+                removed += cursor.fetchone()[0]
+                cursor.execute(f"DROP TABLE {qn(name)}")
+            cursor.execute(
+                f"DELETE FROM {qn(default_partition_name(table))} WHERE {PARTITION_KEY} = %s", [version.id],
+            )
+            counts[table] = removed + cursor.rowcount
+        for table in reversed(PARTITIONED_TABLES):
+            if is_partitioned(table):
+                _create_partition(cursor, table, version.id)
+    return counts
+
+
+__all__ = [
+    'PARTITIONED_TABLES', 'supports_partitions', 'partition_name', 'default_partition_name', 'is_partitioned',
+    'ensure_version_partitions', 'drop_version_partitions',
+]
@@ -0,0 +1,88 @@
+"""
+Быстрая очистка данных версии (ingest_data --clear).
+ORM .delete() собирает связанные объекты в Python и удаляет каскад построчно;
+здесь каждая таблица очищается одним DELETE по version_id (для жизненного цикла
+проблем - DELETE ... USING на PostgreSQL, подзапрос на остальных СУБД), а сессии
+и хиты на секционированном PostgreSQL - удалением секции версии (см. partitions.py).
+Порядок - от зависимых таблиц к родительским, все в одной транзакции.
+"""
+import time
+from typing import Dict, Tuple
+
+from django.db import connection, transaction
+
+from analytics.models import (
+    DailyStat, FunnelMetrics, IngestWatermark, IssueLifecycle, PageHit, PageMetrics, SessionGoal, UserCohort,
+    UXIssue, VisitSession,
+)
+from analytics.hit_snapshot import drop_snapshot
+from analytics.partitions import PARTITIONED_TABLES, drop_version_partitions, is_partitioned
+
+# Таблицы с прямым version_id, в порядке удаления (после зависимых от них)
+VERSION_TABLES = (UXIssue, PageMetrics, UserCohort, DailyStat, FunnelMetrics)
+
+
+def _table(model) -> str:
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _column(model, name: str) -> str:
+    return connection.ops.quote_name(model._meta.get_field(name).column)
+
+
+def _delete_by_version(cursor, model, version_id: int) -> int:
+    cursor.execute(f"DELETE FROM {_table(model)} WHERE {_column(model, 'version')} = %s", [version_id])
+    return cursor.rowcount
+
+
+def _delete_joined(cursor, model, fk: str, parent, version_id: int) -> int:
+    """DELETE строк model, чей fk указывает на строку parent с version_id."""
+    table, parent_table = _table(model), _table(parent)
+    fk_col, parent_version = _column(model, fk), _column(parent, 'version')
+    if connection.vendor == 'postgresql':
+        cursor.execute(
+            f"DELETE FROM {table} AS child USING {parent_table} AS parent "
+            f"WHERE child.{fk_col} = parent.id AND parent.{parent_version} = %s",
+            [version_id],
+        )
+    else:
+        cursor.execute(
+            f"DELETE FROM {table} WHERE {fk_col} IN (SELECT id FROM {parent_table} WHERE {parent_version} = %s)",
+            [version_id],
+        )
+    return cursor.rowcount
+
+
+def purge_version(version, raw_only: bool = False) -> Tuple[Dict[str, int], float]:
+    """
+    Удаляет данные версии set-based запросами. raw_only=True - только сессии и хиты
+    (перезагрузка стадии load). Возвращает ({модель: число строк}, секунды).
+    """
+    started = time.perf_counter()
+    counts: Dict[str, int] = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not raw_only:
+            # Жизненный цикл проблем версии и записи "решена в этой версии"
+            counts['IssueLifecycle'] = _delete_joined(cursor, IssueLifecycle, 'issue', UXIssue, version.id)
+            cursor.execute(
+                f"DELETE FROM {_table(IssueLifecycle)} WHERE {_column(IssueLifecycle, 'version_resolved')} = %s",
+                [version.id],
+            )
+            counts['IssueLifecycle'] += cursor.rowcount
+            for model in VERSION_TABLES:
+                counts[model.__name__] = _delete_by_version(cursor, model, version.id)
+            counts['IngestWatermark'] = _delete_by_version(cursor, IngestWatermark, version.id)
+        # Цели сессий ссылаются на сессии без FK-ограничения - удаление секции их не затронет
+        counts['SessionGoal'] = _delete_by_version(cursor, SessionGoal, version.id)
+        if all(is_partitioned(table) for table in PARTITIONED_TABLES):
+            dropped = drop_version_partitions(version)
+            counts['PageHit'] = dropped[PageHit._meta.db_table]
+            counts['VisitSession'] = dropped[VisitSession._meta.db_table]
+        else:
+            counts['PageHit'] = _delete_by_version(cursor, PageHit, version.id)
+            counts['VisitSession'] = _delete_by_version(cursor, VisitSession, version.id)
+    drop_snapshot(version.id)
+    return counts, time.perf_counter() - started
+
+
+__all__ = ['VERSION_TABLES', 'purge_version']
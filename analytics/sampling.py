@@ -0,0 +1,89 @@
+"""
+Детерминированная выборка для INGEST_SAMPLE_LIMIT.
+Клиенты упорядочиваются по стабильному хешу нормализованного clientID и берутся
+"снизу", пока число их визитов не достигнет лимита. Один и тот же файл всегда дает
+одну и ту же выборку, а выбранные clientID/counterUserIDHash превращаются в фильтры
+pyarrow - строки остальных клиентов не читаются ни в визитах, ни в хитах.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+
+from analytics.ingest_utils import build_key_index, canonicalize_keys, normalize_client_ids
+from analytics.parquet_stream import available_columns, isin_filter, unique_values
+
+# Фиксированный ключ: хеш не зависит от PYTHONHASHSEED и процесса
+_HASH_KEY = 'ux-sample-client'  # 16 байт - требование hash_pandas_object
+
+
+def client_hash(client_ids: pd.Series) -> np.ndarray:
+    """Стабильный uint64-хеш строковых client id."""
+    return pd.util.hash_pandas_object(client_ids.astype(str), index=False, hash_key=_HASH_KEY).to_numpy()
+
+
+def sample_clients(client_ids: pd.Series, limit: int) -> set:
+    """
+    Клиенты с наименьшим хешем, суммарно дающие не больше limit визитов
+    (но хотя бы один клиент).
+    """
+    counts = client_ids.value_counts(sort=False)
+    order = np.argsort(client_hash(counts.index.to_series()), kind='stable')
+    cumulative = counts.to_numpy()[order].cumsum()
+    take = max(1, int(np.searchsorted(cumulative, limit, side='right')))
+    return set(counts.index[order[:take]])
+
+
+def _raw_matching(path: str, column: str, wanted: set, key_index=None) -> list:
+    """
+    Сырые значения колонки (в типе файла), чьи нормализованные ключи попали в wanted.
+    key_index подтягивает float-ключи хитов к точным ключам визитов.
+    """
+    if not wanted or column not in available_columns(path, [column]):
+        return []
+    raw = unique_values(path, column).dropna()
+    keys = normalize_client_ids(raw)
+    if key_index is not None:
+        keys = canonicalize_keys(keys, key_index)
+    return raw[keys.isin(wanted).to_numpy()].tolist()
+
+
+def build_sample_filters(visits_path: str, hits_path: str,
+                         limit: int) -> Optional[Tuple[pc.Expression, pc.Expression, int, int]]:
+    """
+    Готовит фильтры визитов и хитов для выборки из limit визитов.
+    Возвращает (фильтр визитов, фильтр хитов, визитов в выборке, визитов всего)
+    или None, если визитов и так не больше limit.
+    Читаются только ключевые колонки (clientID, counterUserIDHash).
+    """
+    key_columns = available_columns(visits_path, ['ym:s:clientID', 'ym:s:counterUserIDHash'])
+    visits = pd.read_parquet(visits_path, columns=key_columns)
+    visits['client_id_norm'] = normalize_client_ids(visits['ym:s:clientID'])
+    visits = visits[visits['client_id_norm'].notna()]
+    if len(visits) <= limit:
+        return None
+
+    clients = sample_clients(visits['client_id_norm'], limit)
+    selected = visits[visits['client_id_norm'].isin(clients)]
+    hashes = pd.Series(dtype='Int64')
+    if 'ym:s:counterUserIDHash' in selected.columns:
+        hashes = normalize_client_ids(selected['ym:s:counterUserIDHash']).dropna()
+
+    visits_filter = isin_filter(visits_path, {
+        'ym:s:clientID': _raw_matching(visits_path, 'ym:s:clientID', clients),
+    })
+    hits_filter = isin_filter(hits_path, {
+        'ym:pv:clientID': _raw_matching(
+            hits_path, 'ym:pv:clientID', clients, build_key_index(visits['client_id_norm']),
+        ),
+        'ym:pv:counterUserIDHash': _raw_matching(
+            hits_path, 'ym:pv:counterUserIDHash', set(hashes.tolist()),
+            build_key_index(normalize_client_ids(visits['ym:s:counterUserIDHash']))
+            if 'ym:s:counterUserIDHash' in visits.columns else None,
+        ),
+    })
+    return visits_filter, hits_filter, len(selected), len(visits)
+
+
+__all__ = ['client_hash', 'sample_clients', 'build_sample_filters']
@@ -0,0 +1,73 @@
+"""
+Цели сессий в отдельной таблице SessionGoal (сессия, goal_id).
+Строки разворачиваются из VisitSession.goals_id одним INSERT ... SELECT на стороне БД
+(jsonb_array_elements_text на PostgreSQL, json_each на SQLite) сразу после загрузки визитов.
+Воронки и когорты спрашивают "какие сессии/клиенты достигли цели X" через индекс
+(version, goal_id, session), не читая и не разбирая goals_id каждой сессии.
+"""
+from typing import Dict, Iterable, Optional, Set
+
+from django.db import connection
+
+from analytics.models import SessionGoal, VisitSession
+
+
+def populate_session_goals(version=None, since_session_id: Optional[int] = None) -> int:
+    """
+    Добавляет строки SessionGoal для сессий версии (version=None - для всех версий).
+    since_session_id - только сессии с id больше него (--append). Уже существующие пары пропускаются.
+    Возвращает число добавленных строк.
+    """
+    qn = connection.ops.quote_name
+    goals_table, sessions_table = qn(SessionGoal._meta.db_table), qn(VisitSession._meta.db_table)
+    conditions, params = [], []
+    if version is not None:
+        conditions.append("vs.version_id = %s")
+        params.append(version.id)
+    if since_session_id is not None:
+        conditions.append("vs.id > %s")
+        params.append(since_session_id)
+    where = "".join(f" AND {condition}" for condition in conditions)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"INSERT INTO {goals_table} (session_id, version_id, goal_id) "
+                f"SELECT DISTINCT vs.id, vs.version_id, g.value::bigint FROM {sessions_table} vs "
+                f"CROSS JOIN LATERAL jsonb_array_elements_text("
+                f"CASE WHEN jsonb_typeof(vs.goals_id) = 'array' THEN vs.goals_id ELSE '[]'::jsonb END"
+                f") AS g(value) WHERE TRUE{where} ON CONFLICT DO NOTHING",
+                params,
+            )
+        else:
+            cursor.execute(
+                f"INSERT OR IGNORE INTO {goals_table} (session_id, version_id, goal_id) "
+                f"SELECT vs.id, vs.version_id, CAST(g.value AS INTEGER) FROM {sessions_table} vs, json_each(vs.goals_id) g "
+                f"WHERE json_type(vs.goals_id) = 'array'{where}",
+                params,
+            )
+        return cursor.rowcount
+
+
+def sessions_by_goal(version, goal_ids: Iterable[int]) -> Dict[int, Set[int]]:
+    """{goal_id: id сессий версии, достигших цели} одним запросом по индексу."""
+    goal_ids = {int(goal_id) for goal_id in goal_ids}
+    result: Dict[int, Set[int]] = {goal_id: set() for goal_id in goal_ids}
+    if not goal_ids:
+        return result
+    rows = SessionGoal.objects.filter(version=version, goal_id__in=goal_ids).values_list('goal_id', 'session_id')
+    for goal_id, session_id in rows:
+        result[goal_id].add(session_id)
+    return result
+
+
+def clients_with_goal(version, goal_id: int) -> Set[int]:
+    """client_id клиентов версии, хотя бы в одной сессии достигших цели."""
+    return set(
+        VisitSession.objects.filter(
+            version=version, id__in=SessionGoal.objects.filter(version=version, goal_id=goal_id).values('session_id'),
+        ).values_list('client_id', flat=True).distinct()
+    )
+
+
+__all__ = ['populate_session_goals', 'sessions_by_goal', 'clients_with_goal']
@@ -0,0 +1,84 @@
+"""
+Справочник URL (модель Url): хиты хранят целочисленный url_id вместо строки до 500 символов.
+Строки URL превращаются в id при загрузке батча: новые адреса добавляются одним bulk_create
+вместе с каноническими формами (issue_url, discovery_url, name), поэтому детекторы, пути
+и воронки берут готовые формы и группируют по целым числам.
+"""
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+
+from analytics.funnel_discovery import normalize_url_for_discovery
+from analytics.models import Url
+from analytics.utils import get_readable_page_name, normalize_issue_url
+
+NAME_MAX_LENGTH = Url._meta.get_field('name').max_length
+# Размер IN (...) при поиске по raw: SQLite ограничивает число параметров запроса
+LOOKUP_CHUNK = 1000
+
+# raw -> id. Справочник только пополняется (purge_version его не трогает), поэтому кэш процесса не устаревает
+_url_ids: Dict[str, int] = {}
+
+
+def canonical_forms(raw: str) -> Dict[str, str]:
+    """Канонические формы URL для полей Url."""
+    return {
+        'issue_url': normalize_issue_url(raw),
+        'discovery_url': normalize_url_for_discovery(raw),
+        'name': get_readable_page_name(raw)[:NAME_MAX_LENGTH],
+    }
+
+
+def _lookup(raws: List[str], *fields) -> list:
+    rows = []
+    for start in range(0, len(raws), LOOKUP_CHUNK):
+        rows.extend(Url.objects.filter(raw__in=raws[start:start + LOOKUP_CHUNK]).values_list('raw', *fields))
+    return rows
+
+
+def intern_urls(raws: Iterable[str]) -> Dict[str, int]:
+    """
+    {raw: id} для всех raws; отсутствующие в справочнике URL добавляются.
+    Параллельные писатели не мешают друг другу: вставка с ignore_conflicts, id перечитываются.
+    """
+    wanted = set(raws)
+    missing = [raw for raw in wanted if raw not in _url_ids]
+    if missing:
+        found = dict(_lookup(missing, 'id'))
+        new = [raw for raw in missing if raw not in found]
+        if new:
+            Url.objects.bulk_create(
+                [Url(raw=raw, **canonical_forms(raw)) for raw in new], batch_size=LOOKUP_CHUNK, ignore_conflicts=True,
+            )
+            found.update(_lookup(new, 'id'))
+        if connection.in_atomic_block:
+            # Транзакция еще может откатиться - новые id в кэш процесса не кладем
+            return {raw: _url_ids.get(raw) or found[raw] for raw in wanted}
+        _url_ids.update(found)
+    return {raw: _url_ids[raw] for raw in wanted}
+
+
+def url_ids(values) -> np.ndarray:
+    """Колонка строк URL -> массив id справочника (int64), по одному обращению на уникальный URL."""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    mapping = intern_urls(uniques.tolist())
+    ids = np.array([mapping[raw] for raw in uniques], dtype=np.int64)
+    return ids[codes]
+
+
+def issue_urls(values: pd.Series) -> pd.Series:
+    """
+    Колонка сырых URL -> normalize_issue_url: формы известных адресов берутся из справочника,
+    остальные (например, ym:s:startURL без хитов) считаются один раз на уникальное значение.
+    """
+    uniques = [raw for raw in values.dropna().unique().tolist() if isinstance(raw, str)]
+    forms = dict(_lookup(uniques, 'issue_url'))
+    for raw in uniques:
+        if raw not in forms:
+            forms[raw] = normalize_issue_url(raw)
+    return values.map(forms).fillna('')
+
+
+__all__ = ['canonical_forms', 'intern_urls', 'url_ids', 'issue_urls']
@@ -87,3 +87,27 @@ def get_readable_page_name(url: str) -> str:
     friendly = segment.replace('-', ' ').replace('_', ' ').strip()
     # Title-case words, but keep digits as-is
     return friendly.title() or path
+
+
+NOISY_QUERY_PARAMS = ['referer', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term', 'yclid', '_openstat', 'from', 'ref']
+
+
+def normalize_issue_url(raw_url: str) -> str:
+    """
+    Нормализация URL для дедупликации: убираем utm/referer/trailing slash.
+    Одна и та же страница не должна давать разные проблемы из-за query-параметров или схемы.
+    Для хитов уже посчитана заранее (Url.issue_url).
+    """
+    if not isinstance(raw_url, str):
+        return ""
+    parsed = urllib.parse.urlparse(raw_url.strip())
+    netloc = parsed.netloc.lower()
+    path = (parsed.path or "/").rstrip("/") or "/"
+    query_dict = urllib.parse.parse_qs(parsed.query, keep_blank_values=False)
+    for noisy in NOISY_QUERY_PARAMS:
+        query_dict.pop(noisy, None)
+    clean_query = urllib.parse.urlencode({k: v[0] if len(v) == 1 else v for k, v in query_dict.items()}, doseq=True)
+    scheme = parsed.scheme.lower() if parsed.scheme else ("https" if netloc else "")
+    if netloc or scheme:
+        return urllib.parse.urlunparse((scheme, netloc, path, '', clean_query, ''))
+    return path + (f"?{clean_query}" if clean_query else "")
@@ -2,6 +2,8 @@ from .views_helpers import (
     _normalize_issue_url,
     _device_label,
     _compute_paths,
+    _visit_stats,
+    _visit_split,
     _device_split_compare,
     _agent_split_compare,
     _build_alerts_dashboard,
@@ -30,6 +32,8 @@ __all__ = [
     "_normalize_issue_url",
     "_device_label",
     "_compute_paths",
+    "_visit_stats",
+    "_visit_split",
     "_device_split_compare",
     "_agent_split_compare",
     "_build_alerts_dashboard",
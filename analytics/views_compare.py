@@ -1,9 +1,8 @@
 from django.shortcuts import render
 from django.http import JsonResponse
-from django.db.models import Avg, Count, IntegerField
-from django.db.models.functions import Cast
-from .models import ProductVersion, VisitSession
+from .models import ProductVersion
 from .views_helpers import (
+    _visit_stats,
     _build_comparison,
     _device_split_compare,
     _agent_split_compare,
@@ -11,9 +10,6 @@ from .views_helpers import (
     _build_alerts_compare,
 )
 from .ai_service import analyze_version_comparison_with_ai
-from django.db.models import Avg, Count, IntegerField
-from django.db.models.functions import Cast
-from .ai_service import analyze_version_comparison_with_ai
 
 
 def compare_versions(request):
@@ -57,16 +53,8 @@ def compare_versions(request):
             
             # Генерируем AI-анализ
             try:
-                stats_v1_for_ai = VisitSession.objects.filter(version=v1).aggregate(
-                    visits=Count('id'),
-                    bounce=Avg(Cast('bounced', output_field=IntegerField())),
-                    duration=Avg('duration_sec'),
-                )
-                stats_v2_for_ai = VisitSession.objects.filter(version=v2).aggregate(
-                    visits=Count('id'),
-                    bounce=Avg(Cast('bounced', output_field=IntegerField())),
-                    duration=Avg('duration_sec'),
-                )
+                stats_v1_for_ai = _visit_stats(v1)
+                stats_v2_for_ai = _visit_stats(v2)
                 
                 ai_result = analyze_version_comparison_with_ai(
                     v1_name=v1.name,
@@ -122,16 +110,8 @@ def api_compare(request):
     except ProductVersion.DoesNotExist:
         return JsonResponse({'error': 'Invalid version id'}, status=404)
 
-    stats_v1 = VisitSession.objects.filter(version=v1).aggregate(
-        visits=Count('id'),
-        bounce=Avg(Cast('bounced', output_field=IntegerField())),
-        duration=Avg('duration_sec'),
-    )
-    stats_v2 = VisitSession.objects.filter(version=v2).aggregate(
-        visits=Count('id'),
-        bounce=Avg(Cast('bounced', output_field=IntegerField())),
-        duration=Avg('duration_sec'),
-    )
+    stats_v1 = _visit_stats(v1)
+    stats_v2 = _visit_stats(v2)
 
     v1_bounce = (stats_v1['bounce'] or 0) * 100
     v2_bounce = (stats_v2['bounce'] or 0) * 100
@@ -1,10 +1,10 @@
 from django.shortcuts import render
-from django.db.models import Avg, Count, IntegerField
-from django.db.models.functions import Cast
-from .models import ProductVersion, VisitSession, UXIssue
+from .models import ProductVersion, UXIssue
 from .utils import get_readable_page_name
 from .views_helpers import (
     _device_label,
+    _visit_stats,
+    _visit_split,
     _build_alerts_dashboard,
     get_trend_label,
 )
@@ -17,23 +17,14 @@ def dashboard(request):
     # Get stats for each version
     version_stats = []
     for version in versions:
-        stats = VisitSession.objects.filter(version=version).aggregate(
-            total_visits=Count('id'),
-            avg_duration=Avg('duration_sec'),
-            # Postgres requires explicit cast for boolean averaging
-            bounce_rate=Avg(Cast('bounced', output_field=IntegerField()))
-        )
+        stats = _visit_stats(version)
 
         issue_count = UXIssue.objects.filter(version=version).count()
         critical_issues = UXIssue.objects.filter(version=version, severity='CRITICAL').count()
 
         # Device split
-        by_device = VisitSession.objects.filter(version=version).values('device_category').annotate(
-            visits=Count('id'),
-            bounce=Avg(Cast('bounced', output_field=IntegerField())),
-            duration=Avg('duration_sec')
-        )
-        total_visits = stats['total_visits'] or 0
+        by_device = _visit_split(version, 'device_category')
+        total_visits = stats['visits'] or 0
         devices = []
         for row in by_device:
             share = (row['visits'] / total_visits * 100) if total_visits else 0
@@ -47,11 +38,7 @@ def dashboard(request):
             })
 
         # Browser split (top-5)
-        by_browser = VisitSession.objects.filter(version=version).values('browser').annotate(
-            visits=Count('id'),
-            bounce=Avg(Cast('bounced', output_field=IntegerField())),
-            duration=Avg('duration_sec')
-        ).order_by('-visits')[:5]
+        by_browser = _visit_split(version, 'browser', limit=5)
         browsers = []
         for row in by_browser:
             share = (row['visits'] / total_visits * 100) if total_visits else 0
@@ -67,9 +54,9 @@ def dashboard(request):
 
         version_stats.append({
             'version': version,
-            'total_visits': stats['total_visits'] or 0,
-            'avg_duration': round(stats['avg_duration'] or 0, 1),
-            'bounce_rate': round((stats['bounce_rate'] or 0) * 100, 1),
+            'total_visits': stats['visits'] or 0,
+            'avg_duration': round(stats['duration'] or 0, 1),
+            'bounce_rate': round((stats['bounce'] or 0) * 100, 1),
             'issue_count': issue_count,
             'critical_issues': critical_issues,
             'device_split': devices,
@@ -100,21 +87,13 @@ def api_dashboard(request):
 
     version_stats = []
     for version in versions:
-        stats = VisitSession.objects.filter(version=version).aggregate(
-            total_visits=Count('id'),
-            avg_duration=Avg('duration_sec'),
-            bounce_rate=Avg(Cast('bounced', output_field=IntegerField())),
-        )
+        stats = _visit_stats(version)
         issue_count = UXIssue.objects.filter(version=version).count()
         critical_issues = UXIssue.objects.filter(version=version, severity='CRITICAL').count()
 
         # Разрез по устройствам
-        by_device = VisitSession.objects.filter(version=version).values('device_category').annotate(
-            visits=Count('id'),
-            bounce=Avg(Cast('bounced', output_field=IntegerField())),
-            duration=Avg('duration_sec')
-        )
-        total_visits = stats['total_visits'] or 0
+        by_device = _visit_split(version, 'device_category')
+        total_visits = stats['visits'] or 0
         devices = []
         for row in by_device:
             share = (row['visits'] / total_visits * 100) if total_visits else 0
@@ -128,11 +107,7 @@ def api_dashboard(request):
             })
 
         # Разрез по браузерам (топ-5)
-        by_browser = VisitSession.objects.filter(version=version).values('browser').annotate(
-            visits=Count('id'),
-            bounce=Avg(Cast('bounced', output_field=IntegerField())),
-            duration=Avg('duration_sec')
-        ).order_by('-visits')[:5]
+        by_browser = _visit_split(version, 'browser', limit=5)
         browsers = []
         for row in by_browser:
             share = (row['visits'] / total_visits * 100) if total_visits else 0
@@ -148,9 +123,9 @@ def api_dashboard(request):
             'id': version.id,
             'name': version.name,
             'release_date': version.release_date.isoformat(),
-            'total_visits': stats['total_visits'] or 0,
-            'avg_duration': round(stats['avg_duration'] or 0, 1),
-            'bounce_rate': round((stats['bounce_rate'] or 0) * 100, 1),
+            'total_visits': stats['visits'] or 0,
+            'avg_duration': round(stats['duration'] or 0, 1),
+            'bounce_rate': round((stats['bounce'] or 0) * 100, 1),
             'issue_count': issue_count,
             'critical_issues': critical_issues,
             'device_split': devices,
@@ -1,10 +1,12 @@
-import urllib.parse
 import math
 from django.db import models
 from django.db.models import Avg, Count, IntegerField, Q
 from django.db.models.functions import Cast
 from .models import VisitSession, UXIssue, UserCohort, PageMetrics, PageHit
-from .utils import get_readable_page_name
+from .utils import get_readable_page_name, normalize_issue_url
+from .hit_snapshot import column, read_hits, url_values
+from .page_index import PageMetricsIndex
+from . import olap
 
 
 def _normalize_issue_url(raw_url: str) -> str:
@@ -12,19 +14,7 @@ def _normalize_issue_url(raw_url: str) -> str:
     Нормализация URL для дедупликации: убираем utm/referer/trailing slash.
     Повторяет логику ingest, чтобы корректно сравнивать между версиями.
     """
-    if not isinstance(raw_url, str):
-        return ""
-    parsed = urllib.parse.urlparse(raw_url.strip())
-    netloc = parsed.netloc.lower()
-    path = (parsed.path or "/").rstrip("/") or "/"
-    query_dict = urllib.parse.parse_qs(parsed.query, keep_blank_values=False)
-    for noisy in ['referer', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term', 'yclid', '_openstat', 'from', 'ref']:
-        query_dict.pop(noisy, None)
-    clean_query = urllib.parse.urlencode({k: v[0] if len(v) == 1 else v for k, v in query_dict.items()}, doseq=True)
-    scheme = parsed.scheme.lower() if parsed.scheme else ("https" if netloc else "")
-    if netloc or scheme:
-        return urllib.parse.urlunparse((scheme, netloc, path, '', clean_query, ''))
-    return path + (f"?{clean_query}" if clean_query else "")
+    return normalize_issue_url(raw_url)
 
 
 def _device_label(raw):
@@ -46,11 +36,19 @@ def _compute_paths(version_id, limit=20, min_count=5):
     """
     Возвращает топ путей (2-3 шага) для версии: path, steps, count, unique_users.
     """
-    hits = PageHit.objects.filter(session__version_id=version_id).order_by(
-        'session_id', 'timestamp'
-    ).values(
-        'session_id', 'url'
-    )
+    snapshot = read_hits(version_id, ['session_id', 'url_id'])
+    if snapshot is not None:
+        # Колоночный снимок уже отсортирован по (session_id, timestamp, id)
+        url_ids = column(snapshot, 'url_id')
+        issue_urls = url_values(url_ids, 'issue_url')
+        hits = zip(column(snapshot, 'session_id').tolist(), [issue_urls.get(url_id) for url_id in url_ids.tolist()])
+    else:
+        # id - порядок загрузки для хитов с одинаковым временем (иначе пути зависят от плана запроса)
+        hits = PageHit.objects.filter(version_id=version_id).order_by(
+            'session_id', 'timestamp', 'id'
+        ).values_list(
+            'session_id', 'url__issue_url'
+        )
     path_counts = {}
     path_sessions = {}
     current_session = None
@@ -65,14 +63,12 @@ def _compute_paths(version_id, limit=20, min_count=5):
             path_sessions[path] = set()
         path_sessions[path].add(session_key)
 
-    for row in hits:
-        sid = row.get('session_id')
+    for sid, url_norm in hits:  # url_norm нормализован заранее (справочник Url)
         if sid is None:
             continue
         if sid != current_session:
             buffer = []
             current_session = sid
-        url_norm = _normalize_issue_url(row['url'])
         if not url_norm:
             continue
         # Пропускаем подряд дубли, чтобы не собирать шум вида A->A->B
@@ -104,18 +100,36 @@ def _compute_paths(version_id, limit=20, min_count=5):
     return results
 
 
+def _visit_stats(version):
+    """Агрегаты визитов версии: visits, bounce (доля), bounce_count, duration (DuckDB или ORM, см. olap.py)."""
+    stats = olap.visit_stats(version)
+    if stats is None:
+        stats = VisitSession.objects.filter(version=version).aggregate(
+            visits=Count('id'),
+            bounce=Avg(Cast('bounced', output_field=IntegerField())),
+            bounce_count=Count('id', filter=Q(bounced=True)),
+            duration=Avg('duration_sec')
+        )
+    return stats
+
+
+def _visit_split(version, field, limit=None):
+    """Разрез визитов по field: строки {field, visits, bounce, duration} по убыванию visits; limit - топ."""
+    rows = olap.visit_split(version, field, limit)
+    if rows is None:
+        qs = VisitSession.objects.filter(version=version).values(field).annotate(
+            visits=Count('id'),
+            bounce=Avg(Cast('bounced', output_field=IntegerField())),
+            duration=Avg('duration_sec')
+        ).order_by('-visits', field)
+        rows = list(qs[:limit] if limit else qs)
+    return rows
+
+
 def _device_split_compare(v1, v2, stats_v1, stats_v2):
     """Возвращает сравнение по устройствам для двух версий."""
-    dev_v1 = VisitSession.objects.filter(version=v1).values('device_category').annotate(
-        visits=Count('id'),
-        bounce=Avg(Cast('bounced', output_field=IntegerField())),
-        duration=Avg('duration_sec')
-    )
-    dev_v2 = VisitSession.objects.filter(version=v2).values('device_category').annotate(
-        visits=Count('id'),
-        bounce=Avg(Cast('bounced', output_field=IntegerField())),
-        duration=Avg('duration_sec')
-    )
+    dev_v1 = _visit_split(v1, 'device_category')
+    dev_v2 = _visit_split(v2, 'device_category')
     total1 = stats_v1['visits'] or 0
     total2 = stats_v2['visits'] or 0
     dev_map = {}
@@ -159,16 +173,8 @@ def _device_split_compare(v1, v2, stats_v1, stats_v2):
 
 def _agent_split_compare(v1, v2, stats_v1, stats_v2, field):
     """Сравнение по браузерам/OS (field='browser' или 'os') с дельтами (топ-5 по трафику)."""
-    qs1 = VisitSession.objects.filter(version=v1).values(field).annotate(
-        visits=Count('id'),
-        bounce=Avg(Cast('bounced', output_field=IntegerField())),
-        duration=Avg('duration_sec')
-    ).order_by('-visits')[:5]
-    qs2 = VisitSession.objects.filter(version=v2).values(field).annotate(
-        visits=Count('id'),
-        bounce=Avg(Cast('bounced', output_field=IntegerField())),
-        duration=Avg('duration_sec')
-    ).order_by('-visits')[:5]
+    qs1 = _visit_split(v1, field, limit=5)
+    qs2 = _visit_split(v2, field, limit=5)
     total1 = stats_v1['visits'] or 0
     total2 = stats_v2['visits'] or 0
     mp = {}
@@ -274,18 +280,8 @@ def _build_comparison(v1, v2):
     """
     Подготовка структуры сравнения для UI и API, чтобы не дублировать логику.
     """
-    stats_v1 = VisitSession.objects.filter(version=v1).aggregate(
-        visits=Count('id'),
-        bounce=Avg(Cast('bounced', output_field=IntegerField())),
-        bounce_count=Count('id', filter=Q(bounced=True)),
-        duration=Avg('duration_sec')
-    )
-    stats_v2 = VisitSession.objects.filter(version=v2).aggregate(
-        visits=Count('id'),
-        bounce=Avg(Cast('bounced', output_field=IntegerField())),
-        bounce_count=Count('id', filter=Q(bounced=True)),
-        duration=Avg('duration_sec')
-    )
+    stats_v1 = _visit_stats(v1)
+    stats_v2 = _visit_stats(v2)
 
     v1_visits = stats_v1['visits'] or 0
     v2_visits = stats_v2['visits'] or 0
@@ -343,8 +339,9 @@ def _build_comparison(v1, v2):
             })
     issues_diff = sorted(issues_diff, key=lambda x: (-abs(x['impact_diff']), x['issue'].severity))
 
-    pages_v1 = {_normalize_issue_url(m.url): m for m in PageMetrics.objects.filter(version=v1)}
-    pages_v2 = {_normalize_issue_url(m.url): m for m in PageMetrics.objects.filter(version=v2)}
+    # Страницы по канонической форме URL (справочник Url), без нормализации каждой метрики
+    pages_v1 = PageMetricsIndex.load(v1, models=True).by_canonical
+    pages_v2 = PageMetricsIndex.load(v2, models=True).by_canonical
     page_diff = []
     keys = set(pages_v1.keys()) | set(pages_v2.keys())
     for key in keys:
@@ -452,6 +449,8 @@ __all__ = [
     "_normalize_issue_url",
     "_device_label",
     "_compute_paths",
+    "_visit_stats",
+    "_visit_split",
     "_device_split_compare",
     "_agent_split_compare",
     "_build_alerts_dashboard",
@@ -120,6 +120,13 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Колоночные снимки хитов версий (analytics/hit_snapshot.py); пустое значение отключает снимки
+HIT_SNAPSHOT_DIR = os.environ.get('HIT_SNAPSHOT_DIR', str(BASE_DIR / 'snapshots'))
+
+# Движок агрегатов дашборда, сравнения, PageMetrics и воронок (analytics/olap.py):
+# 'orm' - запросы к БД, 'duckdb' - встроенный DuckDB по снимкам версий (нужен пакет duckdb)
+ANALYTICS_ENGINE = os.environ.get('ANALYTICS_ENGINE', 'orm')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -55,13 +55,21 @@ if [ "${AUTO_INGEST:-1}" = "1" ]; then
       fi
     }
 
-    ingest "${INGEST_YEAR_1:-2022}" "${INGEST_VERSION_1:-v1.0 (2022)}" \
-      "${INGEST_VISITS_1:-2022_yandex_metrika_visits.parquet}" \
-      "${INGEST_HITS_1:-2022_yandex_metrika_hits.parquet}"
+    if [ -n "${INGEST_MANIFEST:-}" ] && [ -f "$INGEST_MANIFEST" ]; then
+      # Все версии из манифеста параллельно (по процессу на версию)
+      echo "Ingesting versions from $INGEST_MANIFEST with ${INGEST_WORKERS:-2} workers..."
+      python manage.py ingest_many \
+        --manifest "$INGEST_MANIFEST" \
+        --workers "${INGEST_WORKERS:-2}" || echo "Parallel ingest failed."
+    else
+      ingest "${INGEST_YEAR_1:-2022}" "${INGEST_VERSION_1:-v1.0 (2022)}" \
+        "${INGEST_VISITS_1:-2022_yandex_metrika_visits.parquet}" \
+        "${INGEST_HITS_1:-2022_yandex_metrika_hits.parquet}"
 
-    ingest "${INGEST_YEAR_2:-2024}" "${INGEST_VERSION_2:-v2.0 (2024)}" \
-      "${INGEST_VISITS_2:-2024_yandex_metrika_visits.parquet}" \
-      "${INGEST_HITS_2:-2024_yandex_metrika_hits.parquet}"
+      ingest "${INGEST_YEAR_2:-2024}" "${INGEST_VERSION_2:-v2.0 (2024)}" \
+        "${INGEST_VISITS_2:-2024_yandex_metrika_visits.parquet}" \
+        "${INGEST_HITS_2:-2024_yandex_metrika_hits.parquet}"
+    fi
   fi
 fi
 